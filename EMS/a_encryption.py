@@ -1,19 +1,18 @@
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives import serialization, hashes
-import os
-from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .keypool import get_private_key
+from .metrics import timed
 
 def a_encryption(hash_id,key,t_id):
+    """Wraps the upload's secrets with a fresh RSA key. Returns the ciphertexts and the private key PEM."""
 
     message = [hash_id,key,t_id]
 
-    private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-            backend=default_backend()
-        )
-
+    # Keys come pre-generated from the pool and never touch the disk here.
+    private_key = get_private_key()
     public_key = private_key.public_key()
 
     pem = private_key.private_bytes(
@@ -22,69 +21,46 @@ def a_encryption(hash_id,key,t_id):
             encryption_algorithm=serialization.NoEncryption()
         )
 
-    prk_file = os.path.join(settings.ENCRYPTION_ROOT,t_id+'_private_key.pem')
-
-    with open(prk_file, 'wb') as f:
-        f.write(pem)
-
-    pem = public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        )
-
-    with open('public_key.pem', 'wb') as f:
-        f.write(pem)
+    new_arr = []
 
-    with open(prk_file, "rb") as key_file:
-        private_key = serialization.load_pem_private_key(
-                key_file.read(),
-                password=None,
-                backend=default_backend()
-            )
+    with timed('rsa_wrap'):
+        for i in message:
+            if(isinstance(i, str)):
+                i = i.encode('utf-8')
+            encrypted = public_key.encrypt(
+                    i,
+                    padding.OAEP(
+                        mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                        algorithm=hashes.SHA256(),
+                        label=None
+                    )
+                )
+            new_arr.append(encrypted)
+    return new_arr, pem
 
-    with open("public_key.pem", "rb") as key_file:
-        public_key = serialization.load_pem_public_key(
-            key_file.read(),
-            backend=default_backend()
-        )
-    new_arr = []
+def a_decryption(arr):
+    with timed('rsa_unwrap'):
+        with default_storage.open(arr[1].name) as key_file:
+            private_key = serialization.load_pem_private_key(
+                    key_file.read(),
+                    password=None,
+                    backend=default_backend()
+                )
 
-    for i in message:
-        if(isinstance(i, str)):
-            i = i.encode('utf-8')
-        encrypted = public_key.encrypt(
-                i,
+        key = private_key.decrypt(
+                bytes(arr[0][1]),
                 padding.OAEP(
                     mgf=padding.MGF1(algorithm=hashes.SHA256()),
                     algorithm=hashes.SHA256(),
                     label=None
                 )
             )
-        new_arr.append(encrypted)
-    return new_arr
-
-def a_decryption(arr):
-    with open('media/'+arr[1].name, "rb") as key_file:
-        private_key = serialization.load_pem_private_key(
-                key_file.read(),
-                password=None,
-                backend=default_backend()
-            )
-
-    key = private_key.decrypt(
-            bytes(arr[0][1]),
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
-            )
-        )
-    hash_id = private_key.decrypt(
-            bytes(arr[0][0]),
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
+        hash_id = private_key.decrypt(
+                bytes(arr[0][0]),
+                padding.OAEP(
+                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                    algorithm=hashes.SHA256(),
+                    label=None
+                )
             )
-        )
     return [key,hash_id]
\ No newline at end of file
@@ -16,4 +16,11 @@ class CustomUserAdmin(UserAdmin):
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(Request)
 admin.site.register(SubjectCode)
-admin.site.register(FinalPapers)
\ No newline at end of file
+admin.site.register(FinalPapers)
+admin.site.register(FinalizationJob)
+admin.site.register(ChainEvent)
+admin.site.register(IndexerCursor)
+admin.site.register(ChainOutbox)
+
+admin.site.register(Blob)
+admin.site.register(UploadSession)
\ No newline at end of file
@@ -1,5 +1,27 @@
 from django.apps import AppConfig
+from django.conf import settings
+import os, sys
+
+
+def _serving():
+    """Whether this process serves requests: a WSGI/ASGI server or `manage.py runserver`.
+
+    Other management commands, scripts and `python -c` only set Django up and should not
+    start background work; runserver's autoreloading parent only watches files.
+    """
+    program = os.path.basename(sys.argv[0]) if sys.argv else ''
+    if program in ('manage.py', 'django-admin', '__main__.py'):
+        return sys.argv[1:2] == ['runserver'] and (os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv)
+    return program not in ('', '-c', '-m') and not program.endswith('.py')
 
 
 class EmsConfig(AppConfig):
     name = 'EMS'
+
+    def ready(self):
+        from . import blobstore, metrics, prestaging, refcache
+        blobstore.connect_signals()
+        metrics.connect_signals()
+        refcache.connect_signals()
+        if settings.PRESTAGE_RUN_IN_PROCESS and _serving():
+            prestaging.start_scheduler()
@@ -0,0 +1,218 @@
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.db.models import F
+import hashlib, mmap, os, tempfile
+
+from .models import Blob, FinalPapers, Request
+
+# Every FileField goes through the default storage, which stores a file once per
+# content: the name is the SHA-256 of the bytes, sharded into BLOB_STORE_SHARD_DEPTH
+# directory levels under MEDIA_ROOT/BLOB_STORE_DIR, so a syllabus sent to a hundred
+# teachers is one file. A Blob row counts the FileField values naming each file; saving
+# adds a reference, deleting or replacing drops one, and the file goes with the last. Reads are
+# memory-mapped. Names outside BLOB_STORE_DIR are files from before the store and are
+# handled like the plain FileSystemStorage did.
+
+# Model fields whose values are blob names; recount() and migrate_blobs walk these.
+FILE_FIELDS = ((Request, 'syllabus'), (Request, 'q_pattern'), (Request, 'private_key'), (FinalPapers, 'paper'))
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(settings.BLOB_STORE_DIR + '/')
+
+
+def blob_name(digest, original_name):
+    """'blobs/ab/cd/<sha256>.pdf': the extension is kept so links still open in the right viewer."""
+    shards = [digest[2 * level:2 * level + 2] for level in range(settings.BLOB_STORE_SHARD_DEPTH)]
+    ext = os.path.splitext(original_name or '')[1].lower()
+    return '/'.join([settings.BLOB_STORE_DIR, *shards, digest + ext])
+
+
+class MappedFile(File):
+    """A read-only file backed by an mmap; reads are served from the page cache without copies."""
+
+    def __init__(self, path, name):
+        with open(path, 'rb') as f:
+            self._size = os.fstat(f.fileno()).st_size
+            super().__init__(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), name)
+        self.mode = 'rb'
+
+    @property
+    def size(self):
+        # File.size would return mmap.size, a method, breaking len() and multiple_chunks().
+        return self._size
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        return name  # the real name is the digest, known only once the content is read
+
+    def _save(self, name, content):
+        tmp_dir = self.path(os.path.join(settings.BLOB_STORE_DIR, 'tmp'))
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest, size = hashlib.sha256(), 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks(HASH_CHUNK_SIZE):
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    size += len(chunk)
+                    tmp.write(chunk)
+            name = blob_name(digest.hexdigest(), name)
+            self._add_reference(name, digest.hexdigest(), size, tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return name
+
+    def _add_reference(self, name, sha256, size, tmp_path):
+        # The row lock orders this against a delete() dropping the last reference; taken in
+        # the same step as the lookup, so a row deleted meanwhile is simply created again.
+        with transaction.atomic():
+            blob, _ = Blob.objects.select_for_update().get_or_create(name=name, defaults={'sha256': sha256, 'size': size})
+            path = self.path(name)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.chmod(tmp_path, self.file_permissions_mode or 0o644)
+                os.replace(tmp_path, path)
+            Blob.objects.filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+
+    def _open(self, name, mode='rb'):
+        if mode == 'rb' and is_blob(name):
+            path = self.path(name)
+            if os.path.getsize(path):  # an empty file cannot be mapped
+                return MappedFile(path, name)
+        return super()._open(name, mode)
+
+    def delete(self, name):
+        """Drops one reference to a blob and removes its file with the last one."""
+        if not is_blob(name):
+            return super().delete(name)
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                return
+            if blob.refcount > 1:
+                Blob.objects.filter(pk=blob.pk).update(refcount=F('refcount') - 1)
+                return
+            blob.delete()
+            super().delete(name)
+
+
+# --- Maintenance ---------------------------------------------------------------------
+
+def references():
+    """{blob name: number of FileField values naming it} across FILE_FIELDS."""
+    counts = {}
+    for model, field in FILE_FIELDS:
+        for name in model.objects.filter(**{f'{field}__startswith': settings.BLOB_STORE_DIR + '/'}).values_list(field, flat=True).iterator():
+            counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def recount():
+    """Sets every refcount from the rows that actually name the blob. Returns how many were wrong."""
+    counts = references()
+    wrong = []
+    for blob in Blob.objects.only('id', 'name', 'refcount').iterator():
+        if blob.refcount != counts.get(blob.name, 0):
+            blob.refcount = counts.get(blob.name, 0)
+            wrong.append(blob)
+    Blob.objects.bulk_update(wrong, ['refcount'], batch_size=1000)
+    return len(wrong)
+
+
+def collect_garbage():
+    """Removes blobs no row refers to. Returns the number removed."""
+    removed = 0
+    for name in Blob.objects.filter(refcount__lte=0).values_list('name', flat=True):
+        default_storage.delete(name)
+        removed += 1
+    return removed
+
+
+def migrate_legacy(delete_originals=False, dry_run=False):
+    """Moves files named by FILE_FIELDS from the flat MEDIA_ROOT into the store and renames the rows.
+
+    Returns a summary; refcounts are rebuilt at the end, so rows sharing a file count it once each.
+    """
+    summary = {'files': 0, 'rows': 0, 'missing': [], 'deduplicated': 0, 'bytes_saved': 0}
+    legacy = set()
+    for model, field in FILE_FIELDS:
+        legacy.update(model.objects.exclude(**{f'{field}__startswith': settings.BLOB_STORE_DIR + '/'})
+                      .exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                      .values_list(field, flat=True).distinct())
+    seen = set()
+    for old in sorted(legacy):
+        path = default_storage.path(old)
+        if not os.path.exists(path):
+            summary['missing'].append(old)
+            continue
+        summary['files'] += 1
+        if dry_run:
+            continue
+        with open(path, 'rb') as f:
+            new = default_storage.save(old, File(f))
+        if new in seen:
+            summary['deduplicated'] += 1
+            summary['bytes_saved'] += os.path.getsize(path)
+        seen.add(new)
+        with transaction.atomic():
+            for model, field in FILE_FIELDS:
+                summary['rows'] += model.objects.filter(**{field: old}).update(**{field: new})
+        if delete_originals:
+            os.remove(path)
+    if not dry_run:
+        recount()
+    return summary
+
+
+def _loaded_names(sender, instance):
+    """{field: stored name} for the file fields of instance that are loaded; deferred ones are left out."""
+    names = {}
+    for model, field in FILE_FIELDS:
+        if model is sender and field in instance.__dict__:
+            value = instance.__dict__[field]
+            names[field] = getattr(value, 'name', value)
+    return names
+
+
+def _remember_files(sender, instance, **kwargs):
+    # Read from __dict__ rather than the descriptor so deferred fields are not fetched.
+    instance._blob_names = _loaded_names(sender, instance)
+
+
+def _release_replaced_files(sender, instance, created, **kwargs):
+    names = _loaded_names(sender, instance)
+    if not created:
+        for field, old in getattr(instance, '_blob_names', {}).items():
+            if field in names and names[field] != old and is_blob(old):
+                # The row held one reference to the old blob; re-saving a FileField never dropped it.
+                transaction.on_commit(lambda name=old: default_storage.delete(name))
+    instance._blob_names = names
+
+
+def _release_files(sender, instance, **kwargs):
+    for model, field in FILE_FIELDS:
+        if model is sender:
+            name = getattr(instance, field).name
+            if is_blob(name):
+                # Not before the delete commits: a rollback brings the row back.
+                transaction.on_commit(lambda name=name: default_storage.delete(name))
+
+
+def connect_signals():
+    """Called from EmsConfig.ready(): replacing a file or deleting a Request or FinalPapers row drops its references."""
+    from django.db.models.signals import post_delete, post_init, post_save
+    for model, label in ((Request, 'request'), (FinalPapers, 'finalpapers')):
+        post_init.connect(_remember_files, sender=model, dispatch_uid=f'blobstore_{label}_loaded')
+        post_save.connect(_release_replaced_files, sender=model, dispatch_uid=f'blobstore_{label}_saved')
+        post_delete.connect(_release_files, sender=model, dispatch_uid=f'blobstore_{label}_deleted')
@@ -1,61 +1,41 @@
-import json
-from web3 import Web3
 from django.conf import settings
+import logging
 
-# Connect to Ganache using the URL from settings
-web3 = Web3(Web3.HTTPProvider(settings.BLOCKCHAIN_GANACHE_URL))
-if not web3.is_connected():
-    raise Exception(f"Unable to connect to Ganache at {settings.BLOCKCHAIN_GANACHE_URL}")
+from .metrics import trace_sampled
+from .web3_client import get_client
+from .tx_submitter import get_submitter
 
-# Load the contract ABI and address from settings
-with open(settings.BLOCKCHAIN_ABI_PATH) as f:
-    contract_json = json.load(f)
-    contract_abi = contract_json["abi"]
+logger = logging.getLogger(__name__)
 
-contract_address = settings.BLOCKCHAIN_CONTRACT_ADDRESS
-contract = web3.eth.contract(address=contract_address, abi=contract_abi)
+def paper_id_from_receipt(receipt):
+    """Reads the contract paper id from the PaperUploaded event in an uploadPaper receipt."""
+    from web3.logs import DISCARD
+    events = get_client().contract.events.PaperUploaded().process_receipt(receipt, errors=DISCARD)
+    if not events:
+        raise ValueError(f"No PaperUploaded event in transaction {receipt.transactionHash.hex()}")
+    return events[0]['args']['id']
+
+def submit_paper_upload(ipfs_hash, filename, teacher_id):
+    """Sends an uploadPaper transaction without waiting; the Future resolves to its receipt."""
+    trace_sampled('chain_upload', ipfs_hash=ipfs_hash, filename=filename, teacher_id=teacher_id)
+
+    return get_submitter().submit(get_client().contract.functions.uploadPaper(ipfs_hash, filename, teacher_id))
+
+def submit_download_event(paper_id, filename, superintendent_username):
+    """Sends a recordDownload transaction without waiting; the Future resolves to its receipt."""
+    return get_submitter().submit(get_client().contract.functions.recordDownload(paper_id, filename, superintendent_username))
 
 def record_paper_upload(ipfs_hash, filename, teacher_id):
     """Calls the smart contract function to record paper upload."""
-    account = web3.eth.accounts[0]
-
-    print("DEBUG (blockchain.py): record_paper_upload - Arguments:")
-    print(f"DEBUG (blockchain.py): ipfs_hash: {ipfs_hash}, type: {type(ipfs_hash)}")
-    print(f"DEBUG (blockchain.py): filename: {filename}, type: {type(filename)}")
-    print(f"DEBUG (blockchain.py): teacher_id: {teacher_id}, type: {type(teacher_id)}")
-
-    # Forcefully prefix event signature hash with "0x"
-    paper_uploaded_event_signature_hash = "0x" + web3.keccak(text="PaperUploaded(uint256,string,string,string,uint256)").hex()
-    print(f"DEBUG (blockchain.py): Forcefully prefixed PaperUploaded Event Signature Hash: {paper_uploaded_event_signature_hash}")
-
-    # Build and send transaction with explicit topics (even if not strictly needed)
-    tx_hash = contract.functions.uploadPaper(ipfs_hash, filename, teacher_id).transact({
-        'from': account,
-        'gas': 3000000,
-        'topics': [paper_uploaded_event_signature_hash]  # Include topics explicitly
-    })
-    receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
-    return receipt, contract.functions.paperCount().call() # MODIFIED: Return receipt and paperCount
+    receipt = submit_paper_upload(ipfs_hash, filename, teacher_id).result(timeout=settings.BLOCKCHAIN_RECEIPT_TIMEOUT)
+    return receipt, paper_id_from_receipt(receipt)
 
 def record_paper_download_event(paper_id, filename, superintendent_username):
     """Records paper download event on blockchain."""
     try:
-        account = web3.eth.accounts[0]
-
-        # Forcefully prefix event signature hash with "0x"
-        paper_downloaded_event_signature_hash = "0x" + web3.keccak(text="PaperDownloaded(uint256,uint256,string,string,uint256)").hex()
-        print(f"DEBUG (blockchain.py): Forcefully prefixed PaperDownloaded Event Signature Hash: {paper_downloaded_event_signature_hash}")
-
-        # Build and send transaction with explicit topics (even if not strictly needed)
-        tx_hash = contract.functions.recordDownload(paper_id, filename, superintendent_username).transact({
-            'from': account,
-            'gas': 3000000,
-            'topics': [paper_downloaded_event_signature_hash] # Include topics explicitly
-        })
-
-        receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
+        receipt = submit_download_event(paper_id, filename, superintendent_username).result(timeout=settings.BLOCKCHAIN_RECEIPT_TIMEOUT)
         return receipt.transactionHash.hex()
 
     except Exception as e:
-        print(f"Error recording download event on blockchain: {e}")
-        raise
\ No newline at end of file
+        logger.warning("Recording the download of paper %s on the blockchain failed: %s", paper_id, e)
+        raise
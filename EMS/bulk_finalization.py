@@ -0,0 +1,145 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from django.conf import settings
+from django.core.files import File
+from django.db import connections, transaction
+from django.db.models import Exists, OuterRef
+from types import SimpleNamespace
+import django, logging, multiprocessing, os, time
+
+from .models import Request, SubjectCode, FinalizationJob
+from .a_encryption import a_decryption
+from .encryption import decrypt_file
+from .cid import file_cid
+from .ipfs_client import get_ipfs
+from .jobs import claim_job, finish_job
+from .finalization import FinalizationError, completed, stage, save_final_paper, mark_finalized, remove_plaintext
+
+logger = logging.getLogger(__name__)
+
+# Finalizes every pending request of a subject or term in one run: IPFS calls in a
+# bounded thread pool and decryption in a process pool. The chain records go through
+# the outbox (EMS.outbox), whose worker sends the whole run together, pipelined. Each request still gets its own FinalizationJob, so the
+# usual status endpoint reports its progress. The jobs are created 'Queued' and each is
+# claimed just before it runs: the job workers (EMS.jobs) may take some of them first,
+# and whatever a killed run leaves behind is finished by those workers.
+
+
+def pending_requests(s_code=None, subject=None, exam_from=None, exam_to=None):
+    queryset = Request.objects.filter(status="Pending Finalization").order_by('id')
+    if s_code:
+        queryset = queryset.filter(s_code=s_code)
+    if subject:
+        queryset = queryset.filter(s_code__in=SubjectCode.objects.filter(subject=subject).values('s_code'))
+    if exam_from:
+        queryset = queryset.filter(exam_time__gte=exam_from)
+    if exam_to:
+        queryset = queryset.filter(exam_time__lt=exam_to)
+    return queryset
+
+
+def _row(req, status, job=None, error=''):
+    return {'request_id': req.id, 's_code': req.s_code, 'teacher': req.tusername,
+            'job_id': job.id if job else None, 'status': status, 'error': error}
+
+
+def claim_requests(queryset, username):
+    """Creates a queued job for each request. Returns (claimed [(req, job)], skipped report rows)."""
+    busy = FinalizationJob.objects.filter(request=OuterRef('pk'), status__in=['Queued', 'Running'])
+    claimed, skipped = [], []
+    with transaction.atomic():
+        requests = list(queryset.select_for_update(skip_locked=True, of=('self',)).annotate(busy=Exists(busy)))
+        for req in requests:
+            if req.busy:
+                skipped.append(_row(req, 'Skipped', error="A finalization job is already queued or running."))
+            elif not req.encrypted_file:
+                skipped.append(_row(req, 'Skipped', error="Encrypted file missing for this request."))
+            else:
+                claimed.append(req)
+        jobs = FinalizationJob.objects.bulk_create(
+            FinalizationJob(request=req, requested_by=username) for req in claimed)
+    return list(zip(claimed, jobs)), skipped
+
+
+def decrypt_to_media(file_path, enc_field, private_key_name, output_name):
+    """Process-pool task: decrypts an upload into media/<output_name>.pdf and returns that path."""
+    key = a_decryption([enc_field, SimpleNamespace(name=private_key_name)])[0]
+    with File(open(file_path, 'rb')) as encrypted:
+        with decrypt_file(encrypted, key, output_name) as decrypted:
+            return decrypted.name
+
+
+def _prepare(req, job, cpu_pool):
+    """I/O-pool task: everything up to the saved FinalPapers row. Returns (final_record, hash_id).
+
+    Returns None when a job worker claimed the job first.
+    """
+    decrypted = None
+    try:
+        if not claim_job(job):
+            return None
+        file_path = os.path.join(settings.ENCRYPTION_ROOT, req.encrypted_file)
+        decrypted = cpu_pool.submit(decrypt_to_media, file_path, [bytes(value) for value in req.enc_field],
+                                    req.private_key.name, f"{req.s_code}_{req.id}")
+        ipfs = get_ipfs()
+        with stage(job, 'ipfs_add'):
+            hash_id = ipfs.add(file_path, settings.IPFS_CID_VERSION)["Hash"]
+            expected = req.encrypted_cid or file_cid(file_path, cid_version=settings.IPFS_CID_VERSION)
+            if hash_id != expected:
+                raise FinalizationError(f"IPFS returned CID {hash_id} but the uploaded file has CID {expected}.")
+        if not completed(job, 'ipfs_cp'):
+            with stage(job, 'ipfs_cp'):
+                ipfs.files_cp(f"/ipfs/{hash_id}", f"/papers/{req.encrypted_file}")
+        with stage(job, 'decrypt'):
+            output_path = decrypted.result()
+        with stage(job, 'save_paper'):
+            final_record = save_final_paper(req, File(open(output_path, 'rb')), hash_id)
+        with stage(job, 'finalize_request'):
+            mark_finalized(req)
+        return final_record, hash_id
+    finally:
+        if decrypted is not None:
+            wait([decrypted])  # also when a later stage failed
+            remove_plaintext(f"{req.s_code}_{req.id}")
+        connections.close_all()
+
+
+def run_claimed(claimed, io_workers=None, cpu_workers=None):
+    """Finalizes claimed (request, job) pairs and returns one report row per request."""
+    io_workers = io_workers or settings.BULK_FINALIZATION_IO_WORKERS
+    cpu_workers = cpu_workers or settings.BULK_FINALIZATION_CPU_WORKERS or os.cpu_count()
+    report = []
+    started = time.monotonic()
+    if not claimed:
+        return report
+
+    # spawn: the calling process may have threads of its own, which fork would not copy safely.
+    # The initializer is unpickled before Django is set up, so it must not live in EMS.
+    cpu_pool = ProcessPoolExecutor(min(cpu_workers, len(claimed)), mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=django.setup)
+    with cpu_pool, ThreadPoolExecutor(min(io_workers, len(claimed)), thread_name_prefix='bulk-finalize') as io_pool:
+        futures = [(req, job, io_pool.submit(_prepare, req, job, cpu_pool)) for req, job in claimed]
+        for req, job, future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.exception("Bulk finalization of request %s failed", req.id)
+                finish_job(job, e)
+                report.append(_row(req, 'Failed', job, str(e)))
+            else:
+                if result is None:
+                    report.append(_row(req, 'Skipped', job, "Taken by a finalization worker."))
+                    continue
+                record, hash_id = result
+                finish_job(job)
+                row = _row(req, 'Finalized', job)
+                row.update(paper_id=record.id, ipfs_cid=hash_id)
+                report.append(row)
+
+    logger.info("Bulk finalization of %d request(s) took %.1fs", len(claimed), time.monotonic() - started)
+    return sorted(report, key=lambda row: row['request_id'])
+
+
+def finalize_all(username, **filters):
+    """Claims and finalizes every matching pending request. Returns the report, skipped rows included."""
+    claimed, skipped = claim_requests(pending_requests(**filters), username)
+    return sorted(run_claimed(claimed) + skipped, key=lambda row: row['request_id'])
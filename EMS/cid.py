@@ -0,0 +1,140 @@
+from base64 import b32encode
+import hashlib
+
+# Computes the CID `ipfs add` returns for a file, without a daemon: fixed-size
+# chunking (size-262144), UnixFS file nodes encoded as dag-pb, and the balanced
+# DAG layout with at most 174 links per node. CIDv0 uses dag-pb leaves; CIDv1
+# uses raw leaves, as `ipfs add --cid-version=1` does.
+
+CHUNK_SIZE = 262144
+MAX_LINKS = 174
+
+CODEC_RAW = 0x55
+CODEC_DAG_PB = 0x70
+UNIXFS_FILE = 2
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number, value):
+    """Protobuf field: varint for ints, length-delimited for bytes."""
+    if isinstance(value, int):
+        return _varint(number << 3) + _varint(value)
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+def _base58(data):
+    n = int.from_bytes(data, 'big')
+    out = ''
+    while n:
+        n, rem = divmod(n, 58)
+        out = BASE58_ALPHABET[rem] + out
+    return '1' * (len(data) - len(data.lstrip(b'\0'))) + out
+
+
+def _multihash(block):
+    return b'\x12\x20' + hashlib.sha256(block).digest()
+
+
+class _Node:
+    __slots__ = ('cid', 'filesize', 'tsize')
+
+    def __init__(self, cid, filesize, tsize):
+        self.cid = cid  # binary CID (a bare multihash for CIDv0)
+        self.filesize = filesize  # bytes of file content below this node
+        self.tsize = tsize  # serialized size of this node and everything below it
+
+
+class CidBuilder:
+    """Feeds file content in any chunking and returns the root CID from finish()."""
+
+    def __init__(self, cid_version=0, raw_leaves=None, chunk_size=CHUNK_SIZE):
+        self.cid_version = cid_version
+        self.raw_leaves = cid_version == 1 if raw_leaves is None else raw_leaves
+        self.chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._levels = [[]]  # _levels[0] holds leaves, _levels[i] nodes of height i
+        self._leaves = 0
+
+    def _cid(self, codec, block):
+        if self.cid_version == 0:
+            return _multihash(block)
+        return _varint(1) + _varint(codec) + _multihash(block)
+
+    def _leaf(self, data):
+        if self.raw_leaves:
+            return _Node(self._cid(CODEC_RAW, data), len(data), len(data))
+        # The empty file has no Data field at all.
+        unixfs = _field(1, UNIXFS_FILE) + (_field(2, data) if data else b'') + _field(3, len(data))
+        block = _field(1, unixfs)
+        return _Node(self._cid(CODEC_DAG_PB, block), len(data), len(block))
+
+    def _parent(self, children):
+        filesize = sum(child.filesize for child in children)
+        unixfs = _field(1, UNIXFS_FILE) + _field(3, filesize) + b''.join(_field(4, child.filesize) for child in children)
+        links = b''.join(_field(2, _field(1, child.cid) + _field(2, b'') + _field(3, child.tsize)) for child in children)
+        block = links + _field(1, unixfs)
+        return _Node(self._cid(CODEC_DAG_PB, block), filesize, len(block) + sum(child.tsize for child in children))
+
+    def _push(self, node, height=0):
+        if height == len(self._levels):
+            self._levels.append([])
+        level = self._levels[height]
+        level.append(node)
+        # A full node never gets more children, so it can be built right away.
+        if len(level) == MAX_LINKS:
+            self._levels[height] = []
+            self._push(self._parent(level), height + 1)
+
+    def update(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._push(self._leaf(bytes(self._buffer[:self.chunk_size])))
+            del self._buffer[:self.chunk_size]
+            self._leaves += 1
+        return self
+
+    def finish(self):
+        if self._buffer or not self._leaves:
+            self._push(self._leaf(bytes(self._buffer)))
+            self._buffer.clear()
+        # Close partially filled nodes bottom-up until only the top level is left.
+        height = 0
+        while any(self._levels[height + 1:]):
+            if self._levels[height]:
+                level, self._levels[height] = self._levels[height], []
+                self._push(self._parent(level), height + 1)
+            height += 1
+        top = self._levels[height]
+        root = self._parent(top) if len(top) > 1 else top[0]
+        return encode_cid(root.cid, self.cid_version)
+
+
+def encode_cid(cid, version):
+    if version == 0:
+        return _base58(cid)
+    return 'b' + b32encode(cid).decode().lower().rstrip('=')
+
+
+def compute_cid(chunks, **kwargs):
+    """CID of the content given as an iterable of byte strings."""
+    builder = CidBuilder(**kwargs)
+    for chunk in chunks:
+        builder.update(chunk)
+    return builder.finish()
+
+
+def file_cid(path, **kwargs):
+    with open(path, 'rb') as f:
+        return compute_cid(iter(lambda: f.read(CHUNK_SIZE), b''), **kwargs)
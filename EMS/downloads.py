@@ -0,0 +1,138 @@
+from django.conf import settings
+from django.core import signing
+from django.http import FileResponse, HttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+from urllib.parse import quote, urlencode
+import os, re
+
+from .prestaging import paper_path
+
+# Superintendent downloads. The POST that claims a paper redirects to a short-lived
+# signed link; that link is served either by Django as a streaming FileResponse
+# (Range and conditional requests supported) or, when PAPER_DOWNLOAD_ACCEL_REDIRECT
+# is set, by the front web server through X-Accel-Redirect.
+
+TOKEN_SALT = 'EMS.downloads.paper'
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+BLOCK_SIZE = 64 * 1024  # read size when the server cannot sendfile (FileResponse default is 4 KB)
+
+
+def make_token(paper_id, username):
+    return signing.dumps({'paper': paper_id, 'user': username}, salt=TOKEN_SALT, compress=True)
+
+
+def check_token(token, paper_id, username):
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT, max_age=settings.PAPER_DOWNLOAD_TOKEN_TTL)
+    except signing.BadSignature:  # also raised for expired tokens
+        return False
+    return data == {'paper': paper_id, 'user': username}
+
+
+def download_url(paper, username):
+    return reverse('paper_download', args=[paper.id]) + '?' + urlencode({'token': make_token(paper.id, username)})
+
+
+class FileRange:
+    """Bytes [start, start + length) of an open file.
+
+    fileno() is kept so WSGI servers with sendfile support (gunicorn) can still use it;
+    they start at the file offset and send Content-Length bytes.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """Returns the (first, last) byte of a single range, or None to send the whole file.
+
+    Raises ValueError when the range cannot be satisfied. Multiple ranges are not
+    supported and get the whole file, which RFC 9110 allows.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:  # suffix range: the last N bytes
+        if int(last) == 0 or size == 0:
+            raise ValueError("Unsatisfiable range.")
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        raise ValueError("Unsatisfiable range.")
+    return first, (min(int(last), size - 1) if last else size - 1)
+
+
+def file_response(request, path, filename, content_type='application/pdf'):
+    """Streams a file as an attachment, honouring Range, If-Range and the conditional headers."""
+    stat = os.stat(path)
+    etag = quote_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:  # 304 Not Modified or 412 Precondition Failed
+        response['ETag'] = etag
+        return response
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if range_header and (not if_range or if_range == etag or parse_http_date_safe(if_range) == last_modified):
+        try:
+            byte_range = parse_range(range_header, stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{stat.st_size}"
+            return response
+
+    file = open(path, 'rb')
+    if byte_range:
+        first, last = byte_range
+        response = FileResponse(FileRange(file, first, last - first + 1), status=206,
+                                as_attachment=True, filename=filename, content_type=content_type)
+        response['Content-Range'] = f"bytes {first}-{last}/{stat.st_size}"
+        response['Content-Length'] = last - first + 1
+    else:
+        response = FileResponse(file, as_attachment=True, filename=filename, content_type=content_type)
+    response.block_size = BLOCK_SIZE
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def accel_response(path, filename, content_type='application/pdf'):
+    """Hands the transfer to nginx; it serves Range and conditional requests itself."""
+    response = HttpResponse(content_type=content_type)
+    relative = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+    response['X-Accel-Redirect'] = settings.PAPER_DOWNLOAD_ACCEL_REDIRECT + quote(relative)
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
+
+
+def serve_paper(request, paper):
+    filename = f"{paper.s_code}.pdf"
+    path = paper_path(paper)  # the pre-staged copy when the scheduler made one
+    if settings.PAPER_DOWNLOAD_ACCEL_REDIRECT:
+        return accel_response(path, filename)
+    return file_response(request, path, filename)
@@ -1,35 +1,140 @@
-from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from django.conf import settings
 from django.core.files import File
-import os
+import base64, os, struct
 
+from .metrics import timed
 
-def encrypt_file(paper):
-    key = Fernet.generate_key()
-    input_file = paper
-    output_file = os.path.join(settings.ENCRYPTION_ROOT, str(paper) + '.encrypted')
+# Segmented stream format used for paper uploads:
+#   header  = magic | version | chunk size (uint32) | salt (16 bytes) | nonce prefix (7 bytes)
+#   segment = AES-256-GCM ciphertext of one plaintext chunk followed by its 16 byte tag
+# Every segment nonce is the prefix, a segment counter and a "last segment" flag, and the
+# header is authenticated with each segment, so reordered, dropped or truncated segments
+# fail to decrypt. The AES key is derived from the Fernet key that a_encryption wraps.
+STREAM_MAGIC = b'TEXS'
+STREAM_VERSION = 1
+STREAM_HEADER = struct.Struct('>4sBI16s7s')
+TAG_SIZE = 16
+
+
+def _derive_key(key, salt):
+    hkdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            info=b'trustexaminator-paper-stream',
+            backend=default_backend()
+        )
+    return hkdf.derive(base64.urlsafe_b64decode(key))
+
+
+def _nonce(prefix, counter, last):
+    return prefix + struct.pack('>IB', counter, 1 if last else 0)
+
+
+def _iter_source(source, chunk_size):
+    # Accept Django files, requests responses or any iterable of byte strings.
+    if hasattr(source, 'iter_content'):
+        return source.iter_content(chunk_size=chunk_size)
+    if hasattr(source, 'chunks'):
+        return source.chunks(chunk_size)
+    return source
+
+
+def encrypt_chunks(chunks, key, chunk_size=None):
+    """Yields the stream header followed by one encrypted segment per plaintext chunk."""
+    chunk_size = chunk_size or settings.ENCRYPTION_CHUNK_SIZE
+    salt = os.urandom(16)
+    prefix = os.urandom(7)
+    header = STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, chunk_size, salt, prefix)
+    aead = AESGCM(_derive_key(key, salt))
+    yield header
 
-    data = input_file.read()
+    counter = 0
+    buffer = bytearray()
+    for data in chunks:
+        buffer += data
+        # Keep at least one byte back so the final segment is always flagged as last.
+        while len(buffer) > chunk_size:
+            yield aead.encrypt(_nonce(prefix, counter, False), bytes(buffer[:chunk_size]), header)
+            del buffer[:chunk_size]
+            counter += 1
+    yield aead.encrypt(_nonce(prefix, counter, True), bytes(buffer), header)
 
-    fernet = Fernet(key)
-    encrypted = fernet.encrypt(data)
 
-    with open(output_file, 'wb') as f:
-        f.write(encrypted)
+def decrypt_chunks(chunks, key):
+    """Yields plaintext chunks from a segmented stream or a legacy single Fernet token."""
+    buffer = bytearray()
+    chunks = iter(chunks)
+    for data in chunks:
+        buffer += data
+        if len(buffer) >= STREAM_HEADER.size:
+            break
+
+    if bytes(buffer[:len(STREAM_MAGIC)]) != STREAM_MAGIC:
+        # Papers encrypted before the stream format are one Fernet token.
+        for data in chunks:
+            buffer += data
+        yield Fernet(key).decrypt(bytes(buffer))
+        return
+
+    if len(buffer) < STREAM_HEADER.size:
+        raise InvalidToken
+    header = bytes(buffer[:STREAM_HEADER.size])
+    magic, version, chunk_size, salt, prefix = STREAM_HEADER.unpack(header)
+    if version != STREAM_VERSION:
+        raise InvalidToken
+    del buffer[:STREAM_HEADER.size]
+    aead = AESGCM(_derive_key(key, salt))
+    segment_size = chunk_size + TAG_SIZE
+
+    counter = 0
+    try:
+        # The first read may already hold whole segments after the header.
+        while True:
+            while len(buffer) > segment_size:
+                yield aead.decrypt(_nonce(prefix, counter, False), bytes(buffer[:segment_size]), header)
+                del buffer[:segment_size]
+                counter += 1
+            data = next(chunks, None)
+            if data is None:
+                break
+            buffer += data
+        if len(buffer) < TAG_SIZE:
+            raise InvalidToken
+        yield aead.decrypt(_nonce(prefix, counter, True), bytes(buffer), header)
+    except InvalidTag:
+        raise InvalidToken
+
+
+def encrypt_file(paper, cid=None):
+    # cid: an EMS.cid.CidBuilder fed the encrypted bytes as they are written, so the
+    # caller gets the CID without reading the file back.
+    key = Fernet.generate_key()
+    output_file = os.path.join(settings.ENCRYPTION_ROOT, str(paper) + '.encrypted')
+
+    with timed('paper_encrypt'), open(output_file, 'wb') as f:
+        for segment in encrypt_chunks(_iter_source(paper, settings.ENCRYPTION_CHUNK_SIZE), key):
+            f.write(segment)
+            if cid is not None:
+                cid.update(segment)
 
     return key
 
 
 def decrypt_file(paper, key, s_code):
-    fernet = Fernet(key)
-    paper = paper.text.encode('utf-8')
-
-    decrypted = fernet.decrypt(paper)
+    source = _iter_source(paper, settings.ENCRYPTION_CHUNK_SIZE)
 
-    with open('media/' + s_code + '.pdf', 'wb') as f:
-        f.write(decrypted)
+    with timed('paper_decrypt'), open('media/' + s_code + '.pdf', 'wb') as f:
+        for data in decrypt_chunks(source, key):
+            f.write(data)
 
     file_ = open('media/' + s_code + '.pdf', 'rb')
     f_file = File(file_)
 
-    return f_file
\ No newline at end of file
+    return f_file
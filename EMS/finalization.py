@@ -0,0 +1,149 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+import os
+
+from .models import Request, FinalPapers, CustomUser
+from .encryption import decrypt_file
+from .a_encryption import a_decryption
+from .outbox import enqueue_upload
+from .ipfs_client import get_ipfs
+from .cid import file_cid
+from .prestaging import invalidate_dashboard
+from .refcache import ACTIVE_TEACHERS, invalidate_on_commit
+
+# Stages reported by the finalization status endpoint, in execution order.
+# The chain record itself is sent later from the outbox (EMS.outbox).
+STAGES = ('decrypt', 'ipfs_add', 'ipfs_cp', 'save_paper', 'finalize_request')
+
+
+class FinalizationError(Exception):
+    pass
+
+
+@contextmanager
+def stage(job, name):
+    """Records the start and end of a pipeline stage on the job row."""
+    job.stage = name
+    job.stages[name] = {'status': 'Running', 'started': timezone.now().isoformat()}
+    job.save(update_fields=['stage', 'stages', 'updated_at'])
+    try:
+        yield
+    except Exception:
+        job.stages[name]['status'] = 'Failed'
+        job.stages[name]['finished'] = timezone.now().isoformat()
+        job.save(update_fields=['stages', 'updated_at'])
+        raise
+    job.stages[name]['status'] = 'Completed'
+    job.stages[name]['finished'] = timezone.now().isoformat()
+    job.save(update_fields=['stages', 'updated_at'])
+
+
+def completed(job, name):
+    """Whether an earlier attempt of the job (EMS.jobs.claim_next_job) finished this stage."""
+    return job.stages.get(name, {}).get('status') == 'Completed'
+
+
+def finalize_request(job):
+    """Publishes an uploaded paper to IPFS, decrypts it for the superintendent and records it on chain."""
+    req = job.request
+    if completed(job, 'finalize_request'):
+        return None  # an earlier attempt got to the end
+    if req.status != "Pending Finalization":
+        raise FinalizationError("No pending finalization found for this request.")
+    if not req.encrypted_file:
+        raise FinalizationError("Encrypted file missing for this request. Please ask the teacher to re-upload.")
+
+    # Build local file path.
+    file_path = os.path.join(settings.ENCRYPTION_ROOT, req.encrypted_file)
+
+    # Named per request: jobs for the same subject code run side by side.
+    output_name = f"{req.s_code}_{req.id}"
+    ipfs = get_ipfs()
+    try:
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            # The daemon adds the encrypted file while we decrypt the local copy; the
+            # CID computed at upload proves both saw the same bytes.
+            added = pool.submit(ipfs.add, file_path, settings.IPFS_CID_VERSION)
+
+            with stage(job, 'decrypt'):
+                # Decrypt the file using stored encryption details.
+                dec_values = a_decryption([req.enc_field, req.private_key])
+                with File(open(file_path, 'rb')) as encrypted:
+                    final_content = decrypt_file(encrypted, dec_values[0], output_name)
+
+            with stage(job, 'ipfs_add'):
+                hash_id = added.result()["Hash"]
+                expected = req.encrypted_cid or file_cid(file_path, cid_version=settings.IPFS_CID_VERSION)
+                if hash_id != expected:
+                    raise FinalizationError(f"IPFS returned CID {hash_id} but the uploaded file has CID {expected}.")
+
+        if not completed(job, 'ipfs_cp'):  # files/cp refuses an existing destination
+            with stage(job, 'ipfs_cp'):
+                # Attempt to copy the file inside IPFS; if this fails, raise an error.
+                ipfs.files_cp(f"/ipfs/{hash_id}", f"/papers/{req.encrypted_file}")
+
+        with stage(job, 'save_paper'):
+            final_record = save_final_paper(req, final_content, hash_id)
+    finally:
+        remove_plaintext(output_name)
+
+    with stage(job, 'finalize_request'):
+        mark_finalized(req)
+
+    return final_record
+
+
+def save_final_paper(req, final_content, hash_id):
+    """Creates the FinalPapers row for a request and queues its chain record in the same transaction.
+
+    A retried job finds the row an earlier attempt saved (same teacher, subject code and
+    upload CID) and returns it instead of recording the paper twice.
+    """
+    teacher_info = CustomUser.objects.filter(username=req.tusername).values("course", "semester", "branch", "subject").first()
+    if not teacher_info:
+        raise FinalizationError("Teacher details not found.")
+
+    constructed_filename = f"{req.s_code}.pdf"
+    with transaction.atomic():
+        Request.objects.select_for_update().filter(id=req.id).first()  # one attempt at a time past here
+        existing = FinalPapers.objects.filter(s_code=req.s_code, uploader=req.tusername, ipfs_cid=hash_id).first()
+        if existing is not None:
+            final_content.close()
+            return existing
+        final_record = FinalPapers.objects.create(
+            s_code=req.s_code,
+            course=teacher_info["course"],
+            semester=teacher_info["semester"],
+            branch=teacher_info["branch"],
+            subject=teacher_info["subject"],
+            filename=constructed_filename,
+            ipfs_cid=hash_id,
+            uploader=req.tusername,
+        )
+        with final_content:
+            final_record.paper.save(constructed_filename, final_content, save=True)
+        enqueue_upload(final_record, hash_id, req.tusername)
+    return final_record
+
+
+def remove_plaintext(output_name):
+    """Deletes what decrypt_file wrote for output_name; FinalPapers.paper keeps its own copy."""
+    path = os.path.join('media', f"{output_name}.pdf")  # decrypt_file's output path
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def mark_finalized(req):
+    # Only after successful processing, update the request status.
+    Request.objects.filter(id=req.id).update(status="Finalized")
+    invalidate_dashboard()  # the paper now shows up for superintendents
+    invalidate_on_commit(ACTIVE_TEACHERS)  # update() sends no post_save
+
+    # Remove the local encrypted file for security.
+    file_path = os.path.join(settings.ENCRYPTION_ROOT, req.encrypted_file)
+    if os.path.exists(file_path):
+        os.remove(file_path)
@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.db import transaction
+from web3._utils.events import get_event_data
+import datetime
+
+from .models import ChainEvent, IndexerCursor
+from .web3_client import get_client
+
+CURSOR_NAME = 'paper_storage_events'
+
+# Contract event name -> (event_type shown in the history, initiator arg, paper id arg)
+EVENTS = {
+    'PaperUploaded': ('Upload', 'uploader', 'id'),
+    'PaperDownloaded': ('Download', 'downloader', 'paperId'),
+}
+
+
+def _decode(client, log):
+    topic = "0x" + bytes(log['topics'][0]).hex()
+    name = next(name for name in EVENTS if client.topics[name] == topic)
+    event_type, initiator_arg, paper_arg = EVENTS[name]
+    args = get_event_data(client.web3.codec, client.event_abis[name], log)['args']
+    # The contract emits block.timestamp with every event, so no get_block call is needed.
+    ts = args.get('timestamp')
+    return ChainEvent(
+        event_type=event_type,
+        tx_hash="0x" + bytes(log['transactionHash']).hex(),
+        log_index=log['logIndex'],
+        block_number=log['blockNumber'],
+        block_hash="0x" + bytes(log['blockHash']).hex(),
+        timestamp=datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc) if ts else None,
+        initiator=args.get(initiator_arg, ''),
+        filename=args.get('filename', ''),
+        paper_id=args.get(paper_arg),
+    )
+
+
+def index_range(client, from_block, to_block):
+    """Replaces the indexed events of [from_block, to_block] with what the node reports now."""
+    logs = client.web3.eth.get_logs({
+        'address': client.address,
+        'fromBlock': from_block,
+        'toBlock': to_block,
+        'topics': [[client.topics[name] for name in EVENTS]],
+    })
+    events = [_decode(client, log) for log in logs]
+    with transaction.atomic():
+        cursor = IndexerCursor.objects.select_for_update().get(name=CURSOR_NAME)
+        # Deleting first drops events from blocks that were reorganised away.
+        ChainEvent.objects.filter(block_number__gte=from_block, block_number__lte=to_block).delete()
+        ChainEvent.objects.bulk_create(events)
+        if to_block > cursor.last_block:
+            cursor.last_block = to_block
+            cursor.save(update_fields=['last_block', 'updated_at'])
+    return len(events)
+
+
+def sync_events(chunk_size=None, reorg_depth=None):
+    """Indexes new contract events up to the chain head. Returns (events indexed, last block)."""
+    chunk_size = chunk_size or settings.CHAIN_INDEXER_CHUNK_SIZE
+    reorg_depth = settings.CHAIN_INDEXER_REORG_DEPTH if reorg_depth is None else reorg_depth
+    client = get_client()
+
+    cursor, _ = IndexerCursor.objects.get_or_create(name=CURSOR_NAME)
+    head = client.web3.eth.block_number
+    # Re-scan the trailing blocks in case they were replaced since the last run.
+    start = max(0, cursor.last_block + 1 - reorg_depth)
+
+    count = 0
+    for from_block in range(start, head + 1, chunk_size):
+        to_block = min(from_block + chunk_size - 1, head)
+        count += index_range(client, from_block, to_block)
+    return count, head
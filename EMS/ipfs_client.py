@@ -0,0 +1,94 @@
+from django.conf import settings
+import json, os, threading, uuid
+
+from .metrics import timed
+
+# One IPFS HTTP API client per process, created on first use. Calls go to
+# IPFS_STORAGE_API_URL over a keep-alive session pool; uploads and `cat` reads are
+# streamed so a paper is never held in memory as a whole. requests is imported with
+# the first client.
+
+
+class IpfsError(Exception):
+    pass
+
+
+class IpfsClient:
+    def __init__(self):
+        from requests.adapters import HTTPAdapter
+        import requests
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.IPFS_POOL_SIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self.session = session
+        self.api_url = settings.IPFS_STORAGE_API_URL.rstrip('/') + '/'
+        self.timeout = (settings.IPFS_CONNECT_TIMEOUT, settings.IPFS_REQUEST_TIMEOUT)
+
+    def _post(self, command, params=None, **kwargs):
+        response = self.session.post(self.api_url + command, params=params, timeout=self.timeout, **kwargs)
+        if response.status_code != 200:
+            try:
+                message = response.json().get('Message', response.text)
+            except ValueError:
+                message = response.text
+            response.close()
+            raise IpfsError(f"IPFS {command} failed ({response.status_code}): {message}")
+        return response
+
+    def version(self):
+        return self._post('version').json()
+
+    def add(self, path, cid_version=0):
+        """Adds a local file and returns the API's result, e.g. {'Name', 'Hash', 'Size'}."""
+        boundary = uuid.uuid4().hex
+        with timed('ipfs_add'):
+            response = self._post('add', {'cid-version': cid_version}, data=self._multipart(path, boundary),
+                                  headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+            # The API answers with one JSON object per line; the last one is the file.
+            lines = [line for line in response.text.splitlines() if line.strip()]
+        return json.loads(lines[-1])
+
+    def _multipart(self, path, boundary):
+        name = os.path.basename(path)
+        yield (f'--{boundary}\r\n'
+               f'Content-Disposition: form-data; name="file"; filename="{name}"\r\n'
+               'Content-Type: application/octet-stream\r\n\r\n').encode()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(settings.IPFS_CHUNK_SIZE), b''):
+                yield chunk
+        yield f'\r\n--{boundary}--\r\n'.encode()
+
+    def files_cp(self, source, dest):
+        with timed('ipfs_cp'):
+            self._post('files/cp', [('arg', source), ('arg', dest)]).close()
+
+    def cat(self, cid, offset=None, length=None):
+        """Returns an iterator over the bytes of cid. The request is sent and checked right away."""
+        params = [('arg', cid)]
+        if offset is not None:
+            params.append(('offset', offset))
+        if length is not None:
+            params.append(('length', length))
+        with timed('ipfs_fetch'):  # until the response starts; the body is read by the caller
+            response = self._post('cat', params, stream=True)
+        return self._iter_content(response)
+
+    @staticmethod
+    def _iter_content(response):
+        with response:
+            yield from response.iter_content(chunk_size=settings.IPFS_CHUNK_SIZE)
+
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_ipfs():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = IpfsClient()
+    return _client
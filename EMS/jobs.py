@@ -0,0 +1,129 @@
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+import datetime, logging, threading
+
+from .models import FinalizationJob
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_workers = []
+
+
+def enqueue_finalization(req, username):
+    """Queues a finalization job for a request, reusing one that is already queued or running.
+
+    A running job left behind by a dead worker is picked up again by claim_next_job().
+    """
+    with transaction.atomic():
+        job = (FinalizationJob.objects.select_for_update()
+               .filter(request=req, status__in=['Queued', 'Running']).first())
+        if job is None:
+            job = FinalizationJob.objects.create(request=req, requested_by=username)
+    wake_workers()
+    return job
+
+
+def wake_workers():
+    """Tells the in-process workers (started here if enabled) that jobs were queued."""
+    if settings.FINALIZATION_RUN_IN_PROCESS:
+        start_workers()
+    _wakeup.set()
+
+
+def claim_next_job():
+    """Marks the oldest queued job as running and returns it, or None when the queue is empty.
+
+    Workers are daemon threads in web processes, so a restart can leave a job 'Running'
+    with nobody working on it. A running job whose row has not changed for
+    FINALIZATION_STALE_AFTER seconds (every stage saves it) is taken again, and fails once
+    it has been started FINALIZATION_MAX_ATTEMPTS times.
+    """
+    stale = timezone.now() - datetime.timedelta(seconds=settings.FINALIZATION_STALE_AFTER)
+    while True:
+        with transaction.atomic():
+            job = (FinalizationJob.objects.select_for_update(skip_locked=True)
+                   .filter(Q(status='Queued') | Q(status='Running', updated_at__lt=stale)).order_by('id').first())
+            if job is None:
+                return None
+            if job.status == 'Running':
+                if job.attempts >= settings.FINALIZATION_MAX_ATTEMPTS:
+                    job.status = 'Failed'
+                    job.error = f"Abandoned by its worker after {job.attempts} attempt(s)."
+                    job.save(update_fields=['status', 'error', 'updated_at'])
+                    continue
+                logger.warning("Requeuing finalization job %s, stale since %s", job.id, job.updated_at)
+            job.status = 'Running'
+            job.attempts += 1
+            job.save(update_fields=['status', 'attempts', 'updated_at'])
+        return job
+
+
+def claim_job(job):
+    """Marks a given queued job as running, e.g. for the bulk runner. False when a worker took it first."""
+    claimed = FinalizationJob.objects.filter(id=job.id, status='Queued').update(
+        status='Running', attempts=F('attempts') + 1, updated_at=timezone.now())
+    if claimed:
+        job.status = 'Running'
+        job.attempts += 1
+    return bool(claimed)
+
+
+def run_job(job):
+    from .finalization import finalize_request
+
+    try:
+        finalize_request(job)
+    except Exception as e:
+        logger.exception("Finalization job %s failed", job.id)
+        finish_job(job, e)
+    else:
+        finish_job(job)
+
+
+def finish_job(job, error=None):
+    if error is not None:
+        job.status = 'Failed'
+        job.error = str(error)
+        job.save(update_fields=['status', 'error', 'updated_at'])
+    else:
+        job.status = 'Completed'
+        job.stage = ''
+        job.save(update_fields=['status', 'stage', 'updated_at'])
+
+
+def run_pending_jobs():
+    """Runs queued jobs until the queue is empty. Returns the number of jobs processed."""
+    count = 0
+    while True:
+        job = claim_next_job()
+        if job is None:
+            return count
+        run_job(job)
+        count += 1
+
+
+def _worker_loop():
+    while True:
+        _wakeup.clear()
+        close_old_connections()
+        try:
+            run_pending_jobs()
+        except Exception:
+            logger.exception("Finalization worker error")
+        finally:
+            close_old_connections()
+        _wakeup.wait(settings.FINALIZATION_POLL_INTERVAL)
+
+
+def start_workers(count=None):
+    """Starts the in-process worker pool once per process."""
+    count = count or settings.FINALIZATION_WORKERS
+    with _lock:
+        while len(_workers) < count:
+            worker = threading.Thread(target=_worker_loop, name=f"finalization-worker-{len(_workers)}", daemon=True)
+            worker.start()
+            _workers.append(worker)
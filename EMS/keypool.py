@@ -0,0 +1,69 @@
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.conf import settings
+import queue, threading
+
+from .metrics import timed
+
+# Generating a 2048-bit RSA key takes tens to hundreds of milliseconds, so a
+# background thread keeps a small stock of fresh keys ready for teacher uploads.
+# Every key is handed out once and never reused.
+
+
+def generate_private_key():
+    with timed('rsa_keygen'):
+        return rsa.generate_private_key(
+                public_exponent=65537,
+                key_size=2048,
+                backend=default_backend()
+            )
+
+
+class KeyPool:
+    def __init__(self, size):
+        self.size = size
+        self._keys = queue.Queue(maxsize=max(size, 1))
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Starts the refill thread once; a pool of size 0 never starts one."""
+        if self.size <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._refill, name="rsa-key-pool", daemon=True)
+                self._thread.start()
+
+    def _refill(self):
+        while True:
+            # Blocks while the pool is full.
+            self._keys.put(generate_private_key())
+
+    def get(self):
+        """Returns a ready key, generating one inline if the pool has run dry."""
+        self.start()
+        try:
+            return self._keys.get_nowait()
+        except queue.Empty:
+            return generate_private_key()
+
+    def available(self):
+        return self._keys.qsize()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = KeyPool(settings.RSA_KEY_POOL_SIZE)
+    return _pool
+
+
+def get_private_key():
+    return get_pool().get()
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_datetime
+import json, time
+
+from EMS.bulk_finalization import claim_requests, pending_requests, run_claimed
+from EMS.models import FinalPapers
+from EMS.outbox import wait_for_papers
+
+
+class Command(BaseCommand):
+    help = "Finalizes every 'Pending Finalization' request of a subject or term and prints a per-request report."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--s-code', help="Only requests for this subject code.")
+        parser.add_argument('--subject', help="Only requests for this subject name.")
+        parser.add_argument('--exam-from', type=parse_datetime, help="Only exams at or after this time (ISO 8601).")
+        parser.add_argument('--exam-to', type=parse_datetime, help="Only exams before this time (ISO 8601).")
+        parser.add_argument('--io-workers', type=int, help="Threads for IPFS calls.")
+        parser.add_argument('--cpu-workers', type=int, help="Processes for decryption.")
+        parser.add_argument('--user', default='manage.py', help="Recorded as requested_by on the jobs.")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+        parser.add_argument('--no-chain-wait', action='store_true',
+                            help="Leave the chain records to the outbox worker instead of sending them before exiting.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        queryset = pending_requests(options['s_code'], options['subject'], options['exam_from'], options['exam_to'])
+        claimed, skipped = claim_requests(queryset, options['user'])
+        report = sorted(run_claimed(claimed, options['io_workers'], options['cpu_workers']) + skipped,
+                        key=lambda row: row['request_id'])
+
+        paper_ids = [row['paper_id'] for row in report if row.get('paper_id')]
+        if paper_ids and not options['no_chain_wait']:
+            if not wait_for_papers(paper_ids, settings.BLOCKCHAIN_RECEIPT_TIMEOUT):
+                self.stderr.write("Some chain records are still pending; the outbox worker will send them.")
+            papers = FinalPapers.objects.in_bulk(paper_ids)
+            for row in report:
+                if row.get('paper_id') in papers:
+                    paper = papers[row['paper_id']]
+                    row.update(tx_hash=paper.tx_hash, contract_paper_id=paper.contract_paper_id)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for row in report:
+            line = f"Request {row['request_id']} ({row['s_code']}, {row['teacher']}): {row['status']}"
+            if row['error']:
+                line += f" - {row['error']}"
+            elif row.get('tx_hash'):
+                line += f" - paper {row['contract_paper_id']}, tx {row['tx_hash']}"
+            self.stdout.write(line)
+        finalized = sum(row['status'] == 'Finalized' for row in report)
+        self.stdout.write(f"Finalized {finalized} of {len(report)} request(s) in {time.monotonic() - started:.1f}s.")
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+import json
+
+from EMS.teacher_import import import_teachers, read_rows
+
+
+class Command(BaseCommand):
+    help = "Creates teacher accounts from a CSV (with a header row) or JSON Lines file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Columns: username, password, first_name, last_name, email, course, semester, branch, subject.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per bulk insert and teacher id block.")
+        parser.add_argument('--workers', type=int, help="Processes for password hashing (default: one per CPU).")
+        parser.add_argument('--json', action='store_true', help="Print the summary as JSON.")
+
+    def handle(self, *args, **options):
+        summary = import_teachers(read_rows(options['path'], options['format']), options['batch_size'], options['workers'])
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+        for error in summary['errors']:
+            self.stderr.write(f"Row {error['row']} ({error['username']}): {error['error']}")
+        self.stdout.write(f"Created {summary['created']} teacher(s); {summary['existing']} already existed, "
+                          f"{summary['invalid']} invalid. {summary['seconds']:.1f}s, {summary['rows_per_second']:.0f} rows/s.")
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import time
+
+from EMS.indexer import sync_events
+
+
+class Command(BaseCommand):
+    help = "Indexes new PaperStorage events into the local ChainEvent table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--follow', action='store_true', help="Keep polling for new blocks.")
+        parser.add_argument('--interval', type=float, default=settings.CHAIN_INDEXER_POLL_INTERVAL,
+                            help="Seconds between polls with --follow.")
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                count, head = sync_events()
+                self.stdout.write(f"Indexed {count} event(s) up to block {head}.")
+            except Exception as e:
+                if not options['follow']:
+                    raise
+                self.stderr.write(f"Indexing failed: {e}")
+            if not options['follow']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+import json
+
+from EMS.blobstore import collect_garbage, migrate_legacy, recount
+
+
+class Command(BaseCommand):
+    help = "Moves flat MEDIA_ROOT files into the content-addressed blob store and maintains its refcounts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only count the files that would move.")
+        parser.add_argument('--delete-originals', action='store_true', help="Remove each flat file once its rows point at the blob.")
+        parser.add_argument('--recount', action='store_true', help="Only rebuild refcounts from the rows naming each blob.")
+        parser.add_argument('--gc', action='store_true', help="Afterwards remove blobs no row refers to.")
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.stdout.write(f"{recount()} refcount(s) corrected.")
+        else:
+            summary = migrate_legacy(delete_originals=options['delete_originals'], dry_run=options['dry_run'])
+            self.stdout.write(json.dumps(summary, indent=2))
+        if options['gc'] and not options['dry_run']:
+            self.stdout.write(f"{collect_garbage()} unreferenced blob(s) removed.")
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+import json, time
+
+from EMS.prestaging import run_once, stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = "Pre-stages papers and superintendent dashboard rows ahead of upcoming download windows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--follow', action='store_true', help="Keep running ahead of new windows.")
+        parser.add_argument('--interval', type=float, default=settings.PRESTAGE_INTERVAL,
+                            help="Seconds between runs with --follow.")
+        parser.add_argument('--stats', action='store_true', help="Print cache hit rates and exit.")
+        parser.add_argument('--reset-stats', action='store_true', help="Reset the hit and miss counters and exit.")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(stats(), indent=2))
+            return
+        if options['reset_stats']:
+            reset_stats()
+            return
+        while True:
+            try:
+                summary = run_once()
+                self.stdout.write(f"{summary['upcoming']} paper(s) in upcoming windows: {summary['staged']} staged, "
+                                  f"{summary['failed']} failed, {summary['removed']} expired copies removed.")
+            except Exception as e:
+                if not options['follow']:
+                    raise
+                self.stderr.write(f"Pre-staging failed: {e}")
+            finally:
+                connections.close_all()
+            if not options['follow']:
+                return
+            time.sleep(options['interval'])
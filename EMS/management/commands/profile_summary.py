@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from EMS.profiling import by_view, hottest, load_profiles
+
+
+class Command(BaseCommand):
+    help = "Summarises the request profiles in REQUEST_PROFILE_DIR: the hottest functions and the cost of each view."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=settings.REQUEST_PROFILE_DIR, help="Directory of profiles to read.")
+        parser.add_argument('--view', help="Only profiles of this view (its URL name).")
+        parser.add_argument('--limit', type=int, default=25, help="Number of functions to list.")
+        parser.add_argument('--sort', choices=('self', 'cumulative'), default='self',
+                            help="Rank by samples in the function itself or anywhere below it.")
+
+    def handle(self, *args, **options):
+        profiles = load_profiles(options['dir'], options['view'])
+        if not profiles:
+            self.stdout.write(f"No profiles in {options['dir']}.")
+            return
+
+        self.stdout.write(f"{len(profiles)} profile(s)\n")
+        self.stdout.write(f"{'view':<28} {'n':>5} {'wall ms':>10} {'queries':>8} {'sql ms':>9} {'rpc ms':>9} {'ipfs ms':>9}")
+        for view, row in by_view(profiles).items():
+            self.stdout.write(f"{view:<28} {row['profiles']:>5} {row['wall_ms']:>10.1f} {row['queries']:>8.1f} "
+                              f"{row['sql_ms']:>9.1f} {row['rpc_ms']:>9.1f} {row['ipfs_ms']:>9.1f}")
+
+        functions, total = hottest(profiles, options['limit'], options['sort'])
+        self.stdout.write(f"\n{total} sample(s)")
+        if not total:
+            return
+        self.stdout.write(f"{'self %':>7} {'cum %':>7}  function")
+        for name, own, cumulative in functions:
+            self.stdout.write(f"{100 * own / total:>7.1f} {100 * cumulative / total:>7.1f}  {name}")
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+import time
+
+from EMS.models import ChainOutbox
+from EMS.outbox import drain
+
+
+class Command(BaseCommand):
+    help = "Sends queued contract transactions from the chain outbox and records their hashes once mined."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--follow', action='store_true', help="Keep sending as new rows are queued.")
+        parser.add_argument('--interval', type=float, default=settings.CHAIN_OUTBOX_POLL_INTERVAL,
+                            help="Seconds between polls with --follow.")
+        parser.add_argument('--retry-failed', action='store_true', help="Queue rows that ran out of attempts again first.")
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            count = ChainOutbox.objects.filter(status='Failed').update(
+                status='Pending', attempts=0, next_attempt_at=timezone.now(), updated_at=timezone.now())
+            self.stdout.write(f"Re-queued {count} failed row(s).")
+        while True:
+            try:
+                count = drain()
+                if count or not options['follow']:
+                    self.stdout.write(f"Processed {count} outbox row(s).")
+            except Exception as e:
+                if not options['follow']:
+                    raise
+                self.stderr.write(f"Sending failed: {e}")
+            finally:
+                close_old_connections()
+            if not options['follow']:
+                return
+            time.sleep(options['interval'])
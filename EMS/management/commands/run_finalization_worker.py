@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+import time
+
+from EMS.jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Runs queued paper finalization jobs outside the web process."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit.")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds to sleep when the queue is empty.")
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending_jobs()
+            if count:
+                self.stdout.write(f"Processed {count} finalization job(s).")
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,291 @@
+from contextlib import contextmanager
+from django.conf import settings
+import atexit, contextvars, json, logging, math, os, random, tempfile, threading, time
+
+trace_logger = logging.getLogger('EMS.trace')
+
+# Timings of the pipeline stages (encryption, RSA, IPFS, chain, database writes) kept as
+# Prometheus histograms, plus counters, and served in the text exposition format on
+# /metrics. Recording is an in-memory update under a lock; nothing on the request path
+# talks to the database, a cache or the disk. With METRICS_DIR set (gunicorn and other
+# multi-process servers) a background thread in every process writes its totals to a
+# file of its own there every METRICS_FLUSH_INTERVAL seconds, and at exit; /metrics adds up
+# all the files, including those of workers that have exited, so counters never go
+# back. Empty METRICS_DIR when the server starts.
+#
+# Spans are also written as one JSON line each to the EMS.trace logger for a
+# METRICS_TRACE_SAMPLE_RATE fraction of calls; the default of 0 turns that off.
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGE_SECONDS = 'ems_stage_seconds'
+STAGE_ERRORS = 'ems_stage_errors_total'
+DB_WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE')
+
+HELP = {
+    STAGE_SECONDS: "Time spent in each pipeline stage.",
+    STAGE_ERRORS: "Pipeline stage calls that raised.",
+    'ems_reference_cache_events_total': "Reference cache lookups by outcome (EMS.refcache).",
+    'ems_prestage_events_total': "Pre-staged dashboard and file hits and misses (EMS.prestaging).",
+    'ems_view_requests_total': "Requests served by each EMS view.",
+    'ems_view_seconds_total': "Wall time spent in each EMS view.",
+    'ems_view_queries_total': "SQL queries run by each EMS view.",
+    'ems_view_sql_seconds_total': "Time each EMS view spent in SQL.",
+    'ems_view_rpc_seconds_total': "Time each EMS view spent in chain calls.",
+    'ems_view_ipfs_seconds_total': "Time each EMS view spent in IPFS calls.",
+}
+
+_histograms = {}  # stage -> [bucket counts..., +Inf count, sum]
+_counters = {}  # (name, ((label, value), ...)) -> value
+_lock = threading.Lock()
+_file_id = None
+_flusher = None
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+
+
+def _sampled():
+    rate = settings.METRICS_TRACE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def observe(stage, seconds):
+    if not settings.METRICS_ENABLED:
+        return
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = [0] * (len(BUCKETS) + 2)
+        index = 0
+        while index < len(BUCKETS) and seconds > BUCKETS[index]:
+            index += 1
+        histogram[index] += 1
+        histogram[-1] += seconds
+    _start_flusher()
+
+
+def inc(name, amount=1, **labels):
+    if not settings.METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+    _start_flusher()
+
+
+@contextmanager
+def timed(stage, **fields):
+    """Records the time spent in the block under `stage`; fields only go to sampled traces."""
+    if not settings.METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        inc(STAGE_ERRORS, stage=stage)
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        observe(stage, seconds)
+        totals = _request_stages.get()
+        if totals is not None:
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        if _sampled():
+            trace('span', stage=stage, ms=round(seconds * 1000, 3), error=error, **fields)
+
+
+@contextmanager
+def request_stages():
+    """Yields a dict that collects {stage: seconds} of what is timed in this context, e.g. one request.
+
+    Threads started inside do not inherit it, so work handed to the workers is not counted.
+    """
+    totals = {}
+    token = _request_stages.set(totals)
+    try:
+        yield totals
+    finally:
+        _request_stages.reset(token)
+
+
+def trace(event, **fields):
+    """Writes one JSON line to the EMS.trace logger; callers sample with trace_sampled()."""
+    trace_logger.info(json.dumps({'event': event, 'pid': os.getpid(), **fields}, default=str))
+
+
+def trace_sampled(event, **fields):
+    if _sampled():
+        trace(event, **fields)
+
+
+# --- Database writes -----------------------------------------------------------------
+
+def _time_db_write(execute, sql, params, many, context):
+    if not sql.lstrip()[:6].upper().startswith(DB_WRITE_PREFIXES):
+        return execute(sql, params, many, context)
+    with timed('db_write'):
+        return execute(sql, params, many, context)
+
+
+def _install_db_timer(sender, connection, **kwargs):
+    if settings.METRICS_ENABLED and _time_db_write not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_db_write)
+
+
+def connect_signals():
+    """Called from EmsConfig.ready(): times INSERT/UPDATE/DELETE statements on every new connection."""
+    from django.db.backends.signals import connection_created
+    connection_created.connect(_install_db_timer, dispatch_uid='metrics_db_write_timer')
+
+
+# --- Multi-process files -------------------------------------------------------------
+
+def snapshot():
+    """This process's histograms and counters, with the reference cache counters folded in."""
+    from .refcache import stats as reference_stats
+    with _lock:
+        histograms = {stage: list(values) for stage, values in _histograms.items()}
+        counters = [[name, dict(labels), value] for (name, labels), value in _counters.items()]
+    for namespace, values in reference_stats().items():
+        if isinstance(values, dict):  # skips 'entries'
+            for outcome in ('hit', 'shared_hit', 'miss'):
+                counters.append(['ems_reference_cache_events_total', {'namespace': namespace, 'outcome': outcome},
+                                 values[outcome]])
+    return {'histograms': histograms, 'counters': counters}
+
+
+def _path():
+    global _file_id
+    if _file_id is None:
+        _file_id = f"{os.getpid()}-{time.time_ns()}"
+    return os.path.join(settings.METRICS_DIR, f"{_file_id}.json")
+
+
+def flush():
+    """Writes this process's totals to METRICS_DIR, replacing its previous file atomically."""
+    if not settings.METRICS_DIR:
+        return
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=settings.METRICS_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp_path, _path())
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError:
+            pass  # tried again next interval
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is None and settings.METRICS_DIR:
+        with _lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_periodically, name="metrics-flusher", daemon=True)
+                _flusher.start()
+
+
+def _reset_after_fork():
+    # A forked worker starts from zero under a file and a flusher of its own; the
+    # parent's totals stay in the parent's file.
+    global _file_id, _flusher, _lock
+    _lock = threading.Lock()
+    _histograms.clear()
+    _counters.clear()
+    _file_id, _flusher = None, None
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        pass
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(_flush_at_exit)
+
+
+def collect():
+    """Histograms and counters summed over every process (or this one without METRICS_DIR)."""
+    if not settings.METRICS_DIR:
+        snapshots = [snapshot()]
+    else:
+        flush()
+        snapshots = []
+        for name in os.listdir(settings.METRICS_DIR):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(settings.METRICS_DIR, name)) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # removed or half-written by a process that died mid-flush
+
+    histograms, counters = {}, {}
+    for data in snapshots:
+        for stage, values in data['histograms'].items():
+            total = histograms.setdefault(stage, [0] * len(values))
+            for index, value in enumerate(values):
+                total[index] += value
+        for name, labels, value in data['counters']:
+            key = (name, tuple(sorted(labels.items())))
+            counters[key] = counters.get(key, 0) + value
+    return histograms, counters
+
+
+# --- Exposition ----------------------------------------------------------------------
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value) if math.isfinite(value) else ('+Inf' if value > 0 else '-Inf')
+    return str(value)
+
+
+def render():
+    """Everything in the Prometheus text format (version 0.0.4)."""
+    from .prestaging import COUNTERS, stats as prestage_stats
+    histograms, counters = collect()
+    # Pre-staging counts in its cache, which every process shares already.
+    prestage = prestage_stats()
+    for name in COUNTERS:
+        kind, outcome = name.split('_')
+        counters[('ems_prestage_events_total', (('kind', kind), ('outcome', outcome)))] = prestage[name]
+
+    lines = [f"# HELP {STAGE_SECONDS} {HELP[STAGE_SECONDS]}", f"# TYPE {STAGE_SECONDS} histogram"]
+    for stage in sorted(histograms):
+        values = histograms[stage]
+        cumulative = 0
+        for bound, count in zip((*BUCKETS, math.inf), values[:-1]):
+            cumulative += count
+            lines.append(f"{STAGE_SECONDS}_bucket{_labels([('stage', stage), ('le', _number(float(bound)))])} {cumulative}")
+        lines.append(f"{STAGE_SECONDS}_sum{_labels([('stage', stage)])} {_number(float(values[-1]))}")
+        lines.append(f"{STAGE_SECONDS}_count{_labels([('stage', stage)])} {cumulative}")
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for (counter, labels), value in sorted(counters.items()):
+            if counter == name:
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Forgets this process's totals; for tests."""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.19 on 2026-10-18 10:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EMS', '0025_finalpapers_contract_paper_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FinalizationJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('requested_by', models.CharField(default='None', max_length=150)),
+                ('status', models.CharField(choices=[('Queued', 'Queued'), ('Running', 'Running'), ('Completed', 'Completed'), ('Failed', 'Failed')], default='Queued', max_length=20)),
+                ('stage', models.CharField(blank=True, default='', max_length=30)),
+                ('stages', models.JSONField(blank=True, default=dict)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='finalization_jobs', to='EMS.request')),
+            ],
+        ),
+    ]
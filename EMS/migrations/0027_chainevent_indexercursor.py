@@ -0,0 +1,44 @@
+# Generated by Django 4.2.19 on 2026-10-18 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EMS', '0026_finalizationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexerCursor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_block', models.BigIntegerField(default=-1)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChainEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(max_length=20)),
+                ('tx_hash', models.CharField(max_length=100)),
+                ('log_index', models.IntegerField()),
+                ('block_number', models.BigIntegerField()),
+                ('block_hash', models.CharField(max_length=100)),
+                ('timestamp', models.DateTimeField(blank=True, null=True)),
+                ('initiator', models.CharField(blank=True, default='', max_length=150)),
+                ('filename', models.CharField(blank=True, default='', max_length=255)),
+                ('paper_id', models.BigIntegerField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-timestamp', '-block_number', '-log_index'], name='chainevent_history_idx'), models.Index(fields=['block_number'], name='chainevent_block_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='chainevent',
+            constraint=models.UniqueConstraint(fields=('tx_hash', 'log_index'), name='chainevent_unique_log'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.19 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EMS', '0027_chainevent_indexercursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='finalpapers',
+            name='ipfs_cid',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='finalpapers',
+            name='merkle_proof',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='finalpapers',
+            name='uploader',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.19 on 2026-10-18 10:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EMS', '0028_finalpapers_merkle_anchoring'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['course', 'semester', 'branch', 'subject'], name='user_subject_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='finalpapers',
+            index=models.Index(fields=['s_code'], name='finalpapers_scode_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='finalpapers',
+            index=models.Index(fields=['contract_paper_id'], name='finalpapers_contract_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(fields=['tusername', 'status'], name='request_teacher_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(fields=['s_code', 'status', 'id'], name='request_scode_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(condition=models.Q(('status__in', ['Pending', 'Accepted', 'Uploaded', 'Pending Finalization'])), fields=['tusername'], name='request_active_teacher_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.19 on 2026-10-18 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EMS', '0029_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='request',
+            name='encrypted_cid',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
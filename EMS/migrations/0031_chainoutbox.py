@@ -0,0 +1,36 @@
+# Generated by Django 4.2.19 on 2026-10-18 10:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EMS', '0030_request_encrypted_cid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChainOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('upload', 'upload'), ('download', 'download')], max_length=10)),
+                ('idempotency_key', models.CharField(max_length=100, unique=True)),
+                ('payload', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Sending', 'Sending'), ('Sent', 'Sent'), ('Done', 'Done'), ('Failed', 'Failed')], default='Pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('tx_hash', models.CharField(blank=True, max_length=100, null=True)),
+                ('batch_index', models.IntegerField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('paper', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chain_outbox', to='EMS.finalpapers')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='chainoutbox_due_idx'), models.Index(fields=['tx_hash'], name='chainoutbox_tx_idx')],
+            },
+        ),
+    ]
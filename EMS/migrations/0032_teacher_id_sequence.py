@@ -0,0 +1,26 @@
+# Generated by Django 4.2.19 on 2026-10-18 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EMS', '0031_chainoutbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customuser',
+            name='teacher_id',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        # Continues after the highest TEA-<n> already handed out.
+        migrations.RunSQL(
+            sql=[
+                "CREATE SEQUENCE ems_teacher_id_seq",
+                "SELECT setval('ems_teacher_id_seq', COALESCE((SELECT max(substring(teacher_id from '^TEA-([0-9]+)$')::bigint) FROM \"EMS_customuser\"), 0) + 1, false)",
+            ],
+            reverse_sql="DROP SEQUENCE ems_teacher_id_seq",
+        ),
+    ]
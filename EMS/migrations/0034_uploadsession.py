@@ -0,0 +1,29 @@
+# Generated by Django 4.2.19 on 2026-10-18 11:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EMS', '0033_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tusername', models.CharField(max_length=40)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('sha256', models.CharField(blank=True, default='', max_length=64)),
+                ('received', models.JSONField(blank=True, default=list)),
+                ('status', models.CharField(choices=[('Open', 'Open'), ('Complete', 'Complete')], default='Open', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='EMS.request')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.19 on 2026-10-18 11:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EMS', '0034_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='finalizationjob',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.19 on 2026-10-18 12:16
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EMS', '0035_finalizationjob_attempts'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='chainoutbox',
+            name='batch_index',
+        ),
+        migrations.RemoveField(
+            model_name='finalpapers',
+            name='merkle_proof',
+        ),
+    ]
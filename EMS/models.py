@@ -1,20 +1,22 @@
-from django.db import models
+from django.db import connection, models
 from django.contrib.auth.models import AbstractUser
 import datetime
 from django.contrib.postgres.fields import ArrayField
 from django.utils import timezone  # Import timezone for time-aware datetimes
 
+# Teacher ids come from a database sequence (migration 0032), so concurrent sign-ups
+# never get the same id. They are drawn when a user is first saved, not whenever a
+# CustomUser is instantiated; bulk_create() callers allocate a block up front.
+TEACHER_ID_SEQUENCE = 'ems_teacher_id_seq'
+
+def allocate_teacher_ids(count):
+    """Draws `count` teacher ids from the sequence in one query."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(%s) FROM generate_series(1, %s)", [TEACHER_ID_SEQUENCE, count])
+        return [f"TEA-{number}" for (number,) in cursor.fetchall()]
+
 def teacherID():
-    t_id = 'TEA-1'
-    try:
-        prev = CustomUser.objects.values('teacher_id').last()
-        prev = prev['teacher_id']
-        number = prev.split('-')[1]
-        number = int(number) + 1
-        t_id = 'TEA-' + str(number)
-    except:
-        t_id = 'TEA-1'
-    return t_id
+    return allocate_teacher_ids(1)[0]
 
 ROLE = (
     ('teacher','teacher'),
@@ -56,16 +58,30 @@ STATUS = (
 )
 
 class CustomUser(AbstractUser):
-    teacher_id = models.CharField(max_length=20, default=teacherID, blank=True)
+    teacher_id = models.CharField(max_length=20, default='', blank=True)  # TEA-<n>, assigned by save()
     course = models.CharField(max_length=4, choices=(('None','None'), ('B.E.',"B.E."), ('M.E.','M.E.')), default='None')
     semester = models.CharField(max_length=4, choices=SEM, default='None')
     branch = models.CharField(max_length=40, choices=BRANCH, default='None')
     subject = models.CharField(max_length=30, choices=SUB, default='None')
     role = models.CharField(max_length=20, choices=ROLE, default='teacher')
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['course', 'semester', 'branch', 'subject'], name='user_subject_idx'),  # get_teachers
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.teacher_id:
+            self.teacher_id = teacherID()
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.username
 
+# Requests a teacher is still working on; such a teacher is not offered for a new request.
+ACTIVE_REQUEST_STATUSES = ['Pending', 'Accepted', 'Uploaded', 'Pending Finalization']
+REQUEST_STATUSES = ACTIVE_REQUEST_STATUSES + ['Finalized']
+
 class Request(models.Model):
     tusername = models.CharField(max_length=40, default='None')
     s_code = models.CharField(max_length=7, default="None")
@@ -78,6 +94,14 @@ class Request(models.Model):
     enc_field = ArrayField(models.BinaryField(max_length=500, default=None), default=list)
     private_key = models.FileField(default=None)
     encrypted_file = models.CharField(max_length=255, blank=True, null=True)
+    encrypted_cid = models.CharField(max_length=100, blank=True, null=True)  # CID of encrypted_file, computed at upload (EMS.cid)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tusername', 'status'], name='request_teacher_status_idx'),  # teacher_dashboard
+            models.Index(fields=['s_code', 'status', 'id'], name='request_scode_status_idx'),  # get_teachers, st_dashboard
+            models.Index(fields=['tusername'], condition=models.Q(status__in=ACTIVE_REQUEST_STATUSES), name='request_active_teacher_idx'),
+        ]
 
     def __str__(self):
         return self.tusername
@@ -95,6 +119,14 @@ class FinalPapers(models.Model):
     download_tx_hash = models.CharField(max_length=100, blank=True, null=True,help_text="Blockchain transaction hash for the download event.")
     downloaded = models.BooleanField(default=False)
     contract_paper_id = models.IntegerField(null=True, blank=True) # ADDED: New field to store smart contract paper_id
+    ipfs_cid = models.CharField(max_length=100, blank=True, null=True)
+    uploader = models.CharField(max_length=40, blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['s_code'], name='finalpapers_scode_idx'),
+            models.Index(fields=['contract_paper_id'], name='finalpapers_contract_id_idx'),  # download lookup
+        ]
 
     def __str__(self):
         return self.s_code
@@ -104,4 +136,124 @@ class SubjectCode(models.Model):
     subject = models.CharField(max_length=40)
 
     def __str__(self):
-        return self.subject
\ No newline at end of file
+        return self.subject
+
+JOB_STATUS = (
+    ('Queued','Queued'),
+    ('Running','Running'),
+    ('Completed','Completed'),
+    ('Failed','Failed')
+)
+
+class FinalizationJob(models.Model):
+    request = models.ForeignKey(Request, on_delete=models.CASCADE, related_name='finalization_jobs')
+    requested_by = models.CharField(max_length=150, default='None')
+    status = models.CharField(max_length=20, choices=JOB_STATUS, default='Queued')
+    stage = models.CharField(max_length=30, blank=True, default='')
+    stages = models.JSONField(default=dict, blank=True)  # Per-stage progress: {stage: {"status", "started", "finished"}}
+    error = models.TextField(blank=True, default='')
+    attempts = models.IntegerField(default=0)  # Times a worker has started it (EMS.jobs.claim_next_job)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Job {self.id} ({self.status})"
+
+class ChainEvent(models.Model):
+    """A decoded PaperStorage event, kept up to date by EMS.indexer."""
+    event_type = models.CharField(max_length=20)  # 'Upload' or 'Download'
+    tx_hash = models.CharField(max_length=100)
+    log_index = models.IntegerField()
+    block_number = models.BigIntegerField()
+    block_hash = models.CharField(max_length=100)
+    timestamp = models.DateTimeField(null=True, blank=True)
+    initiator = models.CharField(max_length=150, blank=True, default='')
+    filename = models.CharField(max_length=255, blank=True, default='')
+    paper_id = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tx_hash', 'log_index'], name='chainevent_unique_log'),
+        ]
+        indexes = [
+            models.Index(fields=['-timestamp', '-block_number', '-log_index'], name='chainevent_history_idx'),
+            models.Index(fields=['block_number'], name='chainevent_block_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.tx_hash}"
+
+class IndexerCursor(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    last_block = models.BigIntegerField(default=-1)  # Highest block whose events are indexed
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_block}"
+
+OUTBOX_KIND = (
+    ('upload','upload'),
+    ('download','download')
+)
+
+OUTBOX_STATUS = (
+    ('Pending','Pending'),
+    ('Sending','Sending'),
+    ('Sent','Sent'),
+    ('Done','Done'),
+    ('Failed','Failed')
+)
+
+class ChainOutbox(models.Model):
+    """A contract transaction queued with the change it records and sent by EMS.outbox."""
+    kind = models.CharField(max_length=10, choices=OUTBOX_KIND)
+    idempotency_key = models.CharField(max_length=100, unique=True)  # e.g. 'download:<FinalPapers id>'
+    paper = models.ForeignKey(FinalPapers, on_delete=models.CASCADE, related_name='chain_outbox')
+    payload = models.JSONField(default=dict)  # Contract call arguments
+    status = models.CharField(max_length=10, choices=OUTBOX_STATUS, default='Pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    tx_hash = models.CharField(max_length=100, blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='chainoutbox_due_idx'),
+            models.Index(fields=['tx_hash'], name='chainoutbox_tx_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.idempotency_key} ({self.status})"
+
+class Blob(models.Model):
+    """A file kept once by its SHA-256 in the content-addressed store (EMS.blobstore)."""
+    name = models.CharField(max_length=255, unique=True)  # storage name, e.g. 'blobs/ab/cd/<sha256>.pdf'
+    sha256 = models.CharField(max_length=64)
+    size = models.BigIntegerField()
+    refcount = models.IntegerField(default=0)  # FileField values pointing at this blob
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} x{self.refcount}"
+
+UPLOAD_STATUS = (
+    ('Open','Open'),
+    ('Complete','Complete')
+)
+
+class UploadSession(models.Model):
+    """A resumable paper upload (EMS.uploads): chunks land in UPLOAD_STAGING_ROOT until it is completed."""
+    request = models.ForeignKey(Request, on_delete=models.CASCADE, related_name='upload_sessions')
+    tusername = models.CharField(max_length=40)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True, default='')  # declared by the client, then the computed digest
+    received = models.JSONField(default=list, blank=True)  # merged [start, end) byte ranges on disk
+    status = models.CharField(max_length=10, choices=UPLOAD_STATUS, default='Open')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} for request {self.request_id} ({self.status})"
@@ -0,0 +1,291 @@
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+import datetime, logging, threading
+
+from .models import ChainOutbox, FinalPapers
+from .blockchain import paper_id_from_receipt, submit_download_event, submit_paper_upload
+from .prestaging import invalidate_dashboard
+from .tx_submitter import reset_nonce
+from .web3_client import get_client
+
+logger = logging.getLogger(__name__)
+
+# Contract transactions are written to the ChainOutbox table in the same database
+# transaction as the change they record, so requests never wait on the chain and no
+# event is lost when the node is slow or down. A worker (in-process, or
+# `manage.py run_chain_outbox`) sends what is due, pipelined, and fills in the tx
+# hashes once mined.
+# A row's tx hash is saved before its receipt is awaited: after a crash the worker
+# looks that transaction up instead of sending it again. The idempotency key keeps
+# the same event from being queued twice.
+
+
+def enqueue_upload(paper, ipfs_hash, uploader):
+    """Queues the uploadPaper record of a finalized paper. Call inside the transaction that saves it."""
+    payload = {'cid': ipfs_hash, 'filename': paper.filename, 'uploader': uploader}
+    return _enqueue('upload', f"upload:{paper.id}", paper, payload)
+
+
+def enqueue_download(paper, username):
+    """Queues the recordDownload event of a claimed paper. Call inside the transaction that claims it."""
+    payload = {'paper_id': paper.contract_paper_id, 'filename': paper.filename, 'username': username}
+    return _enqueue('download', f"download:{paper.id}", paper, payload)
+
+
+# One statement claims the paper and queues its download event: the conditional UPDATE
+# lets exactly one of any number of concurrent claims through, and the INSERT only sees
+# the row that UPDATE returned. The outer `NOT downloaded` is what Postgres re-checks
+# when a concurrent claim of the same row commits first.
+CLAIM_DOWNLOAD_SQL = """
+WITH claimed AS (
+    UPDATE {papers} SET downloaded = true
+    WHERE id = (SELECT id FROM {papers} WHERE contract_paper_id = %s AND NOT downloaded ORDER BY id LIMIT 1)
+      AND NOT downloaded
+    RETURNING *
+), queued AS (
+    INSERT INTO {outbox} (kind, idempotency_key, paper_id, payload, status, attempts, next_attempt_at, last_error, created_at, updated_at)
+    SELECT 'download', 'download:' || id, id,
+           jsonb_build_object('paper_id', contract_paper_id, 'filename', filename, 'username', %s::text),
+           'Pending', 0, now(), '', now(), now()
+    FROM claimed
+    ON CONFLICT (idempotency_key) DO NOTHING
+)
+SELECT * FROM claimed
+"""
+
+
+def claim_download(contract_paper_id, username):
+    """Marks a paper downloaded and queues its download event in one round trip.
+
+    Returns the paper, or None when there is no such paper or it was already claimed.
+    """
+    quote = connection.ops.quote_name
+    sql = CLAIM_DOWNLOAD_SQL.format(papers=quote(FinalPapers._meta.db_table), outbox=quote(ChainOutbox._meta.db_table))
+    claimed = list(FinalPapers.objects.raw(sql, [contract_paper_id, username]))
+    if not claimed:
+        return None
+    transaction.on_commit(wake_worker)
+    return claimed[0]
+
+
+def _enqueue(kind, key, paper, payload):
+    entry, _ = ChainOutbox.objects.get_or_create(idempotency_key=key, defaults={'kind': kind, 'paper': paper, 'payload': payload})
+    transaction.on_commit(wake_worker)
+    return entry
+
+
+# --- Sending -------------------------------------------------------------------------
+
+def claim_due(limit):
+    """Marks up to `limit` due rows as being sent and returns them."""
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(ChainOutbox.objects.select_for_update(skip_locked=True)
+                    .filter(status='Pending', next_attempt_at__lte=now).order_by('id')[:limit])
+        ChainOutbox.objects.filter(id__in=[row.id for row in rows]).update(
+            status='Sending', attempts=F('attempts') + 1, updated_at=now)
+    for row in rows:
+        row.status = 'Sending'
+        row.attempts += 1
+    return rows
+
+
+def _submit(rows):
+    """Sends transactions for claimed rows. Returns [(rows, Future)], one pair per transaction."""
+    uploads = [row for row in rows if row.kind == 'upload']
+    downloads = [row for row in rows if row.kind == 'download']
+    sent = []
+
+    def send(group, submit):
+        try:
+            future = submit()
+        except Exception as e:
+            logger.warning("Sending %s failed: %s", ', '.join(row.idempotency_key for row in group), e)
+            _retry(group, e)
+            return
+        for row in group:
+            row.status, row.tx_hash, row.updated_at = 'Sent', future.tx_hash, timezone.now()
+        ChainOutbox.objects.bulk_update(group, ['status', 'tx_hash', 'updated_at'])
+        sent.append((group, future))
+
+    for row in uploads:
+        send([row], lambda row=row: submit_paper_upload(row.payload['cid'], row.payload['filename'], row.payload['uploader']))
+    for row in downloads:
+        send([row], lambda row=row: submit_download_event(row.payload['paper_id'], row.payload['filename'], row.payload['username']))
+    return sent
+
+
+def _apply(rows, receipt):
+    """Copies a mined transaction onto the papers of its rows and marks them done."""
+    tx_hash = receipt.transactionHash.hex()
+    uploads = [row for row in rows if row.kind == 'upload']
+
+    with transaction.atomic():
+        for row in rows:
+            if row.kind == 'download':
+                FinalPapers.objects.filter(id=row.paper_id).update(download_tx_hash=tx_hash)
+            else:
+                FinalPapers.objects.filter(id=row.paper_id).update(
+                    blockchain_status="Recorded", tx_hash=tx_hash, contract_paper_id=paper_id_from_receipt(receipt),
+                    ipfs_cid=row.payload['cid'], uploader=row.payload['uploader'])
+        ChainOutbox.objects.filter(id__in=[row.id for row in rows]).update(
+            status='Done', tx_hash=tx_hash, last_error='', updated_at=timezone.now())
+    if uploads:
+        invalidate_dashboard()  # the papers can now be claimed
+
+
+def _retry(rows, error):
+    """Puts rows back in the queue with exponential backoff, or fails them after too many attempts."""
+    now = timezone.now()
+    for row in rows:
+        row.updated_at = now
+        row.last_error = str(error)
+        row.tx_hash = None
+        if row.attempts >= settings.CHAIN_OUTBOX_MAX_ATTEMPTS:
+            row.status = 'Failed'
+            logger.error("Giving up on %s after %d attempts: %s", row.idempotency_key, row.attempts, error)
+        else:
+            row.status = 'Pending'
+            delay = min(settings.CHAIN_OUTBOX_RETRY_DELAY * 2 ** (row.attempts - 1), settings.CHAIN_OUTBOX_MAX_RETRY_DELAY)
+            row.next_attempt_at = now + datetime.timedelta(seconds=delay)
+    ChainOutbox.objects.bulk_update(rows, ['status', 'last_error', 'tx_hash', 'next_attempt_at', 'updated_at'])
+
+
+def _settle(rows, future):
+    from web3.exceptions import TimeExhausted
+    try:
+        receipt = future.result(timeout=settings.BLOCKCHAIN_RECEIPT_TIMEOUT)
+    except (TimeExhausted, TimeoutError):
+        return  # still Sent; looked up again by recover_stale()
+    except Exception as e:
+        _retry(rows, e)
+        return
+    try:
+        _apply(rows, receipt)
+    except Exception as e:
+        logger.exception("Recording transaction %s failed", future.tx_hash)
+        ChainOutbox.objects.filter(id__in=[row.id for row in rows]).update(last_error=str(e))
+
+
+def recover_stale():
+    """Resolves rows left Sending or Sent by a worker that stopped, e.g. a restarted process."""
+    cutoff = timezone.now() - datetime.timedelta(seconds=2 * settings.BLOCKCHAIN_RECEIPT_TIMEOUT)
+    stale = list(ChainOutbox.objects.filter(Q(status='Sending') | Q(status='Sent'), updated_at__lt=cutoff))
+    by_tx = {}
+    for row in stale:
+        by_tx.setdefault(row.tx_hash, []).append(row)
+
+    # Never got a hash back: the node most likely did not take the transaction.
+    unsent = by_tx.pop(None, [])
+    for row in unsent:
+        row.status = 'Pending'
+        row.next_attempt_at = row.updated_at = timezone.now()
+    ChainOutbox.objects.bulk_update(unsent, ['status', 'next_attempt_at', 'updated_at'])
+
+    from hexbytes import HexBytes
+    from web3.exceptions import TransactionNotFound
+    eth = get_client().web3.eth
+    for tx_hash, rows in by_tx.items():
+        try:
+            receipt = eth.get_transaction_receipt(HexBytes(tx_hash))
+        except TransactionNotFound:
+            # No receipt is also what a transaction still waiting in the mempool gets.
+            # Sending it again would record the event twice, so only a transaction the
+            # node no longer knows at all counts as dropped.
+            try:
+                eth.get_transaction(HexBytes(tx_hash))
+            except TransactionNotFound:
+                _retry(rows, f"Transaction {tx_hash} was dropped.")
+            else:
+                ChainOutbox.objects.filter(id__in=[row.id for row in rows]).update(updated_at=timezone.now())
+            continue
+        if receipt['status'] != 1:
+            _retry(rows, f"Transaction {tx_hash} reverted.")
+        else:
+            _apply(rows, receipt)
+    return len(stale)
+
+
+# Nonces are assigned by the sending process, so two processes sending from the same
+# account (an in-process worker in every web worker, run_chain_outbox, a command waiting
+# on its papers) would reuse them. drain() only sends while it holds a session-level
+# advisory lock, and starts from the node's nonce each time it takes it.
+SENDER_LOCK_ID = 0x54455853
+
+
+def _sender_lock(acquire):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {'pg_try_advisory_lock' if acquire else 'pg_advisory_unlock'}(%s)", [SENDER_LOCK_ID])
+        return cursor.fetchone()[0]
+
+
+def drain():
+    """Sends everything that is due and waits for it to be mined. Returns the number of rows processed.
+
+    Returns 0 right away while another process or thread is sending.
+    """
+    if not _sender_lock(True):
+        return 0
+    try:
+        reset_nonce()
+        recover_stale()
+        count = 0
+        while True:
+            rows = claim_due(settings.CHAIN_OUTBOX_BATCH_SIZE)
+            if not rows:
+                return count
+            for group, future in _submit(rows):
+                _settle(group, future)
+            count += len(rows)
+    finally:
+        _sender_lock(False)
+
+
+# --- In-process worker ---------------------------------------------------------------
+
+_worker = None
+_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def _worker_loop():
+    while True:
+        _wakeup.clear()
+        close_old_connections()
+        try:
+            drain()
+        except Exception:
+            logger.exception("Chain outbox worker error")
+        finally:
+            close_old_connections()
+        _wakeup.wait(settings.CHAIN_OUTBOX_POLL_INTERVAL)
+
+
+def start_worker():
+    """Starts the in-process outbox worker once per process."""
+    global _worker
+    with _lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_worker_loop, name="chain-outbox-worker", daemon=True)
+            _worker.start()
+
+
+def wake_worker():
+    if settings.CHAIN_OUTBOX_RUN_IN_PROCESS:
+        start_worker()
+    _wakeup.set()
+
+
+def wait_for_papers(paper_ids, timeout):
+    """Sends what is due and waits until every row of these papers is done or failed, e.g. before a command exits."""
+    deadline = timezone.now() + datetime.timedelta(seconds=timeout)
+    drain()
+    # Rows another sender picked up first are finished by that sender.
+    while ChainOutbox.objects.filter(paper_id__in=paper_ids, status__in=['Pending', 'Sending', 'Sent']).exists():
+        if timezone.now() >= deadline:
+            return False
+        _wakeup.wait(settings.BLOCKCHAIN_RECEIPT_POLL_INTERVAL)
+        drain()
+    return True
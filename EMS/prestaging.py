@@ -0,0 +1,235 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.models import BooleanField, Case, DurationField, ExpressionWrapper, F, OuterRef, Subquery, Value, When
+from django.utils import timezone
+import datetime, logging, os, shutil, threading
+
+from .models import Request, FinalPapers
+
+logger = logging.getLogger(__name__)
+
+# Superintendent downloads all happen in the PAPER_DOWNLOAD_WINDOW_MINUTES before an
+# exam. A scheduler looks PRESTAGE_LEAD_MINUTES further ahead and, for every paper
+# whose window is about to open, reads it into the page cache (or copies it into
+# PAPER_STAGING_ROOT) and computes the first dashboard pages into the PRESTAGE_CACHE
+# cache. The dashboard and download views count hits and misses in the same cache.
+
+PAPER_FIELDS = ('id', 's_code', 'course', 'semester', 'branch', 'subject', 'downloaded', 'contract_paper_id')
+COUNTERS = ('dashboard_hit', 'dashboard_miss', 'file_hit', 'file_miss')
+VERSION_KEY = 'prestage:dashboard:version'
+
+
+def get_cache():
+    return caches[settings.PRESTAGE_CACHE]
+
+
+def count(name):
+    cache = get_cache()
+    key = f'prestage:metrics:{name}'
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:  # evicted between add() and incr()
+        cache.set(key, 1, None)
+
+
+def stats():
+    """Counters and hit rates since the cache was last cleared."""
+    values = get_cache().get_many([f'prestage:metrics:{name}' for name in COUNTERS])
+    result = {name: values.get(f'prestage:metrics:{name}', 0) for name in COUNTERS}
+    for kind in ('dashboard', 'file'):
+        total = result[f'{kind}_hit'] + result[f'{kind}_miss']
+        result[f'{kind}_hit_rate'] = result[f'{kind}_hit'] / total if total else None
+    return result
+
+
+def reset_stats():
+    get_cache().delete_many([f'prestage:metrics:{name}' for name in COUNTERS])
+
+
+def papers_with_exam_time():
+    """FinalPapers annotated with the exam time of the finalized request for the same subject code."""
+    exam_time = Request.objects.filter(s_code=OuterRef('s_code'), status="Finalized").order_by('id').values('exam_time')[:1]
+    return FinalPapers.objects.annotate(exam_time=Subquery(exam_time))
+
+
+# --- Superintendent dashboard rows ---------------------------------------------------
+
+def _dashboard_key(page):
+    version = get_cache().get_or_set(VERSION_KEY, 1, None)
+    return f'prestage:dashboard:{version}:{page}'
+
+
+def invalidate_dashboard():
+    """Drops every cached dashboard page, e.g. after a paper is finalized or claimed."""
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def load_dashboard_page(page, now=None):
+    """Rows of one dashboard page plus one extra row, which tells whether there is a next page."""
+    # One query: the exam time comes from the finalized request for the same subject code,
+    # and the download window is evaluated by the database.
+    now = now or timezone.now()
+    window = datetime.timedelta(minutes=settings.PAPER_DOWNLOAD_WINDOW_MINUTES)
+    page_size = settings.ST_DASHBOARD_PAGE_SIZE
+    queryset = (papers_with_exam_time()
+                # Papers are claimed by contract id, which the outbox fills in once the upload is mined.
+                .filter(exam_time__gte=now - datetime.timedelta(hours=settings.ST_DASHBOARD_LOOKBACK_HOURS),
+                        contract_paper_id__isnull=False)
+                .annotate(
+                    downloadable=Case(When(exam_time__lte=now + window, then=Value(True)), default=Value(False), output_field=BooleanField()),
+                    timediff=ExpressionWrapper(F('exam_time') - Value(now), output_field=DurationField()),
+                )
+                .order_by('exam_time', 'id')
+                .values(*PAPER_FIELDS, 'exam_time', 'downloadable', 'timediff'))
+    return list(queryset[(page - 1) * page_size:page * page_size + 1])
+
+
+def dashboard_page(page):
+    """Returns (rows, has_next) for the superintendent dashboard, from the cache when possible."""
+    cache = get_cache()
+    key = _dashboard_key(page)
+    rows = cache.get(key)
+    if rows is None:
+        count('dashboard_miss')
+        rows = load_dashboard_page(page)
+        cache.set(key, rows, settings.PRESTAGE_DASHBOARD_TTL)
+    else:
+        count('dashboard_hit')
+        # Cached rows may be a minute old; the window fields depend on the current time.
+        now = timezone.now()
+        window = datetime.timedelta(minutes=settings.PAPER_DOWNLOAD_WINDOW_MINUTES)
+        for row in rows:
+            row['downloadable'] = row['exam_time'] <= now + window
+            row['timediff'] = row['exam_time'] - now
+    page_size = settings.ST_DASHBOARD_PAGE_SIZE
+    return rows[:page_size], len(rows) > page_size
+
+
+# --- Paper files ---------------------------------------------------------------------
+
+def _paper_key(paper_id):
+    return f'prestage:paper:{paper_id}'
+
+
+def staged_path(paper_id):
+    return os.path.join(settings.PAPER_STAGING_ROOT, f"{paper_id}.pdf")
+
+
+def warm_page_cache(path):
+    """Reads a file once so the download that follows is served from memory."""
+    with open(path, 'rb') as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        while f.read(1024 * 1024):
+            pass
+
+
+def stage_paper(paper_id, path, until):
+    """Copies or warms one paper and remembers where it is served from until `until`."""
+    if settings.PAPER_STAGING_ROOT and not settings.PAPER_DOWNLOAD_ACCEL_REDIRECT:
+        os.makedirs(settings.PAPER_STAGING_ROOT, exist_ok=True)
+        target = staged_path(paper_id)
+        if not os.path.exists(target):
+            partial = f"{target}.{os.getpid()}.part"
+            shutil.copyfile(path, partial)
+            os.replace(partial, target)
+        path = target
+    warm_page_cache(path)
+    timeout = max(int((until - timezone.now()).total_seconds()), 1)
+    get_cache().set(_paper_key(paper_id), path, timeout)
+
+
+def paper_path(paper):
+    """The path to serve a paper from: its staged copy when there is one. Counts hits and misses."""
+    staged = get_cache().get(_paper_key(paper.id))
+    if staged and os.path.exists(staged):
+        count('file_hit')
+        return staged
+    count('file_miss')
+    return paper.paper.path
+
+
+def remove_expired(keep_ids):
+    """Deletes staged copies of papers that are no longer in an upcoming or current window."""
+    if not settings.PAPER_STAGING_ROOT or not os.path.isdir(settings.PAPER_STAGING_ROOT):
+        return 0
+    removed = 0
+    for name in os.listdir(settings.PAPER_STAGING_ROOT):
+        stem, ext = os.path.splitext(name)
+        if ext == '.pdf' and stem.isdigit() and int(stem) not in keep_ids:
+            os.remove(os.path.join(settings.PAPER_STAGING_ROOT, name))
+            removed += 1
+    return removed
+
+
+# --- Scheduler -----------------------------------------------------------------------
+
+def run_once(now=None):
+    """Stages every paper whose download window opens within the lead time. Returns a summary."""
+    now = now or timezone.now()
+    window = datetime.timedelta(minutes=settings.PAPER_DOWNLOAD_WINDOW_MINUTES)
+    lead = datetime.timedelta(minutes=settings.PRESTAGE_LEAD_MINUTES)
+    keep = datetime.timedelta(minutes=settings.PRESTAGE_KEEP_MINUTES)
+    papers = list(papers_with_exam_time()
+                  .filter(exam_time__gt=now - keep, exam_time__lte=now + window + lead, downloaded=False)
+                  .order_by('exam_time', 'id'))
+
+    cache = get_cache()
+    known = cache.get_many([_paper_key(paper.id) for paper in papers])
+    staged = failed = 0
+    for paper in papers:
+        path = known.get(_paper_key(paper.id))
+        if path and os.path.exists(path):
+            continue
+        try:
+            stage_paper(paper.id, paper.paper.path, paper.exam_time + keep)
+            staged += 1
+        except OSError as e:
+            failed += 1
+            logger.warning("Could not pre-stage paper %s: %s", paper.id, e)
+
+    # Recompute the first dashboard pages so the first superintendent gets them from the cache.
+    if papers:
+        invalidate_dashboard()
+        for page in range(1, settings.PRESTAGE_DASHBOARD_PAGES + 1):
+            rows = load_dashboard_page(page, now)
+            cache.set(_dashboard_key(page), rows, settings.PRESTAGE_DASHBOARD_TTL)
+            if len(rows) <= settings.ST_DASHBOARD_PAGE_SIZE:
+                break
+
+    removed = remove_expired({paper.id for paper in papers})
+    return {'upcoming': len(papers), 'staged': staged, 'failed': failed, 'removed': removed}
+
+
+_scheduler = None
+_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def _scheduler_loop():
+    while not _stop.is_set():
+        try:
+            summary = run_once()
+            if summary['staged'] or summary['failed'] or summary['removed']:
+                logger.info("Pre-staging: %s", summary)
+        except Exception:
+            logger.exception("Pre-staging run failed")
+        finally:
+            connections.close_all()
+        _stop.wait(settings.PRESTAGE_INTERVAL)
+
+
+def start_scheduler():
+    """Starts the in-process scheduler thread once per process."""
+    global _scheduler
+    if _scheduler is None:
+        with _lock:
+            if _scheduler is None:
+                _scheduler = threading.Thread(target=_scheduler_loop, name="prestage-scheduler", daemon=True)
+                _scheduler.start()
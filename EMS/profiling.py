@@ -0,0 +1,248 @@
+from collections import Counter
+from django.conf import settings
+from django.db import connection
+import json, os, random, sys, sysconfig, threading, time
+
+from . import metrics
+
+# Per-request accounting for the EMS views: every request counts its SQL queries and
+# SQL time, the chain and IPFS time of the stages timed in its thread (EMS.metrics) and
+# its wall time, per view, into /metrics. A REQUEST_PROFILE_RATE fraction of requests,
+# and with REQUEST_PROFILE_SLOW_MS set every request slower than that, is also profiled:
+# one sampler thread per process records the stack of each profiled request thread every
+# REQUEST_PROFILE_INTERVAL_MS, and the folded stacks are written with the request's
+# accounting to REQUEST_PROFILE_DIR, which keeps the newest REQUEST_PROFILE_MAX_FILES.
+# The slow threshold is only known at the end, so while it is set every request is
+# sampled and the samples of the fast ones are dropped. `manage.py profile_summary`
+# reads the directory back.
+
+MAX_DEPTH = 128
+# Stripped from file names in stacks, longest first: 'EMS/views.py', 'django/db/...'.
+_PREFIXES = sorted({str(settings.BASE_DIR), *sysconfig.get_paths().values()}, key=len, reverse=True)
+
+
+class QueryTimer:
+    """A connection execute wrapper counting the queries and SQL time of one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+# --- Sampling ------------------------------------------------------------------------
+
+_names = {}  # code object -> 'EMS/views.py:st_dashboard:271'
+
+
+def _name(code):
+    name = _names.get(code)
+    if name is None:
+        filename = code.co_filename
+        for prefix in _PREFIXES:
+            if filename.startswith(prefix + os.sep):
+                filename = filename[len(prefix) + 1:]
+                break
+        name = _names[code] = f"{filename}:{code.co_name}:{code.co_firstlineno}"
+    return name
+
+
+def fold(frame):
+    """The stack of a frame as 'outermost;...;innermost', the folded format flame graph tools read."""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler:
+    """Records the stack of every registered thread each `interval` seconds, from one daemon thread."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._stacks = {}  # thread id -> Counter of folded stacks
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def register(self, thread_id):
+        with self._lock:
+            self._stacks[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-sampler", daemon=True)
+                self._thread.start()
+        self._active.set()
+
+    def unregister(self, thread_id):
+        """Stops sampling a thread and returns its stacks."""
+        with self._lock:
+            return self._stacks.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            self._active.wait()  # nothing to sample: sleep until the next register()
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._stacks:
+                    self._active.clear()
+                    continue
+                frames = sys._current_frames()
+                for thread_id, stacks in self._stacks.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[fold(frame)] += 1
+
+
+_sampler = None
+_lock = threading.Lock()
+
+
+def get_sampler():
+    global _sampler
+    if _sampler is None:
+        with _lock:
+            if _sampler is None:
+                _sampler = Sampler(settings.REQUEST_PROFILE_INTERVAL_MS / 1000)
+    return _sampler
+
+
+def _reset_after_fork():
+    global _sampler, _lock
+    _sampler, _lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# --- Middleware ----------------------------------------------------------------------
+
+class RequestProfilingMiddleware:
+    """Accounts SQL, chain, IPFS and wall time per EMS view and keeps the profiles of sampled or slow requests."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = settings.REQUEST_PROFILE_RATE
+        sampled = rate > 0 and random.random() < rate
+        profiling = sampled or settings.REQUEST_PROFILE_SLOW_MS is not None
+        thread_id = threading.get_ident()
+        if profiling:
+            get_sampler().register(thread_id)
+        queries = QueryTimer()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(queries), metrics.request_stages() as stages:
+                response = self.get_response(request)
+        finally:
+            samples = get_sampler().unregister(thread_id) if profiling else None
+        wall = time.perf_counter() - started
+
+        match = request.resolver_match
+        if match is None or not match.func.__module__.startswith('EMS.'):
+            return response  # admin, static files, 404s
+        view = match.url_name or match.func.__name__
+        record = {
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'wall_ms': round(wall * 1000, 3),
+            'queries': queries.count,
+            'sql_ms': round(queries.seconds * 1000, 3),
+            'rpc_ms': round(1000 * sum(seconds for stage, seconds in stages.items() if stage.startswith('chain_')), 3),
+            'ipfs_ms': round(1000 * sum(seconds for stage, seconds in stages.items() if stage.startswith('ipfs_')), 3),
+        }
+        account(record)
+        slow = settings.REQUEST_PROFILE_SLOW_MS is not None and record['wall_ms'] >= settings.REQUEST_PROFILE_SLOW_MS
+        if sampled or slow:
+            try:
+                save_profile(record, samples, 'slow' if slow else 'sampled')
+            except OSError:
+                pass  # a full or missing disk must not fail the request
+        return response
+
+
+def account(record):
+    view = record['view']
+    metrics.inc('ems_view_requests_total', view=view)
+    metrics.inc('ems_view_seconds_total', record['wall_ms'] / 1000, view=view)
+    metrics.inc('ems_view_queries_total', record['queries'], view=view)
+    metrics.inc('ems_view_sql_seconds_total', record['sql_ms'] / 1000, view=view)
+    metrics.inc('ems_view_rpc_seconds_total', record['rpc_ms'] / 1000, view=view)
+    metrics.inc('ems_view_ipfs_seconds_total', record['ipfs_ms'] / 1000, view=view)
+
+
+# --- Profile files -------------------------------------------------------------------
+
+def save_profile(record, samples, reason):
+    """Writes one request's profile and removes the oldest beyond REQUEST_PROFILE_MAX_FILES."""
+    directory = settings.REQUEST_PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    profile = dict(record, reason=reason, pid=os.getpid(), time=time.time(),
+                   interval_ms=settings.REQUEST_PROFILE_INTERVAL_MS, samples=(samples or Counter()).most_common())
+    name = f"{time.time_ns()}-{os.getpid()}-{record['view']}.json"
+    with open(os.path.join(directory, name + '.tmp'), 'w') as f:
+        json.dump(profile, f)
+    os.replace(os.path.join(directory, name + '.tmp'), os.path.join(directory, name))
+
+    names = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+    for old in names[:max(len(names) - settings.REQUEST_PROFILE_MAX_FILES, 0)]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except FileNotFoundError:
+            pass  # rotated by another process
+
+
+def load_profiles(directory=None, view=None):
+    directory = directory or settings.REQUEST_PROFILE_DIR
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                profile = json.load(f)
+        except (OSError, ValueError):
+            continue  # rotated away or being written
+        if view is None or profile['view'] == view:
+            profiles.append(profile)
+    return profiles
+
+
+def hottest(profiles, limit=20, sort='self'):
+    """[(function, self samples, cumulative samples)] over all profiles, plus the total sample count.
+
+    Self samples had the function innermost; cumulative ones had it anywhere on the stack.
+    """
+    own, cumulative, total = Counter(), Counter(), 0
+    for profile in profiles:
+        for stack, count in profile['samples']:
+            names = stack.split(';')
+            own[names[-1]] += count
+            for name in set(names):
+                cumulative[name] += count
+            total += count
+    ranked = sorted(cumulative, key=lambda name: (own[name], cumulative[name]) if sort == 'self' else cumulative[name],
+                    reverse=True)
+    return [(name, own[name], cumulative[name]) for name in ranked[:limit]], total
+
+
+def by_view(profiles):
+    """{view: averages of the accounting fields} over the profiles of each view."""
+    fields = ('wall_ms', 'queries', 'sql_ms', 'rpc_ms', 'ipfs_ms')
+    grouped = {}
+    for profile in profiles:
+        grouped.setdefault(profile['view'], []).append(profile)
+    return {view: {'profiles': len(group), **{field: sum(p[field] for p in group) / len(group) for field in fields}}
+            for view, group in sorted(grouped.items())}
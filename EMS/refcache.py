@@ -0,0 +1,143 @@
+from collections import Counter, OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+import threading, time
+
+from .models import Request, SubjectCode, ACTIVE_REQUEST_STATUSES
+
+# Reference data behind the COE teacher dropdown (subject codes and the set of teachers
+# with an active request) changes rarely but is read on every selection. It is kept in
+# a per-process LRU, bounded by REFERENCE_CACHE_MAX_ENTRIES and REFERENCE_CACHE_TTL.
+# Entries are grouped in namespaces with a version each; a post_save/post_delete of
+# Request or SubjectCode bumps the version, so stale entries are never returned. With
+# REFERENCE_CACHE_SHARED naming a cache alias the versions and loaded values live there
+# too, which carries invalidations to every process on the machine.
+# Without it another process can serve a stale busy set for up to the TTL, so the cache
+# only filters the dropdown; add_teacher checks the database before creating a request.
+
+SUBJECT_CODES = 'subject_code'
+ACTIVE_TEACHERS = 'active_teachers'
+
+_entries = OrderedDict()  # (namespace, key) -> (version, expires, value)
+_versions = Counter()
+_counters = Counter()
+_lock = threading.Lock()
+
+
+def _shared():
+    return caches[settings.REFERENCE_CACHE_SHARED] if settings.REFERENCE_CACHE_SHARED else None
+
+
+def _version(namespace):
+    shared = _shared()
+    if shared is None:
+        return _versions[namespace]
+    return shared.get_or_set(f'refcache:version:{namespace}', 1, None)
+
+
+def get(namespace, key, loader):
+    """The cached value for (namespace, key), calling loader() on a miss."""
+    version = _version(namespace)
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get((namespace, key))
+        if entry and entry[0] == version and entry[1] > now:
+            _entries.move_to_end((namespace, key))
+            _counters[f'{namespace}_hit'] += 1
+            return entry[2]
+
+    shared = _shared()
+    shared_key = f'refcache:{namespace}:{version}:{key}'
+    value = shared.get(shared_key) if shared is not None else None
+    if value is None:
+        value = loader()
+        if shared is not None:
+            shared.set(shared_key, value, settings.REFERENCE_CACHE_TTL)
+        outcome = 'miss'
+    else:
+        outcome = 'shared_hit'
+
+    with _lock:
+        _counters[f'{namespace}_{outcome}'] += 1
+        _entries[(namespace, key)] = (version, now + settings.REFERENCE_CACHE_TTL, value)
+        _entries.move_to_end((namespace, key))
+        while len(_entries) > settings.REFERENCE_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+    return value
+
+
+def invalidate(namespace):
+    """Makes every cached entry of a namespace stale, here and, with a shared backend, in other processes."""
+    shared = _shared()
+    if shared is not None:
+        try:
+            shared.incr(f'refcache:version:{namespace}')
+        except ValueError:
+            shared.set(f'refcache:version:{namespace}', 2, None)
+    with _lock:
+        _versions[namespace] += 1
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def stats():
+    """Hit and miss counts of this process, per namespace."""
+    with _lock:
+        counters = dict(_counters)
+        result = {'entries': len(_entries)}
+    for namespace in (SUBJECT_CODES, ACTIVE_TEACHERS):
+        hit, shared_hit, miss = (counters.get(f'{namespace}_{outcome}', 0) for outcome in ('hit', 'shared_hit', 'miss'))
+        total = hit + shared_hit + miss
+        result[namespace] = {'hit': hit, 'shared_hit': shared_hit, 'miss': miss,
+                             'hit_rate': (hit + shared_hit) / total if total else None}
+    return result
+
+
+def reset_stats():
+    with _lock:
+        _counters.clear()
+
+
+# --- Reference data ------------------------------------------------------------------
+
+def subject_code(subject):
+    """The s_code of a subject, or '' when it has none."""
+    def load():
+        row = SubjectCode.objects.filter(subject=subject).values_list('s_code', flat=True).first()
+        return row or ''
+    return get(SUBJECT_CODES, subject, load)
+
+
+def active_teachers():
+    """Usernames of teachers with a request that is not finalized yet."""
+    return get(ACTIVE_TEACHERS, None, lambda: frozenset(
+        Request.objects.filter(status__in=ACTIVE_REQUEST_STATUSES).values_list('tusername', flat=True).distinct()))
+
+
+# --- Invalidation --------------------------------------------------------------------
+
+def invalidate_on_commit(namespace):
+    """Invalidates now and again once the current transaction commits, so a value read in between is dropped too."""
+    invalidate(namespace)
+    transaction.on_commit(lambda: invalidate(namespace))
+
+
+def _request_changed(sender, **kwargs):
+    invalidate_on_commit(ACTIVE_TEACHERS)
+
+
+def _subject_code_changed(sender, **kwargs):
+    invalidate_on_commit(SUBJECT_CODES)
+
+
+def connect_signals():
+    """Called from EmsConfig.ready(). Queryset update()s skip signals and call invalidate() themselves."""
+    from django.db.models.signals import post_delete, post_save
+    post_save.connect(_request_changed, sender=Request, dispatch_uid='refcache_request_saved')
+    post_delete.connect(_request_changed, sender=Request, dispatch_uid='refcache_request_deleted')
+    post_save.connect(_subject_code_changed, sender=SubjectCode, dispatch_uid='refcache_subject_code_saved')
+    post_delete.connect(_subject_code_changed, sender=SubjectCode, dispatch_uid='refcache_subject_code_deleted')
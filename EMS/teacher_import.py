@@ -0,0 +1,112 @@
+from concurrent.futures import ProcessPoolExecutor
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+import csv, itertools, json, multiprocessing, os, time
+
+from .models import CustomUser, allocate_teacher_ids
+
+# Imports teachers from CSV (with a header row) or JSON Lines: rows are validated in
+# batches, passwords hashed in a process pool (PBKDF2 is what makes one-by-one
+# sign-ups slow), teacher ids drawn from the sequence one block per batch, and each
+# batch written with one bulk_create. Usernames that already exist are skipped.
+
+FIELDS = ('username', 'password', 'first_name', 'last_name', 'email', 'course', 'semester', 'branch', 'subject')
+CHOICE_FIELDS = ('course', 'semester', 'branch', 'subject')
+
+
+def read_rows(path, fmt=None):
+    """Yields one dict per teacher; the format is taken from the extension unless given."""
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _choices(field):
+    return {value for value, _ in CustomUser._meta.get_field(field).choices}
+
+
+def validate(row, choices):
+    """Returns the cleaned row, or raises ValueError saying what is wrong with it."""
+    unknown = set(row) - set(FIELDS)
+    if unknown:
+        raise ValueError(f"unknown column(s) {', '.join(sorted(unknown))}")
+    cleaned = {field: (row.get(field) or '').strip() for field in FIELDS}
+    if not cleaned['username']:
+        raise ValueError("username is required")
+    for field in CHOICE_FIELDS:
+        cleaned[field] = cleaned[field] or 'None'
+        if cleaned[field] not in choices[field]:
+            raise ValueError(f"{field} {cleaned[field]!r} is not one of the allowed values")
+    return cleaned
+
+
+def _init_process():
+    import django
+    django.setup()
+
+
+def _hash(password):
+    # An empty password gets an unusable one; the teacher sets it through a reset.
+    return make_password(password or None)
+
+
+def import_teachers(rows, batch_size=1000, workers=None):
+    """Creates a teacher per valid row. Returns a summary with per-row errors and rows/sec."""
+    workers = workers or os.cpu_count()
+    choices = {field: _choices(field) for field in CHOICE_FIELDS}
+    summary = {'created': 0, 'existing': 0, 'invalid': 0, 'errors': []}
+    started = time.monotonic()
+
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_process)
+    try:
+        rows = iter(rows)
+        line = 0
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            valid, seen = [], set()
+            for row in batch:
+                line += 1
+                try:
+                    cleaned = validate(row, choices)
+                    if cleaned['username'] in seen:
+                        raise ValueError("duplicate username in this file")
+                except ValueError as e:
+                    summary['invalid'] += 1
+                    summary['errors'].append({'row': line, 'username': row.get('username'), 'error': str(e)})
+                    continue
+                seen.add(cleaned['username'])
+                valid.append(cleaned)
+
+            existing = set(CustomUser.objects.filter(username__in=seen).values_list('username', flat=True))
+            summary['existing'] += len(existing)
+            valid = [row for row in valid if row['username'] not in existing]
+            if not valid:
+                continue
+
+            passwords = [row.pop('password') for row in valid]
+            if pool:
+                hashed = list(pool.map(_hash, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+            else:
+                hashed = [_hash(password) for password in passwords]
+            teacher_ids = allocate_teacher_ids(len(valid))
+            users = [CustomUser(role='teacher', teacher_id=teacher_id, password=password, **row)
+                     for row, password, teacher_id in zip(valid, hashed, teacher_ids)]
+            with transaction.atomic():
+                CustomUser.objects.bulk_create(users)
+            summary['created'] += len(users)
+    finally:
+        if pool:
+            pool.shutdown()
+
+    summary['seconds'] = time.monotonic() - started
+    summary['rows_per_second'] = line / summary['seconds'] if summary['seconds'] else 0.0
+    return summary
@@ -1,2 +1,963 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+import datetime, hashlib, json, os, random, shutil, tempfile, threading
+from unittest import mock
+from concurrent.futures import Future
+from io import StringIO
+from cryptography.fernet import Fernet, InvalidToken
+from types import SimpleNamespace
 
+from .models import CustomUser, Request, FinalPapers, SubjectCode, ChainOutbox, Blob, FinalizationJob
+from .blobstore import MappedFile, migrate_legacy, recount
+from .blockchain import paper_id_from_receipt
+from .bulk_finalization import claim_requests, pending_requests, run_claimed
+from .cid import CHUNK_SIZE, MAX_LINKS, compute_cid, file_cid
+from .downloads import serve_paper
+from .encryption import STREAM_HEADER, TAG_SIZE, decrypt_chunks, encrypt_chunks
+from .finalization import mark_finalized, save_final_paper
+from .jobs import claim_next_job, enqueue_finalization
+from .teacher_import import import_teachers
+from .tx_submitter import TransactionSubmitter
+from .outbox import (SENDER_LOCK_ID, claim_download, claim_due, drain, enqueue_download, enqueue_upload, recover_stale,
+                     _apply, _retry, _submit)
+from .prestaging import run_once, stats
+from .profiling import hottest, load_profiles
+from . import ipfs_client, metrics, refcache, tx_submitter, web3_client
+
+# Rows per table; large enough that a per-row query would show up as thousands of queries.
+SCALE = 10000
+# Seconds for a fresh worker to set up Django and import the URLconf (best of three), and
+# for `manage.py check`; about 1.7 s and 1.6 s when web3 was imported at startup. The
+# defaults leave room for slow CI machines; EMS_STARTUP_BUDGETS=1 enforces the tight ones.
+TIGHT_STARTUP_BUDGETS = os.environ.get('EMS_STARTUP_BUDGETS') == '1'
+STARTUP_IMPORT_BUDGET = 1.0 if TIGHT_STARTUP_BUDGETS else 3.0
+STARTUP_CHECK_BUDGET = 1.5 if TIGHT_STARTUP_BUDGETS else 4.5
+
+
+@override_settings(PRESTAGE_RUN_IN_PROCESS=False)
+class QueryCountTests(TestCase):
+    """Each view must run a fixed number of queries, however many rows exist."""
+
+    def setUp(self):
+        cache.clear()
+        refcache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        exam_time = timezone.now() + datetime.timedelta(minutes=10)
+        cls.teacher = CustomUser.objects.create_user(username='teacher', password='pw', role='teacher', course='B.E.', semester='1', branch='CSE', subject='Maths')
+        cls.superintendent = CustomUser.objects.create_user(username='superintendent', password='pw', role='superintendent')
+        cls.coe = CustomUser.objects.create_user(username='coe', password='pw', role='coe')
+        SubjectCode.objects.create(s_code='MA101', subject='Maths')
+
+        CustomUser.objects.bulk_create(
+            CustomUser(username=f'teacher{i}', password='!', role='teacher', first_name='Teacher', last_name=str(i), course='B.E.', semester='1', branch='CSE', subject='Maths')
+            for i in range(SCALE)
+        )
+        Request.objects.bulk_create(
+            Request(tusername=f'teacher{i}', s_code='MA101', syllabus='syllabus.pdf', q_pattern='pattern.pdf',
+                    status=('Pending', 'Accepted', 'Pending Finalization', 'Finalized')[i % 4], exam_time=exam_time)
+            for i in range(SCALE)
+        )
+        Request.objects.bulk_create(
+            Request(tusername='teacher', s_code='MA101', syllabus='syllabus.pdf', q_pattern='pattern.pdf', status=status, exam_time=exam_time)
+            for status in ('Pending', 'Accepted', 'Finalized')
+        )
+        FinalPapers.objects.bulk_create(
+            FinalPapers(s_code='MA101', course='B.E.', semester='1', branch='CSE', subject='Maths', paper='MA101.pdf',
+                        contract_paper_id=i, downloaded=True)
+            for i in range(SCALE)
+        )
+
+    def test_teacher_dashboard(self):
+        self.client.force_login(self.teacher)
+        # Session, user, pending requests, other requests.
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('teacher_dashboard'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_get_teachers(self):
+        data = {'course': 'B.E.', 'semester': '1', 'branch': 'CSE', 'subject': 'Maths'}
+        # Subject code, active teachers, pending finalization requests, teachers of the subject.
+        with self.assertNumQueries(4):
+            response = self.client.post(reverse('get_teachers'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['queryset2']), SCALE // 4)
+        # Every fourth bulk-created teacher has only a finalized request.
+        self.assertEqual(len(response.json()['queryset']), SCALE // 4)
+        # Subject code and active teachers now come from memory.
+        with self.assertNumQueries(2):
+            self.client.post(reverse('get_teachers'), data)
+
+    def test_get_teachers_cache_invalidation(self):
+        data = {'course': 'B.E.', 'semester': '1', 'branch': 'CSE', 'subject': 'Maths'}
+        refcache.reset_stats()
+        self.client.post(reverse('get_teachers'), data)
+        pending = Request.objects.create(tusername='teacher3', s_code='MA101', syllabus='syllabus.pdf', q_pattern='pattern.pdf',
+                                         status='Pending', encrypted_file='missing.enc')
+        response = self.client.post(reverse('get_teachers'), data)
+        usernames = {row['username'] for row in response.json()['queryset']}
+        self.assertNotIn('teacher3', usernames)
+        self.assertIn('teacher7', usernames)
+
+        mark_finalized(pending)
+        response = self.client.post(reverse('get_teachers'), data)
+        self.assertIn('teacher3', {row['username'] for row in response.json()['queryset']})
+        self.assertEqual(refcache.stats()['active_teachers'], {'hit': 0, 'shared_hit': 0, 'miss': 3, 'hit_rate': 0.0})
+        self.assertEqual(refcache.stats()['subject_code']['hit'], 2)
+
+    def test_add_teacher_rechecks_active_requests(self):
+        # Another process's cached busy set can still list teacher1 as free; the view must not trust it.
+        busy, free = CustomUser.objects.get(username='teacher1'), CustomUser.objects.get(username='teacher3')
+        data = {'s_code': 'MA101', 'exam_time': timezone.now() + datetime.timedelta(days=1)}
+        response = self.client.post(reverse('add_teacher'), {**data, 'g_id': busy.id})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Request.objects.filter(tusername='teacher1').count(), 1)
+        response = self.client.post(reverse('add_teacher'), {**data, 'g_id': free.id})
+        self.assertEqual(response.json()['new_teacher'][0]['username'], 'teacher3')
+        self.assertTrue(Request.objects.filter(tusername='teacher3', status='Pending').exists())
+
+    def test_st_dashboard(self):
+        self.client.force_login(self.superintendent)
+        # Session, user, one page of papers.
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('st_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['has_next'])
+
+    def test_st_dashboard_download_lookup(self):
+        self.client.force_login(self.superintendent)
+        # Session, user, the conditional claim, then whether the paper exists; it is already downloaded.
+        with self.assertNumQueries(4):
+            response = self.client.post(reverse('st_dashboard'), {'paper_id': SCALE // 2})
+        self.assertRedirects(response, reverse('st_dashboard'), fetch_redirect_response=False)
+
+    def test_coe_dashboard(self):
+        self.client.force_login(self.coe)
+        # Session, user, history count, one page of history with teacher names.
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('coe_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page_obj'].paginator.count, SCALE + 3)
+
+    def test_coe_request_history(self):
+        self.client.force_login(self.coe)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('coe_request_history'), {'status': 'Finalized', 'subject': 'Maths', 'sort': '-id', 'page': 2})
+        data = response.json()
+        self.assertEqual(data['count'], SCALE // 4 + 1)
+        self.assertEqual(data['page'], 2)
+        self.assertTrue(all(row['status'] == 'Finalized' for row in data['results']))
+        # Newest first: the 'teacher' request, then every fourth bulk-created teacher.
+        self.assertEqual(data['results'][0]['name'], f'Teacher {SCALE - 1 - 4 * (settings.COE_HISTORY_PAGE_SIZE - 1)}')
+
+
+@override_settings(PRESTAGE_RUN_IN_PROCESS=False)
+class PrestagingTests(TestCase):
+    """Papers due within the lead time are staged and the dashboard is served from the cache."""
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.staging_root = os.path.join(self.media_root, 'staging')
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.superintendent = CustomUser.objects.create_user(username='superintendent', password='pw', role='superintendent')
+        soon = timezone.now() + datetime.timedelta(minutes=settings.PAPER_DOWNLOAD_WINDOW_MINUTES + 5)
+        later = timezone.now() + datetime.timedelta(hours=5)
+        for s_code, exam_time in (('MA101', soon), ('PH101', later)):
+            Request.objects.create(tusername='teacher', s_code=s_code, syllabus='syllabus.pdf', q_pattern='pattern.pdf',
+                                   status='Finalized', exam_time=exam_time)
+            with open(os.path.join(self.media_root, f'{s_code}.pdf'), 'wb') as f:
+                f.write(s_code.encode() * 1000)
+            FinalPapers.objects.create(s_code=s_code, paper=f'{s_code}.pdf', contract_paper_id=len(s_code))
+        self.soon = FinalPapers.objects.get(s_code='MA101')
+        self.later = FinalPapers.objects.get(s_code='PH101')
+
+    def test_run_once(self):
+        with self.settings(MEDIA_ROOT=self.media_root, PAPER_STAGING_ROOT=self.staging_root):
+            self.assertEqual(run_once(), {'upcoming': 1, 'staged': 1, 'failed': 0, 'removed': 0})
+            self.assertEqual(os.listdir(self.staging_root), [f'{self.soon.id}.pdf'])
+            self.assertEqual(run_once()['staged'], 0)
+
+            # Session and user only: the rows were computed ahead of time.
+            self.client.force_login(self.superintendent)
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('st_dashboard'))
+            self.assertEqual([item['paper']['s_code'] for item in response.context['final_papers_data']], ['MA101', 'PH101'])
+
+            request = RequestFactory().get('/')
+            for paper in (self.soon, self.later):
+                b''.join(serve_paper(request, paper).streaming_content)
+            self.assertEqual(stats(), {'dashboard_hit': 1, 'dashboard_miss': 0, 'dashboard_hit_rate': 1.0,
+                                       'file_hit': 1, 'file_miss': 1, 'file_hit_rate': 0.5})
+
+            # Claimed papers drop out of the next run and their staged copy is removed.
+            FinalPapers.objects.filter(id=self.soon.id).update(downloaded=True)
+            self.assertEqual(run_once(), {'upcoming': 0, 'staged': 0, 'failed': 0, 'removed': 1})
+
+    def test_dashboard_cache_is_invalidated_by_finalization(self):
+        self.client.force_login(self.superintendent)
+        self.client.get(reverse('st_dashboard'))
+        mark_finalized(Request.objects.create(tusername='teacher', s_code='CH101', status='Pending Finalization',
+                                              encrypted_file='missing.enc'))
+        self.client.get(reverse('st_dashboard'))
+        self.assertEqual(stats()['dashboard_miss'], 2)
+
+
+@override_settings(PRESTAGE_RUN_IN_PROCESS=False, CHAIN_OUTBOX_RUN_IN_PROCESS=False)
+class ChainOutboxTests(TestCase):
+    """Claiming a paper queues exactly one download event without touching the chain."""
+
+    def setUp(self):
+        cache.clear()
+        self.superintendent = CustomUser.objects.create_user(username='superintendent', password='pw', role='superintendent')
+        self.paper = FinalPapers.objects.create(s_code='MA101', paper='MA101.pdf', filename='MA101.pdf', contract_paper_id=7)
+
+    def test_claim_queues_one_event(self):
+        self.client.force_login(self.superintendent)
+        for _ in range(2):
+            self.client.post(reverse('st_dashboard'), {'paper_id': 7})
+        enqueue_download(self.paper, 'someone else')
+        entry = ChainOutbox.objects.get()
+        self.assertEqual((entry.kind, entry.idempotency_key, entry.status), ('download', f'download:{self.paper.id}', 'Pending'))
+        self.assertEqual(entry.payload, {'paper_id': 7, 'filename': 'MA101.pdf', 'username': 'superintendent'})
+        self.assertTrue(FinalPapers.objects.get(id=self.paper.id).downloaded)
+
+    @override_settings(CHAIN_OUTBOX_MAX_ATTEMPTS=2, CHAIN_OUTBOX_RETRY_DELAY=5)
+    def test_retry_backoff(self):
+        enqueue_download(self.paper, 'superintendent')
+        rows = claim_due(10)
+        self.assertEqual(claim_due(10), [])
+        _retry(rows, "node unreachable")
+        entry = ChainOutbox.objects.get()
+        self.assertEqual((entry.status, entry.attempts, entry.last_error), ('Pending', 1, "node unreachable"))
+        self.assertAlmostEqual((entry.next_attempt_at - timezone.now()).total_seconds(), 5, delta=1)
+        self.assertEqual(claim_due(10), [])  # not due yet
+
+        ChainOutbox.objects.update(next_attempt_at=timezone.now())
+        _retry(claim_due(10), "node unreachable")
+        self.assertEqual(ChainOutbox.objects.get().status, 'Failed')
+
+
+@override_settings(FINALIZATION_RUN_IN_PROCESS=False, CHAIN_OUTBOX_RUN_IN_PROCESS=False, PRESTAGE_RUN_IN_PROCESS=False)
+class FinalizationQueueTests(TransactionTestCase):
+    """Jobs are claimed once each, reused while pending and taken again when their worker died."""
+
+    def setUp(self):
+        self.request = Request.objects.create(tusername='teacher', s_code='MA101', syllabus='syllabus.pdf', q_pattern='pattern.pdf',
+                                              status='Pending Finalization', encrypted_file='MA101.pdf.encrypted')
+
+    def test_claim_skips_locked_jobs(self):
+        first = enqueue_finalization(self.request, 'coe')
+        second = FinalizationJob.objects.create(request=self.request, requested_by='coe')
+        locked, release = threading.Event(), threading.Event()
+
+        def hold():
+            try:
+                with transaction.atomic():
+                    FinalizationJob.objects.select_for_update().get(id=first.id)
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        try:
+            locked.wait(10)
+            self.assertEqual(claim_next_job().id, second.id)
+        finally:
+            release.set()
+            thread.join()
+        job = claim_next_job()
+        self.assertEqual((job.id, job.status, job.attempts), (first.id, 'Running', 1))
+        self.assertIsNone(claim_next_job())
+
+    def test_enqueue_reuses_pending_job(self):
+        job = enqueue_finalization(self.request, 'coe')
+        self.assertEqual(enqueue_finalization(self.request, 'other').id, job.id)
+        claim_next_job()
+        self.assertEqual(enqueue_finalization(self.request, 'other').id, job.id)
+        FinalizationJob.objects.filter(id=job.id).update(status='Failed')
+        self.assertNotEqual(enqueue_finalization(self.request, 'coe').id, job.id)
+
+    @override_settings(FINALIZATION_STALE_AFTER=60, FINALIZATION_MAX_ATTEMPTS=2)
+    def test_stale_running_job_is_requeued_then_failed(self):
+        job = enqueue_finalization(self.request, 'coe')
+        claim_next_job()
+        self.assertIsNone(claim_next_job())  # still fresh
+        # update() leaves updated_at alone: the worker went away two minutes ago.
+        FinalizationJob.objects.filter(id=job.id).update(updated_at=timezone.now() - datetime.timedelta(minutes=2))
+        with self.assertLogs('EMS.jobs', 'WARNING'):
+            self.assertEqual(claim_next_job().attempts, 2)
+
+        FinalizationJob.objects.filter(id=job.id).update(updated_at=timezone.now() - datetime.timedelta(minutes=2))
+        self.assertIsNone(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'Failed')
+        self.assertIn('2 attempt(s)', job.error)
+
+    def test_status_payload(self):
+        job = enqueue_finalization(self.request, 'coe')
+        job.stages = {'ipfs_cp': {'status': 'Running', 'started': 't1'},
+                      'decrypt': {'status': 'Completed', 'started': 't0', 'finished': 't1'}}
+        job.stage = 'ipfs_cp'
+        job.save()
+        self.client.force_login(CustomUser.objects.create_user(username='teacher0', password='pw', role='teacher'))
+        self.assertEqual(self.client.get(reverse('finalization_status', args=[job.id])).status_code, 302)
+        self.client.force_login(CustomUser.objects.create_user(username='coe', password='pw', role='coe'))
+        data = self.client.get(reverse('finalization_status', args=[job.id])).json()
+        self.assertEqual(data['updated_at'], job.updated_at.isoformat())
+        del data['updated_at']
+        self.assertEqual(data, {
+            'job_id': job.id, 'request_id': self.request.id, 'status': 'Queued', 'stage': 'ipfs_cp', 'error': '',
+            'stages': [{'name': 'decrypt', 'status': 'Completed', 'started': 't0', 'finished': 't1'},
+                       {'name': 'ipfs_cp', 'status': 'Running', 'started': 't1'}],
+        })
+
+    def test_retried_save_reuses_paper(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        CustomUser.objects.create_user(username='teacher', password='pw', course='B.E.', semester='VII', branch='CSE',
+                                       subject='Cloud Computing')
+        with override_settings(MEDIA_ROOT=media_root):
+            first = save_final_paper(self.request, ContentFile(b'paper', name='MA101.pdf'), 'QmPaper')
+            second = save_final_paper(self.request, ContentFile(b'paper', name='MA101.pdf'), 'QmPaper')
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(FinalPapers.objects.count(), 1)
+        self.assertEqual(list(ChainOutbox.objects.values_list('idempotency_key', flat=True)), [f'upload:{first.id}'])
+
+
+@override_settings(FINALIZATION_RUN_IN_PROCESS=False, CHAIN_OUTBOX_RUN_IN_PROCESS=False, PRESTAGE_RUN_IN_PROCESS=False)
+class BulkFinalizationTests(TransactionTestCase):
+    """A bulk run queues one job per finalizable request and reports every request it was given."""
+
+    def setUp(self):
+        self.requests = [
+            Request.objects.create(tusername=f'teacher{n}', s_code='MA101', syllabus='syllabus.pdf', q_pattern='pattern.pdf',
+                                   status='Pending Finalization', encrypted_file=encrypted_file)
+            for n, encrypted_file in enumerate(('missing.pdf.encrypted', None, 'taken.pdf.encrypted'))]
+        FinalizationJob.objects.create(request=self.requests[2], status='Running')
+        Request.objects.create(tusername='teacher', s_code='PH101', status='Pending Finalization', encrypted_file='x')
+
+    def test_claim_skips_busy_and_missing_files(self):
+        claimed, skipped = claim_requests(pending_requests(s_code='MA101'), 'coe')
+        self.assertEqual([(req.id, job.status) for req, job in claimed], [(self.requests[0].id, 'Queued')])
+        self.assertEqual([(row['request_id'], row['status'], row['error']) for row in skipped], [
+            (self.requests[1].id, 'Skipped', "Encrypted file missing for this request."),
+            (self.requests[2].id, 'Skipped', "A finalization job is already queued or running."),
+        ])
+
+    def test_report(self):
+        from benchmarks.standins import FakeIpfs
+        ipfs = FakeIpfs()
+        self.addCleanup(ipfs.stop)
+        self.addCleanup(setattr, ipfs_client, '_client', None)
+        ipfs_client._client = None
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        with open(os.path.join(root, 'missing.pdf.encrypted'), 'wb') as f:
+            f.write(b'not what was uploaded')
+        Request.objects.filter(id=self.requests[0].id).update(encrypted_cid=compute_cid([b'uploaded']))
+        claimed, _ = claim_requests(pending_requests(s_code='MA101'), 'coe')
+        taken = FinalizationJob.objects.create(request=self.requests[1], status='Running')  # by a job worker
+
+        with override_settings(IPFS_STORAGE_API_URL=ipfs.api_url, ENCRYPTION_ROOT=root), \
+                self.assertLogs('EMS.bulk_finalization', 'ERROR'):
+            report = run_claimed(claimed + [(self.requests[1], taken)], io_workers=2, cpu_workers=1)
+        self.assertEqual([(row['request_id'], row['status']) for row in report],
+                         [(self.requests[0].id, 'Failed'), (self.requests[1].id, 'Skipped')])
+        self.assertIn(f"the uploaded file has CID {compute_cid([b'uploaded'])}", report[0]['error'])
+        self.assertEqual(report[1]['error'], "Taken by a finalization worker.")
+        job = FinalizationJob.objects.get(id=report[0]['job_id'])
+        self.assertEqual((job.status, job.attempts), ('Failed', 1))
+        self.assertEqual(Request.objects.get(id=self.requests[0].id).status, 'Pending Finalization')
+
+    def test_endpoint_is_for_coe_only(self):
+        self.client.force_login(CustomUser.objects.create_user(username='teacher0', password='pw', role='teacher'))
+        self.assertEqual(self.client.post(reverse('coe_finalize_all'), {'s_code': 'MA101'}).status_code, 302)
+        self.assertFalse(FinalizationJob.objects.filter(status='Queued').exists())
+
+        self.client.force_login(CustomUser.objects.create_user(username='coe', password='pw', role='coe'))
+        response = self.client.post(reverse('coe_finalize_all'), {'s_code': 'MA101'})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual([job['request_id'] for job in response.json()['jobs']], [self.requests[0].id])
+        self.assertEqual(FinalizationJob.objects.get(id=response.json()['jobs'][0]['job_id']).status, 'Queued')
+
+
+class StubChain:
+    """Stands in for the chain client and the transaction submitter: records contract calls and serves receipts."""
+
+    def __init__(self):
+        self.sent = []  # (function name, args)
+        self.receipts = {}  # tx hash -> receipt
+        self.mempool = set()  # tx hashes the node knows but has not mined
+        self.nonce_resets = 0
+        self.contract = SimpleNamespace(functions=self._Functions(), events=self._Events())
+        self.web3 = SimpleNamespace(eth=SimpleNamespace(get_transaction_receipt=self.get_transaction_receipt,
+                                                        get_transaction=self.get_transaction))
+
+    class _Functions:
+        def __getattr__(self, name):
+            return lambda *args: (name, args)
+
+    class _Events:
+        def __getattr__(self, name):
+            return lambda: SimpleNamespace(process_receipt=lambda receipt, errors=None: receipt['events'].get(name, []))
+
+    def submit(self, call):
+        from hexbytes import HexBytes
+        self.sent.append(call)
+        future = Future()
+        future.tx_hash = HexBytes(hashlib.sha256(str(len(self.sent)).encode()).digest()).hex()
+        return future
+
+    def reset_nonce(self):
+        self.nonce_resets += 1
+
+    def receipt(self, tx_hash, status=1, **events):
+        from hexbytes import HexBytes
+        from web3.datastructures import AttributeDict
+        receipt = self.receipts[tx_hash] = AttributeDict({
+            'transactionHash': HexBytes(tx_hash), 'status': status,
+            'events': {name: [{'args': args}] for name, args in events.items()}})
+        return receipt
+
+    def get_transaction_receipt(self, tx_hash):
+        from web3.exceptions import TransactionNotFound
+        if tx_hash.hex() not in self.receipts:
+            raise TransactionNotFound(tx_hash.hex())
+        return self.receipts[tx_hash.hex()]
+
+    def get_transaction(self, tx_hash):
+        from web3.exceptions import TransactionNotFound
+        if tx_hash.hex() not in self.mempool | set(self.receipts):
+            raise TransactionNotFound(tx_hash.hex())
+        return {'hash': tx_hash}
+
+
+@override_settings(PRESTAGE_RUN_IN_PROCESS=False, CHAIN_OUTBOX_RUN_IN_PROCESS=False)
+class ChainOutboxSendingTests(TestCase):
+    """Rows are sent, recorded from their receipts, and recovered after a crash without sending twice."""
+
+    def setUp(self):
+        self.chain = StubChain()
+        for module, name in ((web3_client, '_client'), (tx_submitter, '_submitter')):
+            self.addCleanup(setattr, module, name, getattr(module, name))
+            setattr(module, name, self.chain)
+        self.papers = [FinalPapers.objects.create(s_code=f'MA10{n}', paper=f'MA10{n}.pdf', filename=f'MA10{n}.pdf')
+                       for n in range(3)]
+        for n, paper in enumerate(self.papers):
+            enqueue_upload(paper, f'Qm{n:044d}', f'teacher{n}')
+
+    def test_per_paper_uploads(self):
+        self.papers[0].contract_paper_id = 7
+        enqueue_download(self.papers[0], 'superintendent')
+        sent = _submit(claim_due(10))
+        self.assertEqual([name for name, _ in self.chain.sent], ['uploadPaper'] * 3 + ['recordDownload'])
+        self.assertEqual(self.chain.sent[0][1], ('Qm' + '0' * 44, 'MA100.pdf', 'teacher0'))
+        self.assertEqual(set(ChainOutbox.objects.values_list('status', flat=True)), {'Sent'})
+
+        for number, (rows, future) in enumerate(sent, start=1):
+            _apply(rows, self.chain.receipt(future.tx_hash, PaperUploaded={'id': number}))
+        self.assertEqual(set(ChainOutbox.objects.values_list('status', flat=True)), {'Done'})
+        papers = FinalPapers.objects.in_bulk([paper.id for paper in self.papers])
+        self.assertEqual([(papers[paper.id].blockchain_status, papers[paper.id].contract_paper_id) for paper in self.papers],
+                         [('Recorded', 1), ('Recorded', 2), ('Recorded', 3)])
+        self.assertEqual(papers[self.papers[0].id].download_tx_hash, sent[3][1].tx_hash)
+
+    @override_settings(BLOCKCHAIN_RECEIPT_TIMEOUT=60)
+    def test_recover_stale(self):
+        sent = _submit(claim_due(2))  # papers 0 and 1
+        claim_due(1)  # paper 2: the worker stopped before sending it
+        mined, waiting = sent[0][1].tx_hash, sent[1][1].tx_hash
+        self.chain.receipt(mined, PaperUploaded={'id': 5})
+        self.chain.mempool.add(waiting)
+        ChainOutbox.objects.update(updated_at=timezone.now() - datetime.timedelta(minutes=5))
+
+        self.assertEqual(recover_stale(), 3)
+        rows = {row.paper_id: row for row in ChainOutbox.objects.all()}
+        self.assertEqual([rows[paper.id].status for paper in self.papers], ['Done', 'Sent', 'Pending'])
+        self.assertEqual(FinalPapers.objects.get(id=self.papers[0].id).contract_paper_id, 5)
+        self.assertEqual(recover_stale(), 0)  # the waiting one is looked at again later
+
+        self.chain.mempool.clear()  # dropped by the node
+        ChainOutbox.objects.filter(status='Sent').update(updated_at=timezone.now() - datetime.timedelta(minutes=5))
+        recover_stale()
+        row = ChainOutbox.objects.get(paper=self.papers[1])
+        self.assertEqual((row.status, row.tx_hash), ('Pending', None))
+        self.assertIn('dropped', row.last_error)
+        self.assertEqual(len(self.chain.sent), 2)
+
+    @override_settings(BLOCKCHAIN_RECEIPT_TIMEOUT=0.01)
+    def test_one_sender_at_a_time(self):
+        other = connections.create_connection('default')
+        self.addCleanup(other.close)
+        with other.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [SENDER_LOCK_ID])
+            self.assertEqual(drain(), 0)
+            self.assertEqual((self.chain.sent, self.chain.nonce_resets), ([], 0))
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [SENDER_LOCK_ID])  # the other sender is done
+        self.assertEqual(drain(), 3)
+        self.assertEqual((len(self.chain.sent), self.chain.nonce_resets), (3, 1))
+        self.assertEqual(drain(), 0)  # released again: nothing left to send
+        self.assertEqual(self.chain.nonce_resets, 2)
+
+    def test_paper_id_from_receipt(self):
+        self.assertEqual(paper_id_from_receipt(self.chain.receipt('0x' + '01' * 32, PaperUploaded={'id': 9})), 9)
+        with self.assertRaises(ValueError):
+            paper_id_from_receipt(self.chain.receipt('0x' + '02' * 32, PaperDownloaded={'id': 1}))
+
+
+class TransactionSubmitterTests(SimpleTestCase):
+    """Nonces are assigned locally after one lookup, and looked up again after a failed send or a reset."""
+
+    def setUp(self):
+        self.node_nonces = iter([7, 10, 12])  # the node's pending nonce at each lookup
+        self.sent = []
+        eth = SimpleNamespace(get_transaction_count=self.get_transaction_count,
+                              get_transaction_receipt=lambda tx_hash: {'status': 1, 'transactionHash': tx_hash})
+        self.submitter = TransactionSubmitter(SimpleNamespace(account='0xsender', web3=SimpleNamespace(eth=eth)))
+
+    def get_transaction_count(self, account, block):
+        self.assertEqual((account, block), ('0xsender', 'pending'))
+        return next(self.node_nonces)
+
+    def call(self, error=None):
+        def transact(tx):
+            if error:
+                raise error
+            self.sent.append(tx['nonce'])
+            return hashlib.sha256(str(len(self.sent)).encode()).digest()
+        return SimpleNamespace(transact=transact)
+
+    @override_settings(BLOCKCHAIN_RECEIPT_POLL_INTERVAL=0.01)
+    def test_nonces(self):
+        futures = [self.submitter.submit(self.call()) for _ in range(3)]
+        with self.assertRaises(ValueError):
+            self.submitter.submit(self.call(ValueError("nonce too low")))
+        self.submitter.submit(self.call())
+        self.submitter.reset_nonce()
+        self.submitter.submit(self.call())
+        self.assertEqual(self.sent, [7, 8, 9, 10, 12])
+        self.assertEqual(futures[0].tx_hash, hashlib.sha256(b'1').hexdigest())
+        self.assertEqual(futures[2].result(timeout=5)['status'], 1)
+
+
+@override_settings(CHAIN_OUTBOX_RUN_IN_PROCESS=False)
+class ClaimDownloadStressTests(TransactionTestCase):
+    """Many superintendents claiming the same paper at once: exactly one wins."""
+
+    THREADS = 32
+
+    def test_one_winner(self):
+        paper = FinalPapers.objects.create(s_code='MA101', paper='MA101.pdf', filename='MA101.pdf', contract_paper_id=7)
+        barrier = threading.Barrier(self.THREADS)
+        winners = []
+
+        def claim(n):
+            try:
+                barrier.wait()
+                if claim_download(7, f'superintendent{n}') is not None:
+                    winners.append(n)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=claim, args=(n,)) for n in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(winners), 1)
+        entry = ChainOutbox.objects.get()
+        self.assertEqual((entry.paper_id, entry.payload['username']), (paper.id, f'superintendent{winners[0]}'))
+        self.assertTrue(FinalPapers.objects.get(id=paper.id).downloaded)
+        self.assertIsNone(claim_download(7, 'late'))
+
+
+class TeacherImportTests(TestCase):
+    """Imported teachers get a contiguous block of sequence ids; bad and existing rows are reported."""
+
+    def test_import(self):
+        existing = CustomUser.objects.create_user(username='existing', password='pw')
+        rows = [{'username': f'imported{i}', 'password': '', 'course': 'B.E.', 'semester': 'VII', 'branch': 'CSE',
+                 'subject': 'Cloud Computing'} for i in range(5)]
+        rows[0]['password'] = 'Secret#123'
+        rows += [{'username': 'existing'}, {'username': 'imported1'}, {'username': 'bad', 'course': 'B.Sc'}, {'password': 'x'}]
+
+        summary = import_teachers(rows, batch_size=3, workers=1)
+        # imported1 is in a later batch than its first row, so it already exists by then.
+        self.assertEqual((summary['created'], summary['existing'], summary['invalid']), (5, 2, 2))
+        self.assertEqual([error['row'] for error in summary['errors']], [8, 9])
+
+        imported = CustomUser.objects.filter(username__startswith='imported').order_by('id')
+        numbers = [int(user.teacher_id.split('-')[1]) for user in imported]
+        self.assertEqual(numbers, list(range(numbers[0], numbers[0] + 5)))
+        self.assertGreater(numbers[0], int(existing.teacher_id.split('-')[1]))
+        self.assertTrue(imported[0].check_password('Secret#123'))
+        self.assertFalse(imported[1].has_usable_password())
+
+
+class BlobStoreTests(TestCase):
+    """Identical uploads are stored once, counted per row and removed with the last reference."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def create_request(self, syllabus):
+        return Request.objects.create(tusername='teacher', s_code='MA101', syllabus=syllabus,
+                                      q_pattern=SimpleUploadedFile('pattern.pdf', b'pattern'))
+
+    def test_deduplication_and_refcounts(self):
+        first = self.create_request(SimpleUploadedFile('syllabus.pdf', b'syllabus' * 1000))
+        second = self.create_request(SimpleUploadedFile('other-name.PDF', b'syllabus' * 1000))
+        self.assertEqual(first.syllabus.name, second.syllabus.name)
+        self.assertRegex(first.syllabus.name, r'^blobs/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.pdf$')
+        self.assertEqual(Blob.objects.get(name=first.syllabus.name).refcount, 2)
+        self.assertEqual(Blob.objects.get(name=first.q_pattern.name).refcount, 2)
+
+        with default_storage.open(first.syllabus.name) as f:
+            self.assertIsInstance(f, MappedFile)
+            self.assertEqual((f.size, len(f)), (8000, 8000))
+            self.assertFalse(f.multiple_chunks(chunk_size=8000))
+            self.assertEqual(f.read(), b'syllabus' * 1000)
+
+        path = first.syllabus.path
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(Blob.objects.get(name=second.syllabus.name).refcount, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_reupload_releases_replaced_blob(self):
+        store = self.create_request(SimpleUploadedFile('syllabus.pdf', b'syllabus'))
+        other = self.create_request(SimpleUploadedFile('syllabus.pdf', b'syllabus'))
+        with self.captureOnCommitCallbacks(execute=True):
+            store.private_key.save('1_private_key.pem', ContentFile(b'first key'), save=True)
+        first = store.private_key.name
+        reloaded = Request.objects.get(pk=store.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            reloaded.private_key.save('1_private_key.pem', ContentFile(b'second key'), save=True)
+            reloaded.syllabus.save('syllabus.pdf', ContentFile(b'new syllabus'), save=True)
+        self.assertFalse(Blob.objects.filter(name=first).exists())
+        self.assertEqual(Blob.objects.get(name=reloaded.private_key.name).refcount, 1)
+        self.assertEqual(Blob.objects.get(name=other.syllabus.name).refcount, 1)
+        self.assertEqual(recount(), 0)
+
+    def test_migrate_legacy_files(self):
+        for name in ('a.pdf', 'b.pdf'):
+            with open(os.path.join(settings.MEDIA_ROOT, name), 'wb') as f:
+                f.write(b'same bytes')
+        Request.objects.bulk_create([
+            Request(tusername='teacher', s_code='MA101', syllabus='a.pdf', q_pattern='b.pdf'),
+            Request(tusername='teacher', s_code='MA101', syllabus='a.pdf', q_pattern='missing.pdf'),
+        ])
+        summary = migrate_legacy(delete_originals=True)
+        self.assertEqual((summary['files'], summary['rows'], summary['deduplicated']), (2, 3, 1))
+        self.assertEqual(summary['missing'], ['missing.pdf'])
+        blob = Blob.objects.get()
+        self.assertEqual(blob.refcount, 3)
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, 'a.pdf')))
+        self.assertEqual(Request.objects.filter(syllabus=blob.name).count(), 2)
+
+
+@override_settings(UPLOAD_CHUNK_SIZE=1000)
+class ResumableUploadTests(TestCase):
+    """Chunks may arrive in any order; completion checks the digest and encrypts the paper once."""
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        roots = override_settings(MEDIA_ROOT=os.path.join(root, 'media'), UPLOAD_STAGING_ROOT=os.path.join(root, 'staging'),
+                                  ENCRYPTION_ROOT=root)
+        roots.enable()
+        self.addCleanup(roots.disable)
+        self.teacher = CustomUser.objects.create_user(username='teacher', password='pw', role='teacher')
+        self.request = Request.objects.create(tusername='teacher', s_code='MA101', syllabus='syllabus.pdf', q_pattern='pattern.pdf',
+                                              status='Accepted', paper_deadline=timezone.now() + datetime.timedelta(hours=1))
+        self.paper = os.urandom(2500)
+        self.client.force_login(self.teacher)
+
+    def start(self, **extra):
+        response = self.client.post(reverse('upload_create'), {'req_id': self.request.id, 'filename': 'C:\\papers\\maths.pdf',
+                                                                'size': len(self.paper), **extra})
+        self.assertEqual(response.status_code, 201)
+        return response.json()['url']
+
+    def put(self, url, start, end):
+        return self.client.put(f'{url}?offset={start}', self.paper[start:end], content_type='application/octet-stream')
+
+    def test_out_of_order_chunks(self):
+        url = self.start(sha256=hashlib.sha256(self.paper).hexdigest())
+        self.assertEqual(self.put(url, 2000, 2500).json()['offset'], 0)
+        self.assertEqual(self.put(url, 0, 1000).json()['received'], [[0, 1000], [2000, 2500]])
+        self.assertEqual(self.client.post(f'{url}/complete').status_code, 409)
+        self.assertEqual(self.put(url, 1000, 2000).json()['offset'], 2500)
+
+        response = self.client.post(f'{url}/complete')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['sha256'], hashlib.sha256(self.paper).hexdigest())
+        self.request.refresh_from_db()
+        self.assertEqual(self.request.status, 'Pending Finalization')
+        self.assertEqual(self.request.encrypted_file, 'maths.pdf.encrypted')
+        self.assertEqual(self.request.encrypted_cid, file_cid(os.path.join(settings.ENCRYPTION_ROOT, 'maths.pdf.encrypted')))
+        self.assertFalse(os.listdir(settings.UPLOAD_STAGING_ROOT))
+
+    def test_checksum_mismatch_and_limits(self):
+        url = self.start(sha256='0' * 64)
+        self.assertEqual(self.client.put(f'{url}?offset=2000', b'x' * 600, content_type='application/octet-stream').status_code, 416)
+        for start in range(0, 2500, 1000):
+            self.put(url, start, start + 1000)
+        self.assertEqual(self.client.post(f'{url}/complete').status_code, 422)
+        self.assertEqual(self.client.get(url).json()['received'], [])
+        self.request.refresh_from_db()
+        self.assertEqual(self.request.status, 'Accepted')
+
+        Request.objects.filter(id=self.request.id).update(paper_deadline=timezone.now() - datetime.timedelta(minutes=1))
+        response = self.client.post(reverse('upload_create'), {'req_id': self.request.id, 'filename': 'maths.pdf', 'size': 10})
+        self.assertEqual(response.status_code, 403)
+
+
+class MetricsTests(TestCase):
+    """Stage timings end up on /metrics, summed over every process writing to METRICS_DIR."""
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_stage_histogram_and_errors(self):
+        with metrics.timed('unit_stage'):
+            pass
+        with self.assertRaises(ValueError), metrics.timed('unit_stage'):
+            raise ValueError
+        text = metrics.render()
+        self.assertIn('ems_stage_seconds_count{stage="unit_stage"} 2', text)
+        self.assertIn('ems_stage_seconds_bucket{stage="unit_stage",le="+Inf"} 2', text)
+        self.assertIn('ems_stage_errors_total{stage="unit_stage"} 1', text)
+        self.assertIn('ems_prestage_events_total{kind="dashboard",outcome="hit"}', text)
+
+    def test_database_writes_are_timed(self):
+        SubjectCode.objects.create(s_code='MT101', subject='Metrics')
+        SubjectCode.objects.filter(s_code='MT101').exists()
+        histograms, _ = metrics.collect()
+        self.assertEqual(sum(histograms['db_write'][:-1]), 1)
+
+    def test_processes_are_summed(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        other = {'histograms': {'unit_stage': [1] + [0] * len(metrics.BUCKETS) + [0.0005]},
+                 'counters': [[metrics.STAGE_ERRORS, {'stage': 'unit_stage'}, 3]]}
+        with open(os.path.join(root, '1-1.json'), 'w') as f:
+            json.dump(other, f)
+        with override_settings(METRICS_DIR=root):
+            with self.assertRaises(KeyError), metrics.timed('unit_stage'):
+                raise KeyError
+            histograms, counters = metrics.collect()
+        self.assertEqual(sum(histograms['unit_stage'][:-1]), 2)
+        self.assertEqual(counters[(metrics.STAGE_ERRORS, (('stage', 'unit_stage'),))], 4)
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_endpoint_access(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.client.force_login(CustomUser.objects.create_user(username='coe-metrics', password='pw', role='coe'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+
+@override_settings(PRESTAGE_RUN_IN_PROCESS=False, REQUEST_PROFILE_INTERVAL_MS=1)
+class RequestProfilingTests(TestCase):
+    """EMS views are accounted on /metrics; sampled and slow ones leave a profile."""
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        profiles = override_settings(REQUEST_PROFILE_DIR=self.root, REQUEST_PROFILE_MAX_FILES=2)
+        profiles.enable()
+        self.addCleanup(profiles.disable)
+        self.client.force_login(CustomUser.objects.create_user(username='coe-profile', password='pw', role='coe'))
+
+    def test_views_are_accounted(self):
+        self.client.get(reverse('cache_stats'))
+        self.client.get(reverse('cache_stats'))
+        _, counters = metrics.collect()
+        self.assertEqual(counters[('ems_view_requests_total', (('view', 'cache_stats'),))], 2)
+        self.assertGreater(counters[('ems_view_queries_total', (('view', 'cache_stats'),))], 0)
+        self.assertEqual(os.listdir(self.root), [])  # nothing sampled by default
+
+    def test_sampled_and_slow_profiles_rotate(self):
+        with override_settings(REQUEST_PROFILE_RATE=1.0):
+            for _ in range(3):
+                self.client.get(reverse('cache_stats'))
+        self.assertEqual(len(os.listdir(self.root)), 2)
+        with override_settings(REQUEST_PROFILE_SLOW_MS=0):
+            self.client.get(reverse('get_teachers'), {'s_code': 'none'})
+        profiles = load_profiles(self.root)
+        self.assertEqual([p['reason'] for p in profiles], ['sampled', 'slow'])
+        self.assertEqual(profiles[-1]['view'], 'get_teachers')
+        self.assertGreater(profiles[-1]['queries'], 0)
+
+    def test_summary(self):
+        profile = {'view': 'st_dashboard', 'wall_ms': 30.0, 'queries': 4, 'sql_ms': 5.0, 'rpc_ms': 0.0, 'ipfs_ms': 0.0,
+                   'samples': [['main;view;render', 3], ['main;view;query', 1], ['main;view', 1]]}
+        with open(os.path.join(self.root, '1-1-st_dashboard.json'), 'w') as f:
+            json.dump(profile, f)
+        functions, total = hottest(load_profiles(self.root))
+        self.assertEqual(total, 5)
+        self.assertEqual(functions[0], ('render', 3, 3))
+        self.assertIn(('view', 1, 5), functions)
+        out = StringIO()
+        call_command('profile_summary', dir=self.root, stdout=out)
+        self.assertIn('st_dashboard', out.getvalue())
+        self.assertIn('60.0', out.getvalue())
+
+
+class StartupTests(SimpleTestCase):
+    """Processes start without the chain or IPFS clients (benchmarks.startup); only serving ones start background work."""
+
+    def test_clients_are_deferred(self):
+        from benchmarks.startup import measure_import
+        self.assertEqual(measure_import()[1], [])
+
+    def test_import_budget(self):
+        from benchmarks.startup import measure_import
+        self.assertLess(min(measure_import()[0] for _ in range(3)), STARTUP_IMPORT_BUDGET)
+
+    def test_check_budget(self):
+        from benchmarks.startup import measure_check
+        self.assertLess(min(measure_check() for _ in range(2)), STARTUP_CHECK_BUDGET)
+
+    def test_serving_processes(self):
+        # Only these start background work (the pre-staging scheduler) from EmsConfig.ready().
+        from EMS.apps import _serving
+        cases = [
+            (['/usr/bin/gunicorn', 'clgproject.wsgi'], {}, True),
+            (['manage.py', 'runserver'], {'RUN_MAIN': 'true'}, True),
+            (['manage.py', 'runserver', '--noreload'], {}, True),
+            (['manage.py', 'runserver'], {}, False),  # the autoreloader's parent
+            (['manage.py', 'test', 'EMS'], {}, False),
+            (['manage.py', 'prestage_papers', '--follow'], {}, False),
+            (['-c'], {}, False),
+            (['/root/package/benchmarks/pipeline.py'], {}, False),
+        ]
+        for argv, environ, expected in cases:
+            with self.subTest(argv=argv), mock.patch('sys.argv', argv), mock.patch.dict(os.environ, environ):
+                if 'RUN_MAIN' not in environ:
+                    os.environ.pop('RUN_MAIN', None)
+                self.assertIs(_serving(), expected)
+
+
+class EncryptionStreamTests(SimpleTestCase):
+    """Any chunking of the plaintext or the stream decrypts back; any change to the stream does not."""
+
+    CHUNK = 64
+
+    def setUp(self):
+        self.key = Fernet.generate_key()
+        self.random = random.Random(7)
+
+    def split(self, data):
+        # Pieces of 0 to three chunk sizes, so segment boundaries fall anywhere.
+        pieces, i = [], 0
+        while i < len(data):
+            size = self.random.randint(0, 3 * self.CHUNK)
+            pieces.append(data[i:i + size])
+            i += size
+        return pieces
+
+    def encrypt(self, data):
+        return b''.join(encrypt_chunks(self.split(data), self.key, chunk_size=self.CHUNK))
+
+    def decrypt(self, stream):
+        return b''.join(decrypt_chunks(self.split(stream), self.key))
+
+    def test_round_trips(self):
+        for size in (0, 1, self.CHUNK, self.CHUNK + 1, 10 * self.CHUNK, 10 * self.CHUNK + 3):
+            data = os.urandom(size)
+            stream = self.encrypt(data)
+            segments = max(1, -(-size // self.CHUNK))
+            self.assertEqual(len(stream), STREAM_HEADER.size + size + segments * TAG_SIZE, size)
+            self.assertEqual(self.decrypt(stream), data, size)
+            self.assertEqual(b''.join(decrypt_chunks([stream], self.key)), data, size)
+
+    def test_tampering_is_rejected(self):
+        data = os.urandom(4 * self.CHUNK)
+        stream = self.encrypt(data)
+        segment = self.CHUNK + TAG_SIZE
+        body = stream[STREAM_HEADER.size:]
+        first, second, rest = body[:segment], body[segment:2 * segment], body[2 * segment:]
+        header = bytearray(stream[:STREAM_HEADER.size])
+        header[-1] ^= 1  # nonce prefix
+        cases = {
+            'truncated': stream[:-1],
+            'truncated header': stream[:STREAM_HEADER.size - 1],
+            'header only': stream[:STREAM_HEADER.size],
+            'reordered': stream[:STREAM_HEADER.size] + second + first + rest,
+            'final segment dropped': stream[:-segment],
+            'header tampered': bytes(header) + body,
+            'wrong key': None,
+        }
+        for name, tampered in cases.items():
+            with self.subTest(name), self.assertRaises(InvalidToken):
+                if tampered is None:
+                    b''.join(decrypt_chunks([stream], Fernet.generate_key()))
+                else:
+                    self.decrypt(tampered)
+
+    def test_legacy_fernet_token(self):
+        data = os.urandom(1000)
+        token = Fernet(self.key).encrypt(data)
+        self.assertEqual(self.decrypt(token), data)
+        with self.assertRaises(InvalidToken):
+            self.decrypt(token[:-1])
+
+
+class CidTests(SimpleTestCase):
+    """EMS.cid must give the same CIDs as `ipfs add`."""
+
+    def test_known_cids(self):
+        self.assertEqual(compute_cid([b'']), 'QmbFMke1KXqnYyBBWxB74N4c5SBnJMVAiMNRcGu6x1AwQH')
+        self.assertEqual(compute_cid([b'hello world\n']), 'QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o')
+        self.assertEqual(compute_cid([b''], cid_version=1), 'bafkreihdwdcefgh4dqkjv67uzcmw7ojee6xedzdetojuzjevtenxquvyku')
+        self.assertEqual(compute_cid([b'hello world\n'], cid_version=1), 'bafkreifjjcie6lypi6ny7amxnfftagclbuxndqonfipmb64f2km2devei4')
+
+    def test_known_multi_block_cids(self):
+        # 1 MiB of zeros is four leaves under one node; 175 leaves need a second level.
+        mib = [bytes(2 ** 20)]
+        wide = [bytes(CHUNK_SIZE)] * (MAX_LINKS + 1)
+        self.assertEqual(compute_cid(mib), 'QmVkbauSDEaMP4Tkq6Epm9uW75mWm136n81YH8fGtfwdHU')
+        self.assertEqual(compute_cid(mib, cid_version=1), 'bafybeiggzq4ryi7hscq5hzvzcnk4urnxt3asp37dhgvnjilf7exskximla')
+        self.assertEqual(compute_cid(wide), 'QmaL1KiQRV8secNszpjjFPg722T53c77k2dz5UsNua59ZT')
+        self.assertEqual(compute_cid(wide, cid_version=1), 'bafybeigfps5vzivfspwgm3uwsfyl5s6bn3ysh7uqidgauxgopw4yi66lse')
+
+    def test_input_chunking_does_not_matter(self):
+        data = bytes(range(256)) * (CHUNK_SIZE * 3 // 256 + 7)
+        expected = compute_cid([data])
+        self.assertEqual(compute_cid(data[i:i + 1000] for i in range(0, len(data), 1000)), expected)
+        self.assertEqual(compute_cid([data[:CHUNK_SIZE], data[CHUNK_SIZE:]]), expected)
+
+    def test_balanced_layout_depth(self):
+        # One full level-1 node is the root; one more leaf adds a level.
+        full = compute_cid([b'\0' * CHUNK_SIZE * MAX_LINKS])
+        self.assertNotEqual(full, compute_cid([b'\0' * (CHUNK_SIZE * MAX_LINKS + 1)]))
+        self.assertTrue(full.startswith('Qm'))
+        self.assertTrue(compute_cid([b'\0' * (CHUNK_SIZE * 2)], cid_version=1).startswith('bafybei'))
@@ -0,0 +1,127 @@
+from concurrent.futures import Future
+from django.conf import settings
+import logging, threading, time
+
+from .web3_client import get_client
+from .metrics import observe, timed
+
+logger = logging.getLogger(__name__)
+
+# Contract transactions are sent back-to-back with locally assigned nonces instead of
+# one send-and-wait per request. A single watcher thread polls for the receipts of
+# everything in flight and resolves the Future returned by submit(). The nonce is only
+# correct while no other process sends from the same account; EMS.outbox.drain() holds
+# a database lock for that and calls reset_nonce() whenever it takes it.
+
+
+class TransactionFailed(Exception):
+    pass
+
+
+class TransactionSubmitter:
+    def __init__(self, client):
+        self.client = client
+        self._send_lock = threading.Lock()
+        self._next_nonce = None
+        self._pending = {}  # tx hash -> (Future, deadline, time sent)
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._watcher = None
+
+    def _start_watcher(self):
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name="tx-receipt-watcher", daemon=True)
+            self._watcher.start()
+
+    def submit(self, contract_function, gas=None):
+        """Sends a contract transaction and returns a Future resolved with its receipt.
+
+        The Future's tx_hash attribute holds the hash as soon as the node has accepted it.
+        """
+        future = Future()
+        with self._send_lock:
+            if self._next_nonce is None:
+                self._next_nonce = self.client.web3.eth.get_transaction_count(self.client.account, 'pending')
+            try:
+                with timed('chain_send'):
+                    tx_hash = contract_function.transact({
+                        'from': self.client.account,
+                        'gas': gas or settings.BLOCKCHAIN_TX_GAS,
+                        'nonce': self._next_nonce,
+                    })
+            except Exception:
+                # The node may not have taken the nonce; ask it again next time.
+                self._next_nonce = None
+                raise
+            self._next_nonce += 1
+            self._start_watcher()
+        future.tx_hash = tx_hash.hex()
+
+        with self._pending_lock:
+            sent = time.monotonic()
+            self._pending[bytes(tx_hash)] = (future, sent + settings.BLOCKCHAIN_RECEIPT_TIMEOUT, sent)
+        self._wakeup.set()
+        return future
+
+    def reset_nonce(self):
+        """Makes the next submit() ask the node for the nonce, e.g. after another process has sent."""
+        with self._send_lock:
+            self._next_nonce = None
+
+    def pending_count(self):
+        with self._pending_lock:
+            return len(self._pending)
+
+    def _watch(self):
+        from web3.exceptions import TimeExhausted, TransactionNotFound
+        eth = self.client.web3.eth
+        while True:
+            with self._pending_lock:
+                idle = not self._pending
+            if idle:
+                # Sleep until the next submit().
+                self._wakeup.wait()
+                self._wakeup.clear()
+            time.sleep(settings.BLOCKCHAIN_RECEIPT_POLL_INTERVAL)
+
+            with self._pending_lock:
+                pending = list(self._pending.items())
+            for tx_hash, (future, deadline, sent) in pending:
+                try:
+                    receipt = eth.get_transaction_receipt(tx_hash)
+                except TransactionNotFound:
+                    receipt = None
+                except Exception as e:
+                    logger.warning("Receipt lookup for 0x%s failed: %s", tx_hash.hex(), e)
+                    receipt = None
+                if receipt is None and time.monotonic() < deadline:
+                    continue
+                with self._pending_lock:
+                    self._pending.pop(tx_hash, None)
+                if future.done():
+                    continue
+                if receipt is None:
+                    future.set_exception(TimeExhausted(f"Transaction 0x{tx_hash.hex()} was not mined in time."))
+                elif receipt['status'] != 1:
+                    future.set_exception(TransactionFailed(f"Transaction 0x{tx_hash.hex()} reverted."))
+                else:
+                    observe('chain_receipt', time.monotonic() - sent)
+                    future.set_result(receipt)
+
+
+_submitter = None
+_lock = threading.Lock()
+
+
+def get_submitter():
+    global _submitter
+    if _submitter is None:
+        with _lock:
+            if _submitter is None:
+                _submitter = TransactionSubmitter(get_client())
+    return _submitter
+
+
+def reset_nonce():
+    if _submitter is not None:
+        _submitter.reset_nonce()
@@ -0,0 +1,202 @@
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+import datetime, hashlib, os, threading
+
+from .models import Request, UploadSession
+from .encryption import encrypt_file
+from .a_encryption import a_encryption
+from .cid import CidBuilder
+
+# Resumable paper uploads: the teacher page creates a session, PUTs chunks at byte
+# offsets (several at once, retrying the ones that fail) and completes it. Chunks are
+# written in place into one staging file per session, so they may arrive in any order;
+# the session row keeps the merged byte ranges on disk. The SHA-256 of the paper
+# advances over the contiguous prefix as chunks arrive, and encryption computes the CID
+# of the encrypted file as it writes it, so completion reads the paper exactly once.
+# The deadline check and encryption are the ones of the one-shot upload in
+# teacher_dashboard; both go through accept_paper().
+
+READ_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    """An upload that cannot proceed; `status` is the HTTP status the API answers with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def accept_paper(store, paper, teacher_id):
+    """Encrypts an uploaded paper for its request and marks the request Pending Finalization."""
+    # **** Deadline Check ****
+    if store.paper_deadline and timezone.now() > store.paper_deadline:
+        raise UploadError("The deadline for uploading this paper has passed.", status=403)
+
+    # Encrypt the file (encrypt_file writes the file to settings.ENCRYPTION_ROOT).
+    cid = CidBuilder(cid_version=settings.IPFS_CID_VERSION)
+    key = encrypt_file(paper, cid=cid)
+    encrypted_filename = f"{paper.name}.encrypted"
+    # Perform asymmetric encryption using a placeholder for the IPFS hash.
+    arr, private_pem = a_encryption("placeholder_hash", key, teacher_id)
+
+    # Save teacher's private key for this request.
+    private_key_filename = f"{teacher_id}_private_key.pem"
+    store.private_key.save(private_key_filename, ContentFile(private_pem), save=True)
+
+    # Update request: store encryption data and filename, then mark as Pending Finalization.
+    store.enc_field = arr
+    store.encrypted_file = encrypted_filename
+    store.encrypted_cid = cid.finish()
+    store.status = 'Pending Finalization'
+    store.save()
+
+
+# --- Sessions ------------------------------------------------------------------------
+
+def staging_path(session_id):
+    return os.path.join(settings.UPLOAD_STAGING_ROOT, f"{session_id}.part")
+
+
+def contiguous(ranges):
+    """Bytes received from the start of the file without a gap."""
+    return ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+
+
+def merge_range(ranges, start, end):
+    merged = []
+    for lo, hi in sorted([*ranges, [start, end]]):
+        if merged and lo <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return merged
+
+
+def remove_expired_sessions():
+    cutoff = timezone.now() - datetime.timedelta(hours=settings.UPLOAD_SESSION_TTL_HOURS)
+    expired = list(UploadSession.objects.filter(status='Open', updated_at__lt=cutoff).values_list('id', flat=True))
+    for session_id in expired:
+        _forget(session_id)
+    UploadSession.objects.filter(id__in=expired).delete()
+    return len(expired)
+
+
+def create_session(user, req_id, filename, size, sha256=''):
+    """Opens an upload for one of the teacher's requests."""
+    try:
+        store = Request.objects.get(id=req_id, tusername=user.username)
+    except (Request.DoesNotExist, ValueError):
+        raise UploadError("The specified request was not found.", status=404)
+    if store.paper_deadline and timezone.now() > store.paper_deadline:
+        raise UploadError("The deadline for uploading this paper has passed.", status=403)
+    if not 0 < size <= settings.UPLOAD_MAX_SIZE:
+        raise UploadError(f"The paper must be between 1 byte and {settings.UPLOAD_MAX_SIZE} bytes.", status=413)
+    filename = os.path.basename(filename.replace('\\', '/'))  # as Django does for multipart uploads
+    if not filename:
+        raise UploadError("No paper file provided.")
+
+    remove_expired_sessions()
+    session = UploadSession.objects.create(request=store, tusername=user.username, filename=filename, size=size,
+                                           sha256=(sha256 or '').lower())
+    os.makedirs(settings.UPLOAD_STAGING_ROOT, exist_ok=True)
+    with open(staging_path(session.id), 'wb') as f:
+        f.truncate(size)
+    return session
+
+
+def get_session(user, session_id):
+    try:
+        return UploadSession.objects.get(id=session_id, tusername=user.username)
+    except UploadSession.DoesNotExist:
+        raise UploadError("Upload not found.", status=404)
+
+
+def write_chunk(session, offset, length, stream):
+    """Writes `length` bytes read from `stream` at `offset`. Returns the updated session."""
+    if session.status != 'Open':
+        raise UploadError("This upload is already complete.", status=409)
+    if length > settings.UPLOAD_CHUNK_SIZE:
+        raise UploadError(f"Chunks may be at most {settings.UPLOAD_CHUNK_SIZE} bytes.", status=413)
+    if offset < 0 or length <= 0 or offset + length > session.size:
+        raise UploadError(f"Chunk {offset}+{length} is outside the {session.size}-byte paper.", status=416)
+
+    written = 0
+    fd = os.open(staging_path(session.id), os.O_WRONLY)
+    try:
+        while written < length:
+            data = stream.read(min(READ_SIZE, length - written))
+            if not data:
+                break
+            written += os.pwrite(fd, data, offset + written)
+    finally:
+        os.close(fd)
+    if written < length:
+        raise UploadError(f"Chunk ended after {written} of {length} bytes.")
+
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(id=session.id)
+        session.received = merge_range(session.received, offset, offset + written)
+        session.save(update_fields=['received', 'updated_at'])
+    _advance_hash(session.id, contiguous(session.received))
+    return session
+
+
+# Running SHA-256 per session in this process: [bytes hashed, hash object, lock]. Another
+# process, or this one after a restart, catches up from the staging file.
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+
+def _advance_hash(session_id, end):
+    with _hashes_lock:
+        state = _hashes.setdefault(session_id, [0, hashlib.sha256(), threading.Lock()])
+    with state[2]:
+        if end > state[0]:
+            # Just written, so read from the page cache.
+            with open(staging_path(session_id), 'rb') as f:
+                f.seek(state[0])
+                while state[0] < end:
+                    data = f.read(min(READ_SIZE, end - state[0]))
+                    state[1].update(data)
+                    state[0] += len(data)
+        return state[1].copy()
+
+
+def _forget(session_id):
+    with _hashes_lock:
+        _hashes.pop(session_id, None)
+    if os.path.exists(staging_path(session_id)):
+        os.remove(staging_path(session_id))
+
+
+def complete(user, session):
+    """Checks and encrypts a fully received paper. Returns the session."""
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(id=session.id)
+        if session.status != 'Open':
+            raise UploadError("This upload is already complete.", status=409)
+        if contiguous(session.received) < session.size:
+            raise UploadError(f"Only {contiguous(session.received)} of {session.size} bytes have arrived.", status=409)
+
+        sha256 = _advance_hash(session.id, session.size).hexdigest()
+        corrupted = session.sha256 and session.sha256 != sha256
+        if corrupted:
+            # Every chunk has to be sent again; raised below, after this is committed.
+            session.received = []
+            session.save(update_fields=['received', 'updated_at'])
+            with _hashes_lock:
+                _hashes.pop(session.id, None)
+        else:
+            with open(staging_path(session.id), 'rb') as f:
+                accept_paper(session.request, File(f, name=session.filename), user.teacher_id)
+            session.sha256 = sha256
+            session.status = 'Complete'
+            session.save(update_fields=['sha256', 'status', 'updated_at'])
+    if corrupted:
+        raise UploadError(f"The paper arrived with SHA-256 {sha256}, not {session.sha256}.", status=422)
+    _forget(session.id)
+    return session
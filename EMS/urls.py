@@ -6,9 +6,18 @@ urlpatterns = [
 	path('', auth_views.LoginView.as_view(template_name="login.html"),name='login'),
 	path('logout',views.user_logout,name='user_logout'),
 	path('teacher',views.teacher_dashboard,name='teacher_dashboard'),
+	path('uploads',views.upload_create,name='upload_create'),
+	path('uploads/<int:upload_id>',views.upload_session,name='upload_session'),
+	path('uploads/<int:upload_id>/complete',views.upload_complete,name='upload_complete'),
 	path('COE',views.coe_dashboard,name='coe_dashboard'),
+	path('coe_request_history',views.coe_request_history,name='coe_request_history'),
+	path('coe_finalize_all',views.coe_finalize_all,name='coe_finalize_all'),
+	path('finalization_status/<int:job_id>',views.finalization_status,name='finalization_status'),
 	path('transaction_history_coe/', views.transaction_history_coe, name='transaction_history_coe'), # New URL
+	path('cache_stats',views.cache_stats,name='cache_stats'),
+	path('metrics',views.metrics,name='metrics'),
 	path('superintendent',views.st_dashboard,name='st_dashboard'),
+	path('paper_download/<int:paper_id>',views.paper_download,name='paper_download'),
 	path('user_login',views.user_login,name="user_login"),
 	path('get_teachers',views.get_teachers,name="get_teachers"),
 	path('add_teacher',views.add_teacher,name='add_teacher')
@@ -1,26 +1,28 @@
 # views.py
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse, HttpResponseRedirect
+from django.urls import reverse
+from django.http import Http404, HttpResponse, JsonResponse, HttpResponseRedirect, HttpResponseForbidden
 from django.contrib.auth.decorators import login_required, user_passes_test # Import user_passes_test
 from django.contrib.auth import logout
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
-from django.core.files import File
 from django.conf import settings
-import os, ipfshttpclient, requests
-from django.utils import timezone  # Import timezone
-from web3 import Web3  # Import Web3
-
-from .models import Request, FinalPapers, CustomUser, SubjectCode
-from .encryption import encrypt_file, decrypt_file
-from .a_encryption import a_encryption, a_decryption
-from .blockchain import record_paper_upload, record_paper_download_event
-
-# Load contract ABI (assuming it's loaded globally as contract_abi in blockchain.py or here)
-import json
-with open(settings.BLOCKCHAIN_ABI_PATH) as f:
-    contract_json = json.load(f)
-    contract_abi = contract_json["abi"]
+from django.db.models import OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Concat
+from django.core.paginator import Paginator
+from django.utils.crypto import constant_time_compare
+from django.db import transaction
+
+from .models import Request, FinalPapers, CustomUser, SubjectCode, FinalizationJob, ChainEvent, REQUEST_STATUSES, ACTIVE_REQUEST_STATUSES, SUB
+from .outbox import claim_download
+from .jobs import enqueue_finalization, wake_workers
+from .uploads import UploadError, accept_paper, complete, contiguous, create_session, get_session, write_chunk
+from .downloads import download_url, check_token, serve_paper
+from .prestaging import dashboard_page, invalidate_dashboard, stats as prestage_stats
+from .refcache import active_teachers, subject_code, stats as reference_stats
+from .bulk_finalization import claim_requests, pending_requests
+from .finalization import STAGES
+from .metrics import render as render_metrics, trace_sampled
 
 
 def custom_404(request, exception):  # 'exception' argument is required by Django
@@ -73,37 +75,77 @@ def teacher_dashboard(request):
                 messages.error(request, "The specified request was not found.", extra_tags='upload')
                 return render(request, 'teacher.html', {'p_request': p_request, 'a_request': a_request})
 
-            # **** Deadline Check ****
-            now = timezone.now()
-            if now > store.paper_deadline:
-                messages.error(request, "The deadline for uploading this paper has passed.", extra_tags='upload')
+            try:
+                accept_paper(store, paper, request.user.teacher_id)
+            except UploadError as e:
+                messages.error(request, str(e), extra_tags='upload')
                 return render(request, 'teacher.html', {'p_request': p_request, 'a_request': a_request})
-            # **** End Deadline Check ****
-
-            # Encrypt the file (encrypt_file writes the file to settings.ENCRYPTION_ROOT).
-            key = encrypt_file(paper)
-            encrypted_filename = f"{paper.name}.encrypted"
-            encrypted_filepath = os.path.join(settings.ENCRYPTION_ROOT, encrypted_filename)
-            # Perform asymmetric encryption using a placeholder for the IPFS hash.
-            arr = a_encryption("placeholder_hash", key, request.user.teacher_id)
-
-            # Save teacher's private key for this request.
-            private_key_filename = f"{request.user.teacher_id}_private_key.pem"
-            private_key_filepath = os.path.join(settings.ENCRYPTION_ROOT, private_key_filename)
-            with open(private_key_filepath, 'rb') as key_file:
-                store.private_key.save(private_key_filename, File(key_file), save=True)
-
-            # Update request: store encryption data and filename, then mark as Pending Finalization.
-            store.enc_field = arr
-            store.encrypted_file = encrypted_filename  # New field to store local filename.
-            store.status = 'Pending Finalization'
-            store.save()
 
             messages.success(request, 'Paper uploaded successfully! Awaiting finalization by COE.', extra_tags='upload')
 
     return render(request, 'teacher.html', {'p_request': p_request, 'a_request': a_request})
 
 
+# Resumable uploads (EMS.uploads), used by static/resumable_upload.js on the teacher page.
+def _upload_state(session):
+    return {
+        'upload_id': session.id,
+        'url': reverse('upload_session', args=[session.id]),
+        'size': session.size,
+        'offset': contiguous(session.received),
+        'received': session.received,
+        'chunk_size': settings.UPLOAD_CHUNK_SIZE,
+        'status': session.status,
+    }
+
+
+@login_required(login_url='login')
+def upload_create(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': "Use POST to start an upload."}, status=405)
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'error': "The paper size is required."}, status=400)
+    try:
+        session = create_session(request.user, request.POST.get('req_id'), request.POST.get('filename', ''), size,
+                                 request.POST.get('sha256', ''))
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    return JsonResponse(_upload_state(session), status=201)
+
+
+@login_required(login_url='login')
+def upload_session(request, upload_id):
+    """GET: how much has arrived. PUT ?offset=N: one chunk of the paper as the raw request body."""
+    try:
+        session = get_session(request.user, upload_id)
+        if request.method == 'PUT':
+            try:
+                offset = int(request.GET.get('offset', ''))
+                length = int(request.META.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                return JsonResponse({'error': "An integer offset and Content-Length are required."}, status=400)
+            session = write_chunk(session, offset, length, request)
+        elif request.method != 'GET':
+            return JsonResponse({'error': "Use GET or PUT."}, status=405)
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    return JsonResponse(_upload_state(session))
+
+
+@login_required(login_url='login')
+def upload_complete(request, upload_id):
+    if request.method != 'POST':
+        return JsonResponse({'error': "Use POST to complete an upload."}, status=405)
+    try:
+        session = complete(request.user, get_session(request.user, upload_id))
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    messages.success(request, 'Paper uploaded successfully! Awaiting finalization by COE.', extra_tags='upload')
+    return JsonResponse({**_upload_state(session), 'sha256': session.sha256, 'redirect': reverse('teacher_dashboard')})
+
+
 
 @login_required(login_url='login')
 @csrf_exempt
@@ -112,179 +154,181 @@ def coe_dashboard(request):
         s_code = request.POST.get('s_code')
         t_id = request.POST.get('t_id')
 
+        is_ajax = request.headers.get('x-requested-with') == 'XMLHttpRequest'
+
         # Fetch the request with status "Pending Finalization".
         req = Request.objects.filter(id=t_id, status="Pending Finalization").first()
         if not req:
-            messages.error(request, "No pending finalization found for this request.", extra_tags='finalize')
-            return redirect('coe_dashboard')
-
-        if not req.encrypted_file:
-            messages.error(request, "Encrypted file missing for this request. Please ask the teacher to re-upload.", extra_tags='finalize')
-            return redirect('coe_dashboard')
-
-        try:
-            # Build local file path.
-            file_path = os.path.join(settings.ENCRYPTION_ROOT, req.encrypted_file)
-            # Connect to IPFS and add the file.
-            api = ipfshttpclient.connect()
-            ipfs_result = api.add(file_path)
-            hash_id = ipfs_result["Hash"]
-
-            # Attempt to copy the file inside IPFS; if this fails, raise an error.
-            api.files.cp(f"/ipfs/{hash_id}", f"/papers/{req.encrypted_file}")
-
-            # Fetch the file from the IPFS gateway.
-            r = requests.get(f"http://127.0.0.1:8080/ipfs/{hash_id}")
-            if r.status_code != 200:
-                raise Exception("Failed to retrieve file from IPFS gateway.")
-
-            # Decrypt the file using stored encryption details.
-            dec_values = a_decryption([req.enc_field, req.private_key])
-            final_content = decrypt_file(r, dec_values[0], req.s_code)
-
-            # Create a FinalPapers record.
-            teacher_info = CustomUser.objects.filter(username=req.tusername).values("course", "semester", "branch", "subject").first()
-            if not teacher_info:
-                raise Exception("Teacher details not found.")
-
-            # Construct filename using s_code - Robust approach
-            constructed_filename = f"{req.s_code}.pdf"
-            if not constructed_filename:  # Fallback in case filename construction fails
-                constructed_filename = "unknown_filename.pdf" # Default filename
-                messages.warning(request, "Filename construction failed. Using default filename.") # Optional warning
-
-            final_record = FinalPapers.objects.create(
-                s_code=req.s_code,
-                course=teacher_info["course"],
-                semester=teacher_info["semester"],
-                branch=teacher_info["branch"],
-                subject=teacher_info["subject"],
-                filename=constructed_filename
-            )
-            final_record.paper.save(f"{req.s_code}.pdf", final_content, save=True)
-
-            # Record blockchain transaction.
-            receipt, contract_paper_id = record_paper_upload(hash_id, constructed_filename, req.tusername) # MODIFIED: Get paperCount
-            tx_hash = receipt.transactionHash.hex()
-            final_record.blockchain_status = "Recorded"
-            final_record.tx_hash = tx_hash
-            final_record.contract_paper_id = contract_paper_id # MODIFIED: Store contract_paper_id
-            final_record.save()
-
-            # Only after successful processing, update the request status.
-            req.status = "Finalized"
-            req.save()
-
-            # Remove the local encrypted file for security.
-            if os.path.exists(file_path):
-                os.remove(file_path)
-
-            messages.success(request, "Paper finalized successfully and securely recorded.", extra_tags='finalize')
-        except Exception as e:
-            messages.error(request, f"Finalization error: {str(e)}", extra_tags="finalize")
+            error = "No pending finalization found for this request."
+        elif not req.encrypted_file:
+            error = "Encrypted file missing for this request. Please ask the teacher to re-upload."
+        else:
+            error = None
+        if error:
+            if is_ajax:
+                return JsonResponse({'error': error}, status=400)
+            messages.error(request, error, extra_tags='finalize')
             return redirect('coe_dashboard')
 
+        # Finalization (IPFS, decryption, chain record) runs on the job queue.
+        job = enqueue_finalization(req, request.user.username)
+        if is_ajax:
+            return JsonResponse({'job_id': job.id, 'status_url': reverse('finalization_status', args=[job.id])}, status=202)
+        messages.success(request, f"Finalization queued (job {job.id}).", extra_tags='finalize')
         return redirect('coe_dashboard')
     else:
-        # GET: Show complete history of all requests.
-        requests_data = Request.objects.all().values("tusername", "status")
-        arr = []
-        for r in requests_data:
-            user_info = CustomUser.objects.filter(username=r["tusername"]).values("first_name", "last_name").first()
-            teacher_name = f"{user_info['first_name']} {user_info['last_name']}" if user_info else r["tusername"]
-            arr.append({"name": teacher_name, "status": r["status"]})
-        return render(request, "coe.html", {"arr": arr})
+        # GET: Show one page of the request history.
+        page, filters = request_history(request.GET)
+        return render(request, "coe.html", {
+            "arr": page.object_list,
+            "page_obj": page,
+            "filters": filters,
+            "statuses": REQUEST_STATUSES,
+            "subjects": [value for value, _ in SUB if value != 'None'],
+        })
+
 
+# Sort keys accepted by the request history (with an optional leading '-').
+HISTORY_SORT_FIELDS = ('name', 'status', 's_code', 'subject', 'exam_time', 'id')
+
+def request_history(params):
+    """Returns (page, filters) for the COE request history; always two queries (count and page)."""
+    teacher = CustomUser.objects.filter(username=OuterRef('tusername'))
+    queryset = Request.objects.annotate(
+        name=Coalesce(
+            Subquery(teacher.annotate(full_name=Concat('first_name', Value(' '), 'last_name')).values('full_name')[:1]),
+            'tusername',
+        ),
+        subject=Subquery(SubjectCode.objects.filter(s_code=OuterRef('s_code')).values('subject')[:1]),
+    )
+
+    filters = {
+        'status': params.get('status', ''),
+        'subject': params.get('subject', ''),
+        'sort': params.get('sort', 'id'),
+    }
+    if filters['status']:
+        queryset = queryset.filter(status=filters['status'])
+    if filters['subject']:
+        queryset = queryset.filter(Q(subject=filters['subject']) | Q(s_code=filters['subject']))
+    if filters['sort'].lstrip('-') not in HISTORY_SORT_FIELDS:
+        filters['sort'] = 'id'
+    queryset = queryset.order_by(filters['sort'], 'id').values('id', 'name', 'status', 's_code', 'subject', 'exam_time')
+
+    paginator = Paginator(queryset, settings.COE_HISTORY_PAGE_SIZE)
+    return paginator.get_page(params.get('page')), filters
 
-from django.utils import timezone
-import datetime
 
 @login_required(login_url='login')
-@csrf_exempt
-def st_dashboard(request):  # Django's HttpRequest object
-    queryset = FinalPapers.objects.all()
-    final_papers_data = []
-
-    now = timezone.now()  # Get the current time (time-zone aware)
-
-    print("DEBUG (st_dashboard): Starting to process final_papers_data loop") # Debug 1
-
-    for paper in queryset:
-        try:
-            # Fetch the associated request for this paper
-            exam_request = Request.objects.filter(s_code=paper.s_code, status="Finalized").first()
-            if exam_request:
-                exam_time = exam_request.exam_time
-                time_difference = exam_time - now
-                downloadable = time_difference <= datetime.timedelta(minutes=20)
-            else:
-                downloadable = False
-
-        except Request.DoesNotExist:
-            downloadable = False
-
-        final_papers_data.append({
-            'exam_time': exam_time if exam_request else None,
-            'paper': paper,
-            'downloadable': downloadable,
-            'timediff': time_difference if exam_request else None,
-            'already_downloaded': paper.downloaded,  # Pass downloaded status to template
-            'django_paper_id': paper.id, # Debug: Django FinalPapers ID
-            'contract_paper_id': paper.contract_paper_id # Debug: Contract Paper ID
-        })
+def coe_request_history(request):
+    """JSON version of the COE request history for the jQuery table."""
+    page, filters = request_history(request.GET)
+    return JsonResponse({
+        'results': [{**row, 'exam_time': row['exam_time'].isoformat() if row['exam_time'] else None} for row in page.object_list],
+        'page': page.number,
+        'num_pages': page.paginator.num_pages,
+        'count': page.paginator.count,
+        'has_next': page.has_next(),
+        'has_previous': page.has_previous(),
+        'filters': filters,
+    })
+
 
-    print("DEBUG (st_dashboard): final_papers_data prepared:") # Debug 2
-    for item in final_papers_data: # Debug 3: Print details of each item in final_papers_data
-        print(f"DEBUG (st_dashboard):   Django Paper ID: {item['django_paper_id']}, Contract Paper ID: {item['contract_paper_id']}, Downloadable: {item['downloadable']}, Already Downloaded: {item['already_downloaded']}")
+@login_required(login_url='login')
+@user_passes_test(lambda u: u.role == 'coe')
+def coe_finalize_all(request):
+    """Queues a finalization job for every pending request of a subject; the job workers run them."""
+    if request.method != "POST":
+        return redirect('coe_dashboard')
+    s_code = request.POST.get('s_code')
+    if not s_code:
+        return JsonResponse({'error': "No subject code given."}, status=400)
 
+    claimed, skipped = claim_requests(pending_requests(s_code=s_code), request.user.username)
+    wake_workers()
+    return JsonResponse({
+        'jobs': [{'request_id': req.id, 'job_id': job.id, 'status_url': reverse('finalization_status', args=[job.id])}
+                 for req, job in claimed],
+        'skipped': skipped,
+    }, status=202)
 
-    if request.method == 'POST':  # Handle download requests
+
+@login_required(login_url='login')
+@user_passes_test(lambda u: u.role == 'coe')
+def finalization_status(request, job_id):
+    job = get_object_or_404(FinalizationJob, id=job_id)
+    return JsonResponse({
+        'job_id': job.id,
+        'request_id': job.request_id,
+        'status': job.status,
+        'stage': job.stage,
+        'stages': [{'name': name, **job.stages[name]} for name in STAGES if name in job.stages],
+        'error': job.error,
+        'updated_at': job.updated_at.isoformat(),
+    })
+
+
+@login_required(login_url='login')
+@csrf_exempt
+def st_dashboard(request):  # Django's HttpRequest object
+    if request.method == 'POST':  # Handle download requests; the listing is not needed here.
         paper_id_str = request.POST.get('paper_id')
-        print(f"DEBUG (st_dashboard): POST request received. paper_id_str from form: {paper_id_str}") # Debug 4
         if paper_id_str:
             try:
                 paper_id = int(paper_id_str)
-                print(f"DEBUG (st_dashboard): paper_id (int) to lookup (contract_paper_id): {paper_id}") # Debug 5 - Clarified debug message
-                paper_instance = get_object_or_404(FinalPapers, contract_paper_id=paper_id) # MODIFIED: Lookup by contract_paper_id
-                print(f"DEBUG (st_dashboard): FinalPapers instance found for contract_paper_id: {paper_id}, Django Paper ID: {paper_instance.id}, Contract Paper ID: {paper_instance.contract_paper_id}") # Debug 6 - Clarified debug message
-
-                if paper_instance.downloaded:  # Check if already downloaded
+                # The check and the claim are one conditional UPDATE, so of several superintendents
+                # clicking at once exactly one gets the paper. The download event is queued in the
+                # same statement and sent to the chain by the outbox worker.
+                paper_instance = claim_download(paper_id, request.user.username)
+                if paper_instance is None:
+                    trace_sampled('st_claim_refused', contract_paper_id=paper_id, user=request.user.username)
+                    if not FinalPapers.objects.filter(contract_paper_id=paper_id).exists(): # MODIFIED: Lookup by contract_paper_id
+                        raise Http404("No paper with this ID.")
                     messages.error(request, "This paper has already been downloaded.") # Optional message
                     return redirect('st_dashboard') # Redirect to dashboard or handle as needed
+                trace_sampled('st_claim', contract_paper_id=paper_id, paper_id=paper_instance.id, user=request.user.username)
+                invalidate_dashboard()
 
-                try:
-                    # Record download event on blockchain
-                    download_tx_hash = record_paper_download_event(
-                        paper_id, # Pass contract_paper_id (which is now 'paper_id' variable)
-                        paper_instance.filename,
-                        request.user.username
-                    )
-                    # Update the model
-                    paper_instance.download_tx_hash = download_tx_hash
-                    paper_instance.downloaded = True  # Set downloaded to True after successful download
-                    paper_instance.save()
-
-                except Exception as e:
-                    messages.error(request, f"Error recording download on blockchain: {e}")
-
-                # Serve the file for download
-                file_path = paper_instance.paper.path
-                with open(file_path, 'rb') as f:
-                    response = HttpResponse(f.read(), content_type="application/pdf")
-                    response['Content-Disposition'] = f'attachment; filename="{paper_instance.s_code}.pdf"'
-                    return response
+                # Send the browser to a short-lived signed link that streams the file.
+                return redirect(download_url(paper_instance, request.user.username))
 
             except ValueError:
                 messages.error(request, "Invalid paper ID format.")
-        else:
-            print("DEBUG (st_dashboard): paper_id_str is empty in POST request") # Debug 7
+        return redirect('st_dashboard')
 
-    return render(request, 'superintendent.html', {'final_papers_data': final_papers_data})
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    # Pre-computed by the pre-staging scheduler ahead of each download window.
+    rows, has_next = dashboard_page(page)
+
+    final_papers_data = [{
+        'exam_time': row['exam_time'],
+        'paper': row,
+        'downloadable': row['downloadable'],
+        'timediff': row['timediff'],
+        'already_downloaded': row['downloaded'],  # Pass downloaded status to template
+    } for row in rows]
+
+    return render(request, 'superintendent.html', {
+        'final_papers_data': final_papers_data,
+        'page': page,
+        'has_previous': page > 1,
+        'has_next': has_next,
+    })
 
 
-# New View for Transaction History (COE only)
-from web3._utils.events import get_event_data
+@login_required(login_url='login')
+def paper_download(request, paper_id):
+    """Serves a claimed paper through the signed link issued by st_dashboard."""
+    if not check_token(request.GET.get('token', ''), paper_id, request.user.username):
+        return HttpResponseForbidden("This download link is invalid or has expired.")
+    paper_instance = get_object_or_404(FinalPapers, id=paper_id, downloaded=True)
+    return serve_paper(request, paper_instance)
+
 
+# New View for Transaction History (COE only)
 @login_required(login_url='login')
 @user_passes_test(lambda u: u.role == 'coe')
 def transaction_history_coe(request):
@@ -292,68 +336,28 @@ def transaction_history_coe(request):
         messages.error(request, "You do not have permission to access this page.", extra_tags='access_denied')
         return render(request, 'transaction_history_coe.html', {'transactions': []}) # Or redirect to another page if preferred
 
-    w3 = Web3(Web3.HTTPProvider(settings.BLOCKCHAIN_GANACHE_URL))
+    # Events are indexed in the background by `manage.py index_chain_events`.
+    transactions = ChainEvent.objects.order_by('-timestamp', '-block_number', '-log_index').values(
+        'tx_hash', 'block_number', 'timestamp', 'event_type', 'initiator', 'filename', 'paper_id'
+    )
 
-    # Build a dict of event ABIs from contract_abi (assumed to be imported/defined)
-    event_abis = {item['name']: item for item in contract_abi if item.get('type') == 'event'}
-    if not all(name in event_abis for name in ('PaperUploaded', 'PaperDownloaded')):
-        messages.error(request, "Event ABIs not found in contract ABI.")
-        return render(request, 'transaction_history_coe.html', {'transactions': []})
+    return render(request, 'transaction_history_coe.html', {'transactions': transactions})
 
-    # Pre-calculate event signature topics
-    topics = {
-        'Upload': "0x" + w3.keccak(text="PaperUploaded(uint256,string,string,string,uint256)").hex(),
-        'Download': "0x" + w3.keccak(text="PaperDownloaded(uint256,uint256,string,string,uint256)").hex()
-    }
 
-    # Fetch logs for PaperUploaded
-    uploaded_filter = w3.eth.filter({
-        "address": settings.BLOCKCHAIN_CONTRACT_ADDRESS,
-        "fromBlock": 0,
-        "topics": [topics['Upload']]
-    })
-    uploaded_events = w3.eth.get_filter_logs(uploaded_filter.filter_id)
-
-    # Fetch logs for PaperDownloaded
-    downloaded_events = w3.eth.get_logs({
-        'address': settings.BLOCKCHAIN_CONTRACT_ADDRESS,
-        'fromBlock': 0,
-        'toBlock': 'latest',
-        'topics': [topics['Download']]
-    })
+@login_required(login_url='login')
+@user_passes_test(lambda u: u.role == 'coe')
+def cache_stats(request):
+    # Hit and miss counters of the reference cache (this process) and of pre-staging.
+    return JsonResponse({'reference': reference_stats(), 'prestage': prestage_stats()})
 
-    # Helper function to decode an event log
-    def decode_event(event, event_type):
-        abi = event_abis['PaperUploaded'] if event_type == 'Upload' else event_abis['PaperDownloaded']
-        decoded = get_event_data(w3.codec, abi, event)
-        # Try to retrieve the block timestamp; fallback to the decoded event's timestamp
-        block = w3.eth.get_block(event['blockNumber'])
-        ts = block.get('timestamp') or decoded['args'].get('timestamp')
-        # Convert Unix timestamp (seconds) to a Python datetime object
-        timestamp = datetime.datetime.fromtimestamp(ts) if ts else None
-        print(timestamp)
-        args = decoded['args']
-        if event_type == 'Upload':
-            initiator = args.get('uploader', '')
-            paper_id = args.get('id', '')
-        else:
-            initiator = args.get('downloader', '')
-            paper_id = args.get('paperId', '')
-        return {
-            'tx_hash': event['transactionHash'].hex(),
-            'block_number': event['blockNumber'],
-            'timestamp': timestamp,
-            'event_type': event_type,
-            'initiator': initiator,
-            'filename': args.get('filename', ''),
-            'paper_id': paper_id
-        }
-
-    transactions = ([decode_event(ev, 'Upload') for ev in uploaded_events] +
-                    [decode_event(ev, 'Download') for ev in downloaded_events])
-    transactions.sort(key=lambda x: x['timestamp'] or 0, reverse=True)
 
-    return render(request, 'transaction_history_coe.html', {'transactions': transactions})
+def metrics(request):
+    # Scraped by Prometheus with `Authorization: Bearer <METRICS_TOKEN>`; a logged-in COE may look too.
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    allowed = bool(settings.METRICS_TOKEN) and constant_time_compare(token, settings.METRICS_TOKEN)
+    if not allowed and not (request.user.is_authenticated and request.user.role == 'coe'):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 
@@ -444,25 +448,21 @@ def get_teachers(request):
     branch = request.POST.get('branch')
     subject = request.POST.get('subject')
 
-    # Exclude teachers with active requests.
-    active_teachers = Request.objects.filter(
-        status__in=['Pending', 'Accepted', 'Uploaded', 'Pending Finalization']
-    ).values_list('tusername', flat=True).distinct()
-
-    s_code_qs = SubjectCode.objects.filter(subject=subject).values()
-    if not s_code_qs:
+    # Subject codes and teachers with active requests come from the in-process cache.
+    s_code = subject_code(subject)
+    if not s_code:
         return JsonResponse({'error': 'Subject code not found for the given subject'}, status=400)
-    s_code = s_code_qs[0]['s_code']
 
     # Return requests that are pending finalization for this subject.
     queryset2 = Request.objects.filter(s_code=s_code, status='Pending Finalization').values('id')
 
-    queryset = CustomUser.objects.filter(
+    busy = active_teachers()
+    queryset = [teacher for teacher in CustomUser.objects.filter(
         course=course,
         semester=semester,
         branch=branch,
         subject=subject
-    ).exclude(username__in=active_teachers).values()
+    ).values() if teacher['username'] not in busy]
 
     data = {
         'queryset': list(queryset),
@@ -480,15 +480,20 @@ def add_teacher(request):
     t_id = request.POST.get('g_id')
     deadline = request.POST.get('paper_deadline', None)
     exam_time = request.POST.get('exam_time',None)
-    username = CustomUser.objects.filter(id=t_id).values('username')
-    print(s_code, syllabus, t_id)
-    Request.objects.create(
-        tusername=username[0]['username'],
-        s_code=s_code,
-        syllabus=syllabus,
-        q_pattern=q_pattern,
-        paper_deadline=deadline,
-        exam_time = exam_time
-    )
+    trace_sampled('add_teacher', s_code=s_code, syllabus=syllabus, teacher=t_id)
+    with transaction.atomic():
+        # The dropdown's busy set may be stale in other processes (see EMS.refcache), so
+        # check the database again; the row lock keeps two submissions from both passing.
+        username = CustomUser.objects.select_for_update().filter(id=t_id).values('username')
+        if Request.objects.filter(tusername=username[0]['username'], status__in=ACTIVE_REQUEST_STATUSES).exists():
+            return JsonResponse({'error': "This teacher already has an active request."}, status=409)
+        Request.objects.create(
+            tusername=username[0]['username'],
+            s_code=s_code,
+            syllabus=syllabus,
+            q_pattern=q_pattern,
+            paper_deadline=deadline,
+            exam_time = exam_time
+        )
     new_teacher = CustomUser.objects.filter(username=username[0]['username']).values()
     return JsonResponse({'new_teacher': list(new_teacher)})
\ No newline at end of file
@@ -0,0 +1,63 @@
+from django.conf import settings
+import json, threading
+
+# One Web3 client per process, created on first use. It talks to the node over a
+# keep-alive session pool and caches everything that does not change between calls:
+# the contract ABI, event ABIs and topics, and the sender account. web3 and requests
+# are imported here too, so importing the app stays fast and needs no node.
+
+
+class ChainClient:
+    def __init__(self):
+        from eth_utils import event_abi_to_log_topic
+        from requests.adapters import HTTPAdapter
+        from web3 import Web3
+        import requests
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.BLOCKCHAIN_POOL_SIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self.session = session
+
+        self.web3 = Web3(Web3.HTTPProvider(
+            settings.BLOCKCHAIN_GANACHE_URL,
+            session=session,
+            request_kwargs={'timeout': (settings.BLOCKCHAIN_CONNECT_TIMEOUT, settings.BLOCKCHAIN_REQUEST_TIMEOUT)},
+        ))
+
+        with open(settings.BLOCKCHAIN_ABI_PATH) as f:
+            self.abi = json.load(f)["abi"]
+        self.address = Web3.to_checksum_address(settings.BLOCKCHAIN_CONTRACT_ADDRESS)
+        self.contract = self.web3.eth.contract(address=self.address, abi=self.abi)
+
+        self.event_abis = {item['name']: item for item in self.abi if item.get('type') == 'event'}
+        self.topics = {name: "0x" + event_abi_to_log_topic(abi).hex() for name, abi in self.event_abis.items()}
+
+        self._account = settings.BLOCKCHAIN_SENDER_ACCOUNT
+        self._account_lock = threading.Lock()
+
+    @property
+    def account(self):
+        """The account transactions are sent from; looked up from the node once."""
+        if self._account is None:
+            with self._account_lock:
+                if self._account is None:
+                    self._account = self.web3.eth.accounts[0]
+        return self._account
+
+    def is_connected(self):
+        return self.web3.is_connected()
+
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = ChainClient()
+    return _client
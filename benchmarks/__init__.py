@@ -0,0 +1,31 @@
+"""Local performance benchmarks. Run from the project root, e.g. `python -m benchmarks.keypool`."""
+import os, statistics, sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django(settings_module='clgproject.settings'):
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(pct / 100.0 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(samples):
+    """Returns count, mean and p50/p95/p99 of a list of latencies in seconds, in milliseconds."""
+    return {
+        'count': len(samples),
+        'mean_ms': statistics.mean(samples) * 1000 if samples else 0.0,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+    }
@@ -0,0 +1,57 @@
+"""Gas and throughput of per-paper uploadPaper transactions, the baseline for batched anchoring.
+
+Deploys a fresh PaperStorage from the truffle artifact on BLOCKCHAIN_GANACHE_URL, so the
+contract the application uses is left untouched, or with --evm on the in-process chain of
+benchmarks.standins, which needs no Ganache.
+
+    python -m benchmarks.anchoring --papers 200 --evm
+"""
+import argparse, json, time
+
+from benchmarks import setup_django
+
+
+def deploy(client, artifact):
+    contract = client.web3.eth.contract(abi=artifact['abi'], bytecode=artifact['bytecode'])
+    tx_hash = contract.constructor().transact({'from': client.account})
+    return client.web3.eth.wait_for_transaction_receipt(tx_hash).contractAddress
+
+
+def per_paper(papers):
+    from EMS.blockchain import submit_paper_upload
+    started = time.perf_counter()
+    futures = [submit_paper_upload(f"Qm{i:044d}", f"P{i}.pdf", f"teacher{i}") for i in range(papers)]
+    receipts = [future.result() for future in futures]
+    elapsed = time.perf_counter() - started
+    return sum(r['gasUsed'] for r in receipts), len(receipts), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--papers', type=int, default=100)
+    parser.add_argument('--evm', action='store_true', help="Use the in-process EVM stand-in instead of Ganache.")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from EMS import web3_client
+
+    with open(settings.BLOCKCHAIN_ABI_PATH) as f:
+        artifact = json.load(f)
+    if args.evm:
+        from benchmarks.standins import EvmNode
+        node = EvmNode(settings.BLOCKCHAIN_ABI_PATH)
+        settings.BLOCKCHAIN_GANACHE_URL = node.url
+        settings.BLOCKCHAIN_SENDER_ACCOUNT = None
+        settings.BLOCKCHAIN_CONTRACT_ADDRESS = node.contract_address
+    else:
+        settings.BLOCKCHAIN_CONTRACT_ADDRESS = deploy(web3_client.get_client(), artifact)
+    web3_client._client = None
+
+    gas, transactions, elapsed = per_paper(args.papers)
+    print(f"per-paper: {transactions} tx, {gas} gas total, {gas / args.papers:.0f} gas/paper, "
+          f"{args.papers / elapsed:.1f} papers/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Concurrent download claims: the old read-check-save against the single-statement claim.
+
+Creates a scratch test database with --papers papers and lets --threads threads claim
+them, each paper raced by --contenders threads at once. Reports claim latency,
+claims per second and how many papers were handed out more than once.
+
+    python -m benchmarks.claims --papers 500 --threads 32 --contenders 4
+"""
+import argparse, queue, threading, time
+
+from benchmarks import setup_django, summarize
+
+
+def read_check_save(contract_paper_id, username):
+    """The old path: load the row, check `downloaded`, save the whole row, queue the event."""
+    from django.db import transaction
+    from EMS.models import FinalPapers
+    from EMS.outbox import enqueue_download
+    paper = FinalPapers.objects.get(contract_paper_id=contract_paper_id)
+    if paper.downloaded:
+        return None
+    with transaction.atomic():
+        paper.downloaded = True
+        paper.save()
+        enqueue_download(paper, username)
+    return paper
+
+
+def single_statement(contract_paper_id, username):
+    from EMS.outbox import claim_download
+    return claim_download(contract_paper_id, username)
+
+
+def run(claim, papers, threads, contenders):
+    from django.db import connection
+    from EMS.models import ChainOutbox, FinalPapers
+
+    FinalPapers.objects.update(downloaded=False)
+    ChainOutbox.objects.all().delete()
+    wins = {}
+    wins_lock = threading.Lock()
+    barriers = {paper: threading.Barrier(contenders) for paper in range(papers)}
+
+    def attempt(task):
+        paper, contender = task
+        barriers[paper].wait()
+        started = time.perf_counter()
+        try:
+            won = claim(paper, f'superintendent{contender}') is not None
+        except Exception:  # e.g. the duplicate outbox key in the old path
+            won = False
+        elapsed = time.perf_counter() - started
+        if won:
+            with wins_lock:
+                wins[paper] = wins.get(paper, 0) + 1
+        return elapsed
+
+    tasks = queue.Queue()
+    for paper in range(papers):
+        for contender in range(contenders):
+            tasks.put((paper, contender))
+    latencies = []
+
+    def worker():
+        try:
+            while True:
+                try:
+                    task = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                latencies.append(attempt(task))
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stats = summarize(latencies)
+    stats['claims_per_s'] = len(latencies) / elapsed
+    stats['double_claims'] = sum(count > 1 for count in wins.values())
+    stats['unclaimed'] = papers - len(wins)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--papers', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--contenders', type=int, default=4, help="Threads racing for each paper.")
+    args = parser.parse_args()
+    if args.threads % args.contenders:
+        parser.error("--threads must be a multiple of --contenders so every race can start.")
+
+    setup_django()
+    from django.conf import settings
+    from django.db import connection
+    from EMS.models import FinalPapers
+
+    settings.CHAIN_OUTBOX_RUN_IN_PROCESS = False  # measure the claim, not the chain
+
+    test_db = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        FinalPapers.objects.bulk_create(
+            FinalPapers(s_code=f'B{n:06d}', paper=f'B{n:06d}.pdf', filename=f'B{n:06d}.pdf', contract_paper_id=n)
+            for n in range(args.papers))
+        for name, claim in (('read-check-save', read_check_save), ('single statement', single_statement)):
+            stats = run(claim, args.papers, args.threads, args.contenders)
+            print(f"{name:>16}: n={stats['count']} mean={stats['mean_ms']:.1f}ms p50={stats['p50_ms']:.1f}ms "
+                  f"p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms "
+                  f"throughput={stats['claims_per_s']:.0f} claims/s double claims={stats['double_claims']} "
+                  f"unclaimed={stats['unclaimed']}")
+    finally:
+        connection.close()
+        connection.creation.destroy_test_db(test_db, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Concurrent paper downloads: buffered HttpResponse, streaming FileResponse and X-Accel-Redirect.
+
+Serves a scratch file from an in-process threaded WSGI server through Django's handler
+and downloads it from many client threads at once. Reports latency, throughput and the
+peak Python heap of the whole run (tracemalloc). The X-Accel-Redirect row shows the
+time a Django worker is busy; the bytes would be sent by nginx.
+
+    python -m benchmarks.downloads --clients 50 --downloads 200 --paper-size 5000000
+"""
+import argparse, os, socketserver, tempfile, threading, time, tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from benchmarks import setup_django, summarize
+
+PAPER_PATH = None
+
+
+def buffered(request):
+    """The old download path: the whole file is read into memory."""
+    from django.http import HttpResponse
+    with open(PAPER_PATH, 'rb') as f:
+        response = HttpResponse(f.read(), content_type="application/pdf")
+        response['Content-Disposition'] = 'attachment; filename="paper.pdf"'
+        return response
+
+
+def streaming(request):
+    from EMS.downloads import file_response
+    return file_response(request, PAPER_PATH, 'paper.pdf')
+
+
+def accel(request):
+    from EMS.downloads import accel_response
+    return accel_response(PAPER_PATH, 'paper.pdf')
+
+
+def _urlpatterns():
+    from django.urls import path
+    return [path('buffered', buffered), path('streaming', streaming), path('accel', accel)]
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def run(base_url, mode, clients, downloads):
+    import requests
+
+    local = threading.local()
+
+    def download(_):
+        session = getattr(local, 'session', None) or requests.Session()
+        local.session = session
+        started = time.perf_counter()
+        received = 0
+        with session.get(f"{base_url}/{mode}", stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(64 * 1024):
+                received += len(chunk)
+        return time.perf_counter() - started, received
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(download, range(downloads)))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = summarize([latency for latency, _ in results])
+    stats['mb_per_s'] = sum(received for _, received in results) / elapsed / 1e6
+    stats['peak_heap_mb'] = peak / 1e6
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--downloads', type=int, default=200)
+    parser.add_argument('--paper-size', type=int, default=5 * 1000 * 1000)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.core.handlers.wsgi import WSGIHandler
+    import benchmarks.downloads as module
+
+    global PAPER_PATH
+    media_root = tempfile.mkdtemp(prefix='bench-downloads-')
+    PAPER_PATH = os.path.join(media_root, 'paper.pdf')
+    with open(PAPER_PATH, 'wb') as f:
+        f.write(os.urandom(args.paper_size))
+    settings.MEDIA_ROOT = media_root
+    settings.PAPER_DOWNLOAD_ACCEL_REDIRECT = '/protected-media/'
+    settings.ALLOWED_HOSTS = ['*']
+    module.urlpatterns = _urlpatterns()
+    settings.ROOT_URLCONF = 'benchmarks.downloads'
+
+    server = make_server('127.0.0.1', 0, WSGIHandler(), server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    try:
+        for mode in ('buffered', 'streaming', 'accel'):
+            stats = run(base_url, mode, args.clients, args.downloads)
+            print(f"{mode:>10}: n={stats['count']} mean={stats['mean_ms']:.1f}ms p50={stats['p50_ms']:.1f}ms "
+                  f"p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms "
+                  f"throughput={stats['mb_per_s']:.1f}MB/s peak heap={stats['peak_heap_mb']:.1f}MB")
+    finally:
+        server.shutdown()
+        os.remove(PAPER_PATH)
+        os.rmdir(media_root)
+
+
+if __name__ == '__main__':
+    main()
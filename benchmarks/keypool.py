@@ -0,0 +1,55 @@
+"""Teacher upload latency (stream encryption + RSA wrapping) with and without the RSA key pool.
+
+    python -m benchmarks.keypool --uploads 40 --paper-size 2000000 --interval 0.25
+"""
+import argparse, os, tempfile, time
+
+from benchmarks import setup_django, summarize
+
+
+def run(uploads, paper_size, interval, pool_size):
+    from django.conf import settings
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from EMS import keypool
+    from EMS.encryption import encrypt_file
+    from EMS.a_encryption import a_encryption
+
+    keypool._pool = keypool.KeyPool(pool_size)
+    if pool_size:
+        keypool._pool.start()
+        while keypool._pool.available() < pool_size:
+            time.sleep(0.05)
+
+    payload = os.urandom(paper_size)
+    samples = []
+    for i in range(uploads):
+        paper = SimpleUploadedFile(f"bench_{pool_size}_{i}.pdf", payload)
+        started = time.perf_counter()
+        key = encrypt_file(paper)
+        a_encryption("placeholder_hash", key, f"TEA-{i}")
+        samples.append(time.perf_counter() - started)
+        os.remove(os.path.join(settings.ENCRYPTION_ROOT, f"{paper.name}.encrypted"))
+        time.sleep(interval)
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uploads', type=int, default=30)
+    parser.add_argument('--paper-size', type=int, default=1024 * 1024)
+    parser.add_argument('--interval', type=float, default=0.25, help="Seconds between uploads (arrival rate).")
+    parser.add_argument('--pool-size', type=int, default=8)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    settings.ENCRYPTION_ROOT = tempfile.mkdtemp(prefix='bench-keypool-')
+
+    for label, size in (('no pool', 0), (f'pool={args.pool_size}', args.pool_size)):
+        stats = run(args.uploads, args.paper_size, args.interval, size)
+        print(f"{label:>10}: n={stats['count']} mean={stats['mean_ms']:.1f}ms "
+              f"p50={stats['p50_ms']:.1f}ms p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
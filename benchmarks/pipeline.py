@@ -0,0 +1,270 @@
+"""End-to-end pipeline: teacher upload, COE finalization, chain record, superintendent download.
+
+Runs the real views (teacher_dashboard, coe_dashboard, st_dashboard and the download
+link) through Django's test client against a scratch test database, with the chain and
+IPFS replaced by the in-process stand-ins of benchmarks.standins. Each of --concurrency
+threads takes papers through the whole pipeline; every combination of --paper-size and
+--concurrency is one run. Reports per-stage latency percentiles (including the
+finalization job's own stages), papers per second and the peak RSS of the process so far, and
+with --json writes the results with the commit they were measured on. --compare prints
+the change against such a file.
+
+    python -m benchmarks.pipeline --papers 40 --paper-size 100000 --paper-size 5000000 --concurrency 1 --concurrency 4
+"""
+import argparse, datetime, json, logging, os, resource, shutil, subprocess, sys, tempfile, threading, time
+
+from benchmarks import BASE_DIR, setup_django, summarize
+
+POLL_INTERVAL = 0.02  # seconds between status checks while a paper waits on a worker
+STAGE_TIMEOUT = 300  # seconds a paper may spend waiting in one stage
+
+
+def configure(root, node, ipfs):
+    """Points the application at the stand-ins and a scratch directory."""
+    from django.conf import settings
+    from EMS import ipfs_client, web3_client
+    settings.DEBUG = False  # no query log
+    settings.BLOCKCHAIN_GANACHE_URL = node.url
+    settings.BLOCKCHAIN_CONTRACT_ADDRESS = node.contract_address
+    settings.BLOCKCHAIN_SENDER_ACCOUNT = None
+    settings.IPFS_STORAGE_API_URL = ipfs.api_url
+    settings.IPFS_STORAGE_GATEWAY_URL = ipfs.gateway_url
+    settings.MEDIA_ROOT = os.path.join(root, 'media')
+    settings.ENCRYPTION_ROOT = os.path.join(root, 'encrypted')
+    settings.UPLOAD_STAGING_ROOT = os.path.join(root, 'staging')
+    settings.PRESTAGE_RUN_IN_PROCESS = False
+    os.makedirs(settings.ENCRYPTION_ROOT)
+    os.makedirs(settings.MEDIA_ROOT)
+    os.chdir(root)  # decrypt_file writes to media/ under the working directory
+    web3_client._client = None
+    ipfs_client._client = None
+
+
+def create_users(papers, tag):
+    """One teacher with an accepted request per paper, plus a COE and a superintendent."""
+    from django.contrib.auth.hashers import make_password
+    from django.core.files.base import ContentFile
+    from django.core.files.storage import default_storage
+    from django.utils import timezone
+    from EMS.models import CustomUser, Request, allocate_teacher_ids
+
+    password = make_password('pw')  # hashed once; the benchmark logs in with force_login
+    teacher_ids = allocate_teacher_ids(papers)
+    teachers = CustomUser.objects.bulk_create(
+        CustomUser(username=f'bench{tag}-{n}', password=password, role='teacher', teacher_id=teacher_ids[n],
+                   course='B.E.', semester='VII', branch='CSE', subject='Cloud Computing')
+        for n in range(papers))
+    coe = CustomUser.objects.create(username=f'bench{tag}-coe', password=password, role='coe')
+    superintendent = CustomUser.objects.create(username=f'bench{tag}-st', password=password, role='superintendent')
+
+    syllabus = default_storage.save('syllabus.pdf', ContentFile(b'syllabus'))
+    now = timezone.now()
+    requests = Request.objects.bulk_create(
+        Request(tusername=teacher.username, s_code=f'{tag}{n:04d}', syllabus=syllabus, q_pattern=syllabus, status='Accepted',
+                paper_deadline=now + datetime.timedelta(hours=1), exam_time=now + datetime.timedelta(minutes=10))
+        for n, teacher in enumerate(teachers))
+    return list(zip(teachers, requests)), coe, superintendent
+
+
+def wait_for(check, what):
+    deadline = time.monotonic() + STAGE_TIMEOUT
+    while True:
+        value = check()
+        if value:
+            return value
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Timed out waiting for {what}.")
+        time.sleep(POLL_INTERVAL)
+
+
+def run_paper(teacher, req, coe, superintendent, paper, timings):
+    """Takes one paper through the pipeline, adding (stage, seconds) pairs to timings."""
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test import Client
+    from django.urls import reverse
+    from EMS.models import FinalizationJob, FinalPapers
+
+    def timed(stage, call):
+        started = time.perf_counter()
+        result = call()
+        timings.append((stage, time.perf_counter() - started))
+        return result
+
+    started = time.perf_counter()
+    client = Client()
+    client.force_login(teacher)
+    timed('upload', lambda: client.post(reverse('teacher_dashboard'), {
+        'req_id': req.id, 'paper': SimpleUploadedFile(f'{req.s_code}.pdf', paper, 'application/pdf')}))
+
+    client = Client()
+    client.force_login(coe)
+
+    def finalize():
+        response = client.post(reverse('coe_dashboard'), {'s_code': req.s_code, 't_id': req.id},
+                               HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        if response.status_code != 202:
+            raise RuntimeError(f"Finalization was not queued: {response.content[:200]!r}")
+        job_id = response.json()['job_id']
+        return wait_for(lambda: FinalizationJob.objects.filter(id=job_id, status__in=['Completed', 'Failed']).first(),
+                        f"finalization job {job_id}")
+    job = timed('finalize', finalize)
+    if job.status != 'Completed':
+        raise RuntimeError(f"Finalization failed: {job.error}")
+    for name, stage in job.stages.items():
+        if stage.get('started') and stage.get('finished'):
+            elapsed = datetime.datetime.fromisoformat(stage['finished']) - datetime.datetime.fromisoformat(stage['started'])
+            timings.append((f'finalize.{name}', elapsed.total_seconds()))
+
+    final = FinalPapers.objects.get(s_code=req.s_code)
+    contract_paper_id = timed('chain_record', lambda: wait_for(
+        lambda: FinalPapers.objects.filter(id=final.id).values_list('contract_paper_id', flat=True).first(),
+        f"the chain record of paper {final.id}"))
+
+    client = Client()
+    client.force_login(superintendent)
+    response = timed('claim', lambda: client.post(reverse('st_dashboard'), {'paper_id': contract_paper_id}))
+    if response.status_code != 302 or 'paper_download' not in response['Location']:
+        raise RuntimeError("The paper could not be claimed.")
+
+    def download(url):
+        response = client.get(url)
+        return b''.join(response.streaming_content) if response.streaming else response.content
+    if timed('download', lambda: download(response['Location'])) != paper:
+        raise RuntimeError("The downloaded paper differs from the upload.")
+    timings.append(('pipeline', time.perf_counter() - started))
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished children (ru_maxrss is in KiB on Linux)."""
+    scale = 1 if sys.platform == 'darwin' else 1024  # bytes on macOS
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return own / 2 ** 20, children / 2 ** 20
+
+
+def run(papers, paper_size, concurrency, tag):
+    from django.db import connection
+    assignments, coe, superintendent = create_users(papers, tag)
+    payload = os.urandom(paper_size)
+    timings, errors = [], []
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            while True:
+                with lock:
+                    if not assignments:
+                        return
+                    teacher, req = assignments.pop()
+                samples = []
+                try:
+                    run_paper(teacher, req, coe, superintendent, payload, samples)
+                except Exception as e:
+                    errors.append(f"request {req.id}: {e}")
+                with lock:
+                    timings.extend(samples)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stages = {}
+    for stage, seconds in timings:
+        stages.setdefault(stage, []).append(seconds)
+    rss, children_rss = peak_rss_mb()
+    return {
+        'papers': papers,
+        'paper_size': paper_size,
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'papers_per_s': (papers - len(errors)) / elapsed,
+        'mb_per_s': (papers - len(errors)) * paper_size / elapsed / 2 ** 20,
+        'peak_rss_mb': rss,
+        'peak_children_rss_mb': children_rss,
+        'stages': {stage: summarize(samples) for stage, samples in sorted(stages.items())},
+        'errors': errors,
+    }
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(result, baseline=None):
+    print(f"paper size {result['paper_size']} bytes, concurrency {result['concurrency']}: "
+          f"{result['papers']} papers in {result['seconds']:.1f}s, throughput={result['papers_per_s']:.2f} papers/s "
+          f"({result['mb_per_s']:.2f} MB/s), peak RSS={result['peak_rss_mb']:.0f}MB, errors={len(result['errors'])}")
+    for stage, stats in result['stages'].items():
+        line = (f"  {stage:>26}: n={stats['count']} mean={stats['mean_ms']:.1f}ms p50={stats['p50_ms']:.1f}ms "
+                f"p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms")
+        old = baseline and baseline['stages'].get(stage)
+        if old and old['p50_ms']:
+            line += f" (p50 {100 * (stats['p50_ms'] / old['p50_ms'] - 1):+.0f}%, p95 {100 * (stats['p95_ms'] / old['p95_ms'] - 1):+.0f}%)"
+        print(line)
+    if baseline:
+        print(f"  throughput {100 * (result['papers_per_s'] / baseline['papers_per_s'] - 1):+.0f}% "
+              f"against {baseline.get('commit') or 'the baseline'}")
+    for error in result['errors'][:5]:
+        print(f"  error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--papers', type=int, default=20, help="Papers per run.")
+    parser.add_argument('--paper-size', type=int, action='append', help="Bytes per paper; repeat for several runs.")
+    parser.add_argument('--concurrency', type=int, action='append', help="Papers in flight at once; repeat for several runs.")
+    parser.add_argument('--json', metavar='PATH', help="Write the results as JSON.")
+    parser.add_argument('--compare', metavar='PATH', help="A --json file from an earlier commit to compare against.")
+    args = parser.parse_args()
+    sizes = args.paper_size or [1000000]
+    concurrencies = args.concurrency or [1, 4]
+
+    setup_django()
+    from django.conf import settings
+    from django.db import connection
+    from benchmarks.standins import EvmNode, FakeIpfs
+
+    node = EvmNode(settings.BLOCKCHAIN_ABI_PATH)
+    ipfs = FakeIpfs()
+    root = tempfile.mkdtemp(prefix='ems-pipeline-')
+    configure(root, node, ipfs)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        baseline = {(run['paper_size'], run['concurrency']): dict(run, commit=previous['commit']) for run in previous['runs']}
+
+    test_db = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    results = []
+    try:
+        for n, (size, concurrency) in enumerate((size, concurrency) for size in sizes for concurrency in concurrencies):
+            result = run(args.papers, size, concurrency, tag=f'R{n}')
+            report(result, baseline.get((size, concurrency)))
+            results.append(result)
+    finally:
+        # The in-process workers poll until the process exits; keep them quiet while their database goes.
+        logging.getLogger('EMS').setLevel(logging.CRITICAL + 1)
+        connection.close()
+        connection.creation.destroy_test_db(test_db, verbosity=0)
+        node.stop()
+        ipfs.stop()
+        shutil.rmtree(root, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'commit': commit(), 'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                       'python': sys.version.split()[0], 'cpus': os.cpu_count(), 'runs': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""In-process stand-ins for Ganache and the IPFS daemon, for benchmarks that run the whole pipeline.
+
+EvmNode serves JSON-RPC over HTTP from an eth-tester chain (py-evm, one block per
+transaction) with PaperStorage deployed from the truffle artifact; FakeIpfs answers the
+API calls EMS.ipfs_client makes (add, files/cp, cat, version) and the gateway, keeping
+content in memory and computing real CIDs with EMS.cid. Both listen on free ports on
+127.0.0.1, so the application reaches them through its usual HTTP clients.
+
+eth-tester and py-evm are benchmark-only dependencies: pip install "eth-tester[py-evm]".
+"""
+from collections.abc import Mapping
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import json, re, threading
+
+
+class _Server:
+    """A ThreadingHTTPServer on a free port, served from a daemon thread."""
+
+    def __init__(self, handler):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                length = int(self.rfile.readline().strip(), 16)
+                if length == 0:
+                    self.rfile.readline()
+                    return bytes(body)
+                body += self.rfile.read(length)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def send(self, status, body, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# --- Chain ---------------------------------------------------------------------------
+
+def _to_rpc(value):
+    """Python values from the tester provider to JSON-RPC hex quantities and data."""
+    if isinstance(value, Mapping):
+        return {key: _to_rpc(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_rpc(item) for item in value]
+    if isinstance(value, (bytes, bytearray)):
+        return '0x' + bytes(value).hex()
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, int):
+        return hex(value)
+    return value
+
+
+class EvmNode:
+    """eth-tester behind a JSON-RPC endpoint, with PaperStorage deployed at `contract_address`."""
+
+    def __init__(self, artifact_path):
+        try:
+            from web3 import EthereumTesterProvider, Web3
+            from web3.middleware import combine_middleware
+            provider = EthereumTesterProvider()
+        except ImportError as e:
+            raise SystemExit(f"The EVM stand-in needs eth-tester and py-evm ({e}); "
+                             "pip install \"eth-tester[py-evm]\".")
+        self.web3 = Web3(provider)
+        self.lock = threading.Lock()  # the tester chain is not thread-safe
+        with open(artifact_path) as f:
+            artifact = json.load(f)
+        contract = self.web3.eth.contract(abi=artifact['abi'], bytecode=artifact['bytecode'])
+        tx_hash = contract.constructor().transact({'from': self.web3.eth.accounts[0]})
+        self.contract_address = self.web3.eth.wait_for_transaction_receipt(tx_hash).contractAddress
+        # The provider's own middleware translates between JSON-RPC and eth-tester's
+        # snake_case fields; provider.make_request alone would skip it.
+        self._request = combine_middleware(middleware=tuple(provider._middleware), w3=self.web3,
+                                           provider_request_fn=provider.make_request)
+        self.server = _Server(self._handler())
+        self.url = self.server.url
+
+    def call(self, request):
+        try:
+            with self.lock:
+                response = dict(self._request(request['method'], request.get('params', [])))
+        except Exception as e:
+            return {'jsonrpc': '2.0', 'id': request.get('id'), 'error': {'code': -32000, 'message': str(e)}}
+        response = _to_rpc(response)
+        response.update(jsonrpc='2.0', id=request.get('id'))
+        return response
+
+    def _handler(self):
+        node = self
+
+        class Handler(_Handler):
+            def do_POST(self):
+                body = json.loads(self.read_body())
+                self.send(200, [node.call(item) for item in body] if isinstance(body, list) else node.call(body))
+
+        return Handler
+
+    def stop(self):
+        self.server.stop()
+
+
+# --- IPFS ----------------------------------------------------------------------------
+
+class FakeIpfs:
+    """The IPFS HTTP API at `api_url` and a read-only gateway at `gateway_url`."""
+
+    def __init__(self):
+        self.blocks = {}  # cid -> content
+        self.mfs = {}  # path -> cid
+        self.api = _Server(self._api_handler())
+        self.gateway = _Server(self._gateway_handler())
+        self.api_url = self.api.url + '/api/v0/'
+        self.gateway_url = self.gateway.url + '/ipfs/'
+
+    def add(self, content, cid_version=0):
+        from EMS.cid import compute_cid
+        cid = compute_cid([content], cid_version=cid_version)
+        self.blocks[cid] = content
+        return cid
+
+    def _api_handler(self):
+        ipfs = self
+
+        class Handler(_Handler):
+            def do_POST(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                body = self.read_body()
+                command = url.path.rsplit('/api/v0/', 1)[-1]
+                if command == 'version':
+                    return self.send(200, {'Version': '0.4.23'})
+                if command == 'add':
+                    boundary = self.headers['Content-Type'].split('boundary=')[1].strip('"').encode()
+                    part = next(part for part in body.split(b'--' + boundary) if b'\r\n\r\n' in part)
+                    headers, content = part.split(b'\r\n\r\n', 1)
+                    name = re.search(rb'filename="([^"]*)"', headers)
+                    cid = ipfs.add(content[:-2], int(query.get('cid-version', ['0'])[0]))
+                    return self.send(200, {'Name': name.group(1).decode() if name else '', 'Hash': cid,
+                                           'Size': str(len(content) - 2)})
+                if command == 'files/cp':
+                    source, dest = query['arg']
+                    ipfs.mfs[dest] = source.rsplit('/', 1)[-1]
+                    return self.send(200, b'', 'text/plain')
+                if command == 'cat':
+                    content = ipfs.blocks.get(query['arg'][0].rsplit('/', 1)[-1])
+                    if content is None:
+                        return self.send(500, {'Message': 'block not found'})
+                    offset = int(query.get('offset', ['0'])[0])
+                    length = int(query['length'][0]) if 'length' in query else len(content)
+                    return self.send(200, content[offset:offset + length], 'application/octet-stream')
+                return self.send(404, {'Message': f'unknown command {command}'})
+
+            do_GET = do_POST
+
+        return Handler
+
+    def _gateway_handler(self):
+        ipfs = self
+
+        class Handler(_Handler):
+            def do_GET(self):
+                content = ipfs.blocks.get(self.path.rsplit('/ipfs/', 1)[-1])
+                if content is None:
+                    return self.send(404, b'not found', 'text/plain')
+                return self.send(200, content, 'application/octet-stream')
+
+        return Handler
+
+    def stop(self):
+        self.api.stop()
+        self.gateway.stop()
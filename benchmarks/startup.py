@@ -0,0 +1,83 @@
+"""Worker startup: time to set up Django and import the EMS URLconf, and `manage.py check` wall time.
+
+Each sample is a fresh interpreter, as for a new gunicorn worker or management command.
+EMS.tests.StartupTests enforces the budgets, the tight ones with EMS_STARTUP_BUDGETS=1;
+--importtime lists the modules that cost the most, from `python -X importtime`.
+
+    python -m benchmarks.startup --runs 10 --importtime 15
+"""
+import argparse, subprocess, sys, time
+
+from benchmarks import BASE_DIR, summarize
+
+# Prints the seconds spent in django.setup() and the URLconf import, then the heavy
+# client libraries that got imported along the way (there should be none).
+IMPORT_SCRIPT = """
+import os, sys, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'clgproject.settings')
+started = time.perf_counter()
+import django
+django.setup()
+import EMS.urls
+print(time.perf_counter() - started)
+print(' '.join(sorted(name for name in %r if name in sys.modules)))
+"""
+# Imported on first use (EMS.web3_client, EMS.ipfs_client), never at startup.
+DEFERRED_MODULES = ('web3', 'eth_abi', 'eth_account', 'eth_utils', 'hexbytes', 'requests', 'ipfshttpclient', 'ipfsapi',
+                    'ipfs_storage', 'aiohttp')
+
+
+def measure_import(extra_args=()):
+    """(seconds in setup and import, deferred modules that were imported anyway) from a fresh interpreter."""
+    result = subprocess.run([sys.executable, *extra_args, '-c', IMPORT_SCRIPT % (DEFERRED_MODULES,)], cwd=BASE_DIR,
+                            capture_output=True, text=True, check=True)
+    seconds, imported = result.stdout.splitlines()[-2:]
+    return float(seconds), imported.split(), result.stderr
+
+
+def measure_check():
+    started = time.perf_counter()
+    subprocess.run([sys.executable, 'manage.py', 'check'], cwd=BASE_DIR, capture_output=True, check=True)
+    return time.perf_counter() - started
+
+
+def importtime(limit):
+    """The `limit` modules with the largest cumulative import time, as (microseconds, module)."""
+    _, _, stderr = measure_import(['-X', 'importtime'])
+    rows = []
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and '|' in line and 'cumulative' not in line:
+            _, cumulative, module = line[len('import time:'):].split('|')
+            rows.append((int(cumulative), module.rstrip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--importtime', type=int, metavar='N', default=0, help="List the N slowest imports.")
+    args = parser.parse_args()
+
+    imports, processes, checks, deferred = [], [], [], set()
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        seconds, imported, _ = measure_import()
+        processes.append(time.perf_counter() - started)
+        imports.append(seconds)
+        deferred.update(imported)
+        checks.append(measure_check())
+
+    for label, samples in (('setup + import', imports), ('worker process', processes), ('manage.py check', checks)):
+        stats = summarize(samples)
+        print(f"{label:>16}: n={stats['count']} mean={stats['mean_ms']:.1f}ms "
+              f"p50={stats['p50_ms']:.1f}ms p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms")
+    print(f"deferred modules imported at startup: {', '.join(sorted(deferred)) or 'none'}")
+
+    if args.importtime:
+        print()
+        for cumulative, module in importtime(args.importtime):
+            print(f"{cumulative / 1000:>9.1f}ms  {module}")
+
+
+if __name__ == '__main__':
+    main()
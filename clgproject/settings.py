@@ -11,7 +11,6 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
-import ipfshttpclient
 
 # import ipfs_storage
 # ipfs_storage.ipfsapi = ipfshttpclient
@@ -23,6 +22,42 @@ BLOCKCHAIN_CONTRACT_ADDRESS = "0x92Ed8A23bcA57222aa02A3111F377fe4488851ce"  # Re
 # BLOCKCHAIN_CONTRACT_ADDRESS = "0x4931F347CBA29d932EB03375d6A1190cB0d08e83"  # Replace with your contract address
 BLOCKCHAIN_ABI_PATH = os.path.join(BASE_DIR, "TrustExaminerBlockchain", "build", "contracts", "PaperStorage.json")
 BLOCKCHAIN_GANACHE_URL = "http://127.0.0.1:7545"
+BLOCKCHAIN_SENDER_ACCOUNT = None  # None uses the node's first account
+# Keep-alive connection pool for JSON-RPC calls (EMS.web3_client).
+BLOCKCHAIN_POOL_SIZE = 10
+BLOCKCHAIN_CONNECT_TIMEOUT = 3  # seconds
+BLOCKCHAIN_REQUEST_TIMEOUT = 30  # seconds
+# Pipelined transaction submission (EMS.tx_submitter).
+BLOCKCHAIN_TX_GAS = 3000000
+BLOCKCHAIN_RECEIPT_POLL_INTERVAL = 0.5  # seconds
+BLOCKCHAIN_RECEIPT_TIMEOUT = 120  # seconds
+# Durable outbox for contract transactions (EMS.outbox). Only one process sends at a time
+# (a database lock guards the account's nonces), so with several web workers the others'
+# in-process workers just wait; set CHAIN_OUTBOX_RUN_IN_PROCESS = False when a separate
+# `manage.py run_chain_outbox --follow` process sends them.
+CHAIN_OUTBOX_RUN_IN_PROCESS = True
+CHAIN_OUTBOX_BATCH_SIZE = 32  # rows sent per round
+CHAIN_OUTBOX_POLL_INTERVAL = 5  # seconds
+CHAIN_OUTBOX_MAX_ATTEMPTS = 10
+CHAIN_OUTBOX_RETRY_DELAY = 5  # seconds, doubled after each failed attempt
+CHAIN_OUTBOX_MAX_RETRY_DELAY = 300  # seconds
+# Event indexer behind the COE transaction history (`manage.py index_chain_events`).
+CHAIN_INDEXER_CHUNK_SIZE = 2000  # blocks per eth_getLogs call
+CHAIN_INDEXER_REORG_DEPTH = 12  # trailing blocks re-scanned on every run
+CHAIN_INDEXER_POLL_INTERVAL = 5  # seconds
+
+# Finalization job queue (EMS.jobs). Set FINALIZATION_RUN_IN_PROCESS = False when a
+# separate `manage.py run_finalization_worker` process drains the queue.
+FINALIZATION_RUN_IN_PROCESS = True
+FINALIZATION_WORKERS = 2
+FINALIZATION_POLL_INTERVAL = 5  # seconds
+# A running job untouched this long lost its worker and is started again, at most
+# FINALIZATION_MAX_ATTEMPTS times in all. Keep it above the slowest single stage.
+FINALIZATION_STALE_AFTER = 600  # seconds
+FINALIZATION_MAX_ATTEMPTS = 3
+# Bulk finalization (EMS.bulk_finalization): IPFS threads and decryption processes.
+BULK_FINALIZATION_IO_WORKERS = 8
+BULK_FINALIZATION_CPU_WORKERS = None  # None uses os.cpu_count()
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/2.2/howto/deployment/checklist/
@@ -34,6 +69,12 @@ ENCRYPT_KEY = b'AiMCduXlQ0S5gLbqfL07ExVnIvGCHBVgHO3Tlj-m8JY='
 
 IPFS_STORAGE_API_URL = 'http://localhost:5001/api/v0/'
 IPFS_STORAGE_GATEWAY_URL = 'http://localhost:8080/ipfs/'
+# Shared IPFS API client (EMS.ipfs_client).
+IPFS_POOL_SIZE = 10
+IPFS_CONNECT_TIMEOUT = 3  # seconds
+IPFS_REQUEST_TIMEOUT = 120  # seconds without data before a call fails
+IPFS_CHUNK_SIZE = 256 * 1024  # bytes per streamed read/write
+IPFS_CID_VERSION = 0  # must match what EMS.cid computes at upload; 1 implies raw leaves
 
 
 # SECURITY WARNING: don't run with debug turned on in production!
@@ -62,6 +103,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'EMS.profiling.RequestProfilingMiddleware',
 ]
 
 AUTH_USER_MODEL = 'EMS.CustomUser'
@@ -151,3 +193,72 @@ STATICFILES_DIRS=[
 STATIC_ROOT = os.path.join(BASE_DIR, "static_cdn")
 MEDIA_ROOT= os.path.join(BASE_DIR, 'media/')
 ENCRYPTION_ROOT= os.path.join(BASE_DIR, 'static/encrypted_files')
+# Uploads and final papers are stored once per content under MEDIA_ROOT/BLOB_STORE_DIR,
+# sharded by SHA-256 (EMS.blobstore). `manage.py migrate_blobs` moves older flat files in.
+STORAGES = {
+    "default": {"BACKEND": "EMS.blobstore.ContentAddressedStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+BLOB_STORE_DIR = 'blobs'
+BLOB_STORE_SHARD_DEPTH = 2  # directory levels of two hex digits each
+# Superintendent dashboard: papers become downloadable this long before the exam.
+PAPER_DOWNLOAD_WINDOW_MINUTES = 20
+ST_DASHBOARD_LOOKBACK_HOURS = 24  # keep papers listed this long after their exam
+ST_DASHBOARD_PAGE_SIZE = 25
+# Signed download links issued after a paper is claimed (EMS.downloads).
+PAPER_DOWNLOAD_TOKEN_TTL = 300  # seconds
+# Set to an nginx `internal` location that aliases MEDIA_ROOT (e.g. '/protected-media/')
+# to let nginx send the file via X-Accel-Redirect instead of a Django worker.
+PAPER_DOWNLOAD_ACCEL_REDIRECT = None
+# Exam-window pre-staging (EMS.prestaging): papers are read into the page cache, or
+# copied into PAPER_STAGING_ROOT, and dashboard rows computed before each window opens.
+# With PRESTAGE_RUN_IN_PROCESS the scheduler starts with each serving process (runserver or
+# the WSGI server); otherwise run `manage.py prestage_papers --follow`. With several
+# processes PRESTAGE_CACHE should name a shared cache (Redis, memcached).
+PRESTAGE_RUN_IN_PROCESS = True
+PRESTAGE_INTERVAL = 60  # seconds between scheduler runs
+PRESTAGE_LEAD_MINUTES = 10  # how long before the download window papers are staged
+PRESTAGE_KEEP_MINUTES = 60  # staged copies are kept this long after the exam
+PRESTAGE_DASHBOARD_PAGES = 3
+PRESTAGE_DASHBOARD_TTL = 60  # seconds a computed dashboard page is reused
+PRESTAGE_CACHE = 'default'
+PAPER_STAGING_ROOT = None  # e.g. a tmpfs directory; None only warms the page cache
+# In-process cache of subject codes and teachers with active requests (EMS.refcache),
+# invalidated by Request/SubjectCode signals. Name a cache alias in REFERENCE_CACHE_SHARED
+# (e.g. a file-based or local memcached one) to share it between processes.
+REFERENCE_CACHE_MAX_ENTRIES = 1024
+REFERENCE_CACHE_TTL = 300  # seconds
+REFERENCE_CACHE_SHARED = None
+COE_HISTORY_PAGE_SIZE = 50  # rows per page of the COE request history
+# Resumable paper uploads (EMS.uploads). Chunks are kept outside MEDIA_ROOT and static
+# files until the upload is completed and encrypted.
+UPLOAD_STAGING_ROOT = os.path.join(BASE_DIR, 'upload_staging')
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024  # largest chunk a PUT may carry; the client uses this size
+UPLOAD_MAX_SIZE = 200 * 1024 * 1024
+UPLOAD_SESSION_TTL_HOURS = 48  # unfinished sessions and their chunks are removed after this
+# Plaintext bytes per authenticated segment of the paper stream format (EMS.encryption).
+ENCRYPTION_CHUNK_SIZE = 64 * 1024
+# Pre-generated RSA keys kept ready for teacher uploads (EMS.keypool). 0 disables the pool.
+RSA_KEY_POOL_SIZE = 8
+# Stage timings and counters served on /metrics (EMS.metrics). With several worker
+# processes set METRICS_DIR to a directory they share, emptied when the server starts.
+METRICS_ENABLED = True
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 5  # seconds between writes of a process's totals to METRICS_DIR
+METRICS_TOKEN = None  # bearer token for the scraper; without it only a logged-in COE can read /metrics
+# Fraction of stage timings and claim/upload events logged as JSON lines to EMS.trace.
+METRICS_TRACE_SAMPLE_RATE = 0.0
+# Per-view query, SQL, chain and IPFS accounting (EMS.profiling), plus stack-sampled
+# profiles of a REQUEST_PROFILE_RATE fraction of requests and of every request slower
+# than REQUEST_PROFILE_SLOW_MS (None: none). Summarise with `manage.py profile_summary`.
+REQUEST_PROFILE_RATE = 0.0
+REQUEST_PROFILE_SLOW_MS = None  # while set, every request is sampled to find the slow ones
+REQUEST_PROFILE_INTERVAL_MS = 5
+REQUEST_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+REQUEST_PROFILE_MAX_FILES = 500  # oldest profiles are removed beyond this
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {'EMS.trace': {'handlers': ['console'], 'level': 'INFO', 'propagate': False}},
+}
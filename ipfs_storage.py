@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+
+# Takes the place of the django-ipfs-storage package, which only
+# EMS/migrations/0001_initial.py still names (for Request.paper, removed in 0014). That
+# package imports the deprecated ipfsapi and connects to the IPFS daemon as soon as the
+# storage is created, so merely loading migrations (migrate, test) needed a running
+# daemon. This storage is created without side effects and reads through EMS.ipfs_client.
+
+
+@deconstructible
+class InterPlanetaryFileSystemStorage(Storage):
+    """Read-only IPFS storage: names are CIDs."""
+
+    def __init__(self, api_url=None, gateway_url=None):
+        self.gateway_url = gateway_url or settings.IPFS_STORAGE_GATEWAY_URL
+
+    def _open(self, name, mode='rb'):
+        from EMS.ipfs_client import get_ipfs
+        return ContentFile(b''.join(get_ipfs().cat(name)), name=name)
+
+    def url(self, name):
+        return self.gateway_url + name
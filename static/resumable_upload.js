@@ -0,0 +1,141 @@
+// Resumable paper upload for the teacher page (server side: EMS/uploads.py).
+// The file is sent in chunks by byte offset, several at a time; a chunk that fails is
+// retried with backoff while the others carry on. The session id is kept in
+// localStorage, so choosing the same file again after a dropped connection or a
+// reload only sends what the server does not have yet.
+(function (window) {
+  'use strict';
+
+  function sleep(ms) {
+    return new Promise(function (resolve) { setTimeout(resolve, ms); });
+  }
+
+  function UploadFailed(message, status) {
+    this.message = message;
+    this.status = status;
+  }
+
+  function ResumableUpload(options) {
+    this.file = options.file;
+    this.reqId = options.reqId;
+    this.createUrl = options.createUrl;
+    this.csrfToken = options.csrfToken;
+    this.parallel = options.parallel || 3;
+    this.maxRetries = options.maxRetries || 6;
+    this.onProgress = options.onProgress || function () {};
+    this.storageKey = ['upload', this.reqId, this.file.name, this.file.size, this.file.lastModified].join(':');
+  }
+
+  ResumableUpload.prototype.request = async function (method, url, body) {
+    var response = await fetch(url, {
+      method: method,
+      body: body,
+      credentials: 'same-origin',
+      headers: {'X-CSRFToken': this.csrfToken, 'X-Requested-With': 'XMLHttpRequest'}
+    });
+    var data = await response.json().catch(function () { return {}; });
+    if (!response.ok) {
+      throw new UploadFailed(data.error || ('Upload failed with status ' + response.status), response.status);
+    }
+    return data;
+  };
+
+  ResumableUpload.prototype.sha256 = async function () {
+    // Lets the server reject a paper that arrived corrupted; needs a secure context.
+    if (!window.crypto || !window.crypto.subtle) {
+      return '';
+    }
+    var digest = await window.crypto.subtle.digest('SHA-256', await this.file.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map(function (b) { return b.toString(16).padStart(2, '0'); }).join('');
+  };
+
+  ResumableUpload.prototype.session = async function () {
+    var saved = window.localStorage.getItem(this.storageKey);
+    if (saved) {
+      try {
+        var state = await this.request('GET', saved);
+        if (state.status === 'Open' && state.size === this.file.size) {
+          return state;
+        }
+      } catch (e) {
+        // Expired or completed elsewhere: start over.
+      }
+    }
+    var form = new FormData();
+    form.append('req_id', this.reqId);
+    form.append('filename', this.file.name);
+    form.append('size', this.file.size);
+    form.append('sha256', await this.sha256());
+    state = await this.request('POST', this.createUrl, form);
+    window.localStorage.setItem(this.storageKey, state.url);
+    return state;
+  };
+
+  ResumableUpload.prototype.missingChunks = function (state) {
+    var chunks = [];
+    for (var start = 0; start < state.size; start += state.chunk_size) {
+      var end = Math.min(start + state.chunk_size, state.size);
+      var have = state.received.some(function (range) { return range[0] <= start && end <= range[1]; });
+      if (!have) {
+        chunks.push([start, end]);
+      }
+    }
+    return chunks;
+  };
+
+  ResumableUpload.prototype.sendChunk = async function (url, chunk) {
+    for (var attempt = 0; ; attempt++) {
+      try {
+        return await this.request('PUT', url + '?offset=' + chunk[0], this.file.slice(chunk[0], chunk[1]));
+      } catch (e) {
+        var retriable = !e.status || e.status >= 500 || e.status === 408 || e.status === 429;
+        if (!retriable || attempt >= this.maxRetries) {
+          throw e;
+        }
+        await sleep(Math.min(1000 * Math.pow(2, attempt), 30000));
+      }
+    }
+  };
+
+  ResumableUpload.prototype.sendAll = async function (state) {
+    var self = this;
+    var queue = this.missingChunks(state);
+    var done = state.size - queue.reduce(function (sum, chunk) { return sum + chunk[1] - chunk[0]; }, 0);
+    self.onProgress(done, state.size);
+
+    async function worker() {
+      while (queue.length) {
+        var chunk = queue.shift();
+        await self.sendChunk(state.url, chunk);
+        done += chunk[1] - chunk[0];
+        self.onProgress(done, state.size);
+      }
+    }
+    var workers = [];
+    for (var i = 0; i < this.parallel; i++) {
+      workers.push(worker());
+    }
+    await Promise.all(workers);
+  };
+
+  ResumableUpload.prototype.start = async function () {
+    var state = await this.session();
+    for (var round = 0; ; round++) {
+      await this.sendAll(state);
+      try {
+        var result = await this.request('POST', state.url + '/complete');
+        window.localStorage.removeItem(this.storageKey);
+        return result;
+      } catch (e) {
+        // 409: bytes are missing; 422: the checksum did not match and the server dropped
+        // them. Either way, send what it asks for once more.
+        if ((e.status !== 409 && e.status !== 422) || round >= 1) {
+          throw e;
+        }
+        state = await this.request('GET', state.url);
+      }
+    }
+  };
+
+  window.ResumableUpload = ResumableUpload;
+})(window);